@@ -0,0 +1,119 @@
+"""
+Micro-benchmark del traductor DICOM JSON: datasets por segundo con la implementación
+anterior (recorrido genérico con str() por valor) y con la actual (tablas por VR,
+números como números, includefield y backend JSON rápido si está instalado).
+
+Uso (desde el directorio 'dicomproxy'):
+    python -m benchmarks.bench_dicomweb_translator --datasets 20000 --repeat 5
+"""
+import argparse
+import io
+import json
+import time
+from pynetdicom.dsutils import decode, encode
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from pydicom.uid import generate_uid
+
+from implementation.dicom_services import dicomweb_translator, qido
+
+
+# --- Implementación anterior, copiada tal cual como referencia ---
+def _legacy_format_value(elem):
+    if elem.VR == 'PN':
+        return [{"Alphabetic": str(name)} for name in elem.value] if isinstance(elem.value, list) else [{"Alphabetic": str(elem.value)}]
+    elif isinstance(elem.value, list):
+        return elem.value
+    elif elem.value is None:
+        return []
+    else:
+        return [str(elem.value)]
+
+
+def _legacy_dataset_to_dicomweb_dict(ds: Dataset) -> dict:
+    dicomweb_dict = {}
+    for elem in ds:
+        tag_str = f"{elem.tag.group:04X}{elem.tag.element:04X}"
+        if elem.VR == 'SQ':
+            value = [_legacy_dataset_to_dicomweb_dict(item) for item in elem.value]
+        else:
+            value = _legacy_format_value(elem)
+        dicomweb_dict[tag_str] = {"vr": elem.VR, "Value": value}
+    return dicomweb_dict
+
+
+def legacy_json_bytes(ds: Dataset) -> bytes:
+    return json.dumps(_legacy_dataset_to_dicomweb_dict(ds), default=str, ensure_ascii=False).encode("utf-8")
+
+
+def make_study_result(number: int) -> Dataset:
+    """Respuesta C-FIND de nivel STUDY típica, con algunos atributos adicionales."""
+    ds = Dataset()
+    ds.QueryRetrieveLevel = "STUDY"
+    ds.SpecificCharacterSet = "ISO_IR 100"
+    ds.StudyDate = "20240115"
+    ds.StudyTime = "101500"
+    ds.AccessionNumber = f"ACC{number:08d}"
+    ds.ModalitiesInStudy = ["CT", "SR"]
+    ds.ReferringPhysicianName = "GARCIA^ANA"
+    ds.PatientName = "PEREZ^JUAN^^^"
+    ds.PatientID = f"P{number:07d}"
+    ds.PatientBirthDate = "19700101"
+    ds.PatientSex = "M"
+    ds.StudyInstanceUID = generate_uid()
+    ds.StudyID = str(number)
+    ds.StudyDescription = "TC TORAX CON CONTRASTE"
+    ds.NumberOfStudyRelatedSeries = 4
+    ds.NumberOfStudyRelatedInstances = 512
+    ds.PatientWeight = "72.5"
+    ds.InstitutionName = "HOSPITAL GENERAL"
+    item = Dataset()
+    item.CodeValue = "CTCHEST"
+    item.CodingSchemeDesignator = "LOCAL"
+    item.CodeMeaning = "TC de tórax"
+    ds.ProcedureCodeSequence = Sequence([item])
+    return ds
+
+
+def _rate(function, encoded, repeat: int) -> float:
+    """
+    Los datasets se decodifican igual que una respuesta C-FIND recibida (elementos
+    aún sin convertir) antes de cada pasada; solo se mide la traducción.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        datasets = [decode(io.BytesIO(data), True, True) for data in encoded]
+        start = time.perf_counter()
+        for ds in datasets:
+            function(ds)
+        best = min(best, time.perf_counter() - start)
+    return len(encoded) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Datasets por segundo del traductor DICOM JSON, antes y después.")
+    parser.add_argument("--datasets", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    encoded = [encode(make_study_result(number), True, True) for number in range(args.datasets)]
+    identifier = qido.build_qido_identifier("STUDY", [])
+    include = qido.response_tags(identifier, [])
+
+    results = {
+        "datasets": args.datasets,
+        "json_backend": "orjson" if dicomweb_translator.orjson is not None else "json",
+        "datasets_per_second": {
+            "legacy": _rate(legacy_json_bytes, encoded, args.repeat),
+            "current": _rate(dicomweb_translator.dataset_to_dicomweb_json_bytes, encoded, args.repeat),
+            "current_includefield": _rate(lambda ds: dicomweb_translator.dataset_to_dicomweb_json_bytes(ds, include),
+                                          encoded, args.repeat),
+        },
+    }
+    rates = results["datasets_per_second"]
+    results["speedup"] = round(rates["current"] / rates["legacy"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: rendimiento de recuperación C-MOVE frente a C-GET contra un PACS de prueba local.
+
+Uso (desde el directorio 'dicomproxy'):
+    python -m benchmarks.bench_retrieval_strategies --studies 4 --instances 50 --rows 256 --concurrency 4
+
+Cada ronda recupera en paralelo 'concurrency' estudios distintos con cada modo y mide
+instancias/s y MB/s hasta que el consumidor ha recibido la última instancia. Base de
+datos, spool y caché de instancias se crean en un directorio temporal, así que la caché
+local nunca sirve nada: se mide solo el camino DIMSE. El resultado se imprime en JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# El entorno temporal debe existir antes de importar la configuración del proxy
+_workdir = tempfile.mkdtemp(prefix="dicomproxy-bench-")
+os.environ.setdefault("SPOOL_DIR", os.path.join(_workdir, "spool"))
+os.environ.setdefault("INSTANCE_STORE_DIR", os.path.join(_workdir, "instance_store"))
+os.environ.setdefault("INSTANCE_STORE_MAX_BYTES", str(100 * 1024 ** 3))
+
+from loguru import logger
+
+from implementation import database
+from implementation.dicom_services import retrieval
+from implementation.dicom_services.dimse_scp import storage_scp
+from benchmarks.stand_in_pacs import StandInPACS, make_study
+
+
+async def _retrieve_study(pacs_config: dict, study_uid: str):
+    count, size = 0, 0
+    async for instance in retrieval._remote_instances(pacs_config, study_uid):
+        count += 1
+        size += instance.size
+        instance.release()
+    return count, size
+
+
+async def _round(pacs_config: dict, study_uids) -> dict:
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_retrieve_study(pacs_config, uid) for uid in study_uids))
+    elapsed = time.perf_counter() - start
+    instances = sum(count for count, _ in results)
+    size = sum(nbytes for _, nbytes in results)
+    return {"seconds": elapsed, "instances": instances, "bytes": size}
+
+
+async def run(args) -> dict:
+    storage_scp.start(args.proxy_aet, args.scp_port)
+    pacs = StandInPACS(args.pacs_port, move_destination=("127.0.0.1", args.scp_port), latency=args.latency).start()
+    studies = []
+    for _ in range(args.studies):
+        study = make_study(args.instances, rows=args.rows)
+        pacs.add(study)
+        studies.append(study[0].StudyInstanceUID)
+
+    report = {"parameters": vars(args), "strategies": {}}
+    try:
+        for strategy in ("C-MOVE", "C-GET"):
+            pacs_config = pacs.config(strategy)
+            await _round(pacs_config, studies[:1])  # calentamiento: asociaciones del pool
+            rounds = []
+            for _ in range(args.rounds):
+                for first in range(0, len(studies), args.concurrency):
+                    rounds.append(await _round(pacs_config, studies[first:first + args.concurrency]))
+            per_second = [r["instances"] / r["seconds"] for r in rounds]
+            mb_per_second = [r["bytes"] / r["seconds"] / 1e6 for r in rounds]
+            report["strategies"][strategy] = {
+                "rounds": len(rounds),
+                "instances": sum(r["instances"] for r in rounds),
+                "instances_per_second_median": statistics.median(per_second),
+                "mb_per_second_median": statistics.median(mb_per_second),
+                "seconds_per_round_median": statistics.median(r["seconds"] for r in rounds),
+            }
+    finally:
+        pacs.stop()
+        storage_scp.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el rendimiento de C-MOVE y C-GET contra un PACS local.")
+    parser.add_argument("--studies", type=int, default=4)
+    parser.add_argument("--instances", type=int, default=50, help="instancias por estudio")
+    parser.add_argument("--rows", type=int, default=256, help="filas/columnas de cada imagen")
+    parser.add_argument("--concurrency", type=int, default=4, help="recuperaciones simultáneas por ronda")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="retardo del PACS por instancia (s)")
+    parser.add_argument("--pacs-port", type=int, default=11113)
+    parser.add_argument("--scp-port", type=int, default=11114)
+    parser.add_argument("--proxy-aet", default="BENCHPROXY")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+    database.DATABASE_FILE = os.path.join(_workdir, "bench.db")
+    database.initialize_database()
+
+    try:
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+    finally:
+        shutil.rmtree(_workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Banco de pruebas del proxy completo contra PACS de prueba locales.
+
+Arranca uno o varios PACS de prueba (SCP Query/Retrieve de pynetdicom en este mismo
+proceso) con estudios sintéticos de tamaño y latencia configurables, y el Storage SCP
+del proxy. Después ejecuta cada escenario con la concurrencia indicada:
+
+    find        búsqueda federada 'query_engine.stream_query' en todos los PACS
+    retrieve    recuperación de un estudio (C-MOVE o C-GET) por el camino del Storage SCP
+    translator  'pydicom_to_dicomweb_json' sobre lotes de respuestas C-FIND
+    logs        página del visor de logs ('admin_view_logs') sobre un log sintético
+
+Por escenario se informa del rendimiento (operaciones y unidades por segundo), la
+latencia por operación (p50/p95/p99) y el pico de memoria residente del proceso hasta
+ese momento (acumulado: para aislar un escenario, ejecutarlo solo con --scenarios).
+El resultado es JSON e incluye el commit, para comparar ejecuciones entre versiones.
+
+Uso (desde el directorio 'dicomproxy'):
+    python -m benchmarks.bench_suite --pacs 2 --studies 8 --instances 20 --concurrency 8 --output actual.json
+    python -m benchmarks.bench_suite --compare anterior.json actual.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+# El entorno temporal debe existir antes de importar la configuración del proxy
+_workdir = tempfile.mkdtemp(prefix="dicomproxy-bench-")
+os.environ.setdefault("SPOOL_DIR", os.path.join(_workdir, "spool"))
+os.environ.setdefault("INSTANCE_STORE_DIR", os.path.join(_workdir, "instance_store"))
+os.environ.setdefault("INSTANCE_STORE_MAX_BYTES", str(100 * 1024 ** 3))
+os.environ.setdefault("LOGS_DIR", os.path.join(_workdir, "logs"))
+os.environ.setdefault("LOG_INDEX_DB", os.path.join(_workdir, "logs", "log_index.db"))
+os.environ.setdefault("TRACE_EXPORT_FILE", os.path.join(_workdir, "logs", "traces.otlp.jsonl"))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from loguru import logger
+from pynetdicom.dsutils import decode, encode
+
+from implementation import crud, database
+from implementation.config.logging_config import LOGS_DIR
+from implementation.dicom_services import dimse_scu, retrieval
+from implementation.dicom_services.association_pool import association_pool
+from implementation.dicom_services.dicomweb_translator import pydicom_to_dicomweb_json
+from implementation.dicom_services.dimse_scp import storage_scp
+from implementation.dicom_services.query_engine import query_engine
+from implementation.web import security
+from benchmarks.bench_dicomweb_translator import make_study_result
+from benchmarks.stand_in_pacs import StandInPACS, make_study
+
+# La salida estándar queda solo para el JSON: la consola del logging del proxy va a stderr
+with contextlib.redirect_stdout(sys.stderr):
+    from implementation.main import app
+
+SCENARIOS = ("find", "retrieve", "translator", "logs")
+SYNTHETIC_LOG = "DicomProxy_20240115_1.log"
+
+
+# --- Medición ---
+def _percentile(samples: list, p: float) -> float:
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso (None si la plataforma no lo ofrece)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB y macOS en bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def drive(operation, total: int, concurrency: int, unit: str) -> dict:
+    """
+    Ejecuta 'operation' (corrutina que devuelve las unidades procesadas) 'total' veces
+    con 'concurrency' operaciones simultáneas y resume rendimiento y latencias.
+    """
+    latencies, units, errors = [], 0, []
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal units
+        while next(counter) < total:
+            start = time.perf_counter()
+            try:
+                count = await operation()
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+                continue
+            latencies.append(time.perf_counter() - start)
+            units += count
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    result = {
+        "operations": len(latencies), "errors": len(errors), "concurrency": concurrency, "seconds": round(elapsed, 4),
+        "operations_per_second": round(len(latencies) / elapsed, 2), "unit": unit, "units": units,
+        "units_per_second": round(units / elapsed, 2),
+        "latency_ms": {name: round(_percentile(latencies, p) * 1000, 2) for name, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))} if latencies else {},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if latencies:
+        result["latency_ms"]["max"] = round(latencies[-1] * 1000, 2)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+# --- Escenarios ---
+class Bench:
+    """Entorno del banco de pruebas: PACS de prueba, estudios y pool de hilos del tamaño de la concurrencia."""
+
+    def __init__(self, args):
+        self.args = args
+        self.pacs = []
+        self.studies = []  # (pacs_config, StudyInstanceUID)
+        self.executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bench")
+
+    def start(self):
+        args = self.args
+        storage_scp.start(args.proxy_aet, args.scp_port)
+        for number in range(args.pacs):
+            pacs = StandInPACS(args.pacs_port + number, f"BENCHPACS{number + 1}",
+                               move_destination=("127.0.0.1", args.scp_port), latency=args.latency).start()
+            crud.add_pacs_config(f"PACS de prueba {number + 1}", pacs.ae_title, "127.0.0.1", pacs.port, args.strategy)
+            for _ in range(args.studies):
+                study = make_study(args.instances, rows=args.rows)
+                pacs.add(study)
+                self.studies.append((pacs.ae_title, study[0].StudyInstanceUID))
+            self.pacs.append(pacs)
+        for config in crud.get_all_pacs():
+            if not config['is_active']:
+                crud.toggle_pacs_active(config['id'])
+        configs = {config['aetitle']: config for config in crud.get_all_pacs()}
+        self.studies = [(configs[aet], uid) for aet, uid in self.studies]
+
+    def stop(self):
+        association_pool.close_all()
+        dimse_scu.get_association_pool.close_all()
+        for pacs in self.pacs:
+            pacs.stop()
+        storage_scp.stop()
+        self.executor.shutdown(wait=False)
+
+    def _in_thread(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def find(self) -> int:
+        # Sin la caché de consultas: cada operación llega a los PACS
+        identifier = dimse_scu.build_find_identifier({})
+        return len([result async for result in query_engine.stream_query(identifier)])
+
+    def retrieve_operation(self):
+        studies = itertools.cycle(self.studies)
+
+        async def retrieve() -> int:
+            pacs_config, study_uid = next(studies)
+            count = 0
+            # Directamente del PACS: la caché local de instancias no interviene
+            async for instance in retrieval._remote_instances(pacs_config, study_uid):
+                count += 1
+                instance.release()
+            return count
+        return retrieve
+
+    def translator_operation(self, total: int):
+        """
+        Cada operación traduce un lote recién decodificado (elementos sin convertir,
+        como una respuesta C-FIND recibida); la decodificación se hace antes de medir.
+        """
+        encoded = [encode(make_study_result(number), True, True) for number in range(self.args.batch)]
+        batches = iter([[decode(io.BytesIO(data), True, True) for data in encoded] for _ in range(total + 1)])
+
+        async def translate() -> int:
+            return len(await self._in_thread(pydicom_to_dicomweb_json, next(batches)))
+        return translate
+
+    def logs_operation(self):
+        """Páginas del visor sin filtro, por nivel y por texto, pedidas a la aplicación ASGI con sesión iniciada."""
+        write_synthetic_log(LOGS_DIR / SYNTHETIC_LOG, self.args.log_lines)
+        cookie = f"access_token={security.create_access_token(data={'sub': 'bench'})}".encode()
+        queries = itertools.cycle([{"file": SYNTHETIC_LOG}, {"file": SYNTHETIC_LOG, "level": "ERROR"},
+                                   {"file": SYNTHETIC_LOG, "search": "Message ID 4242"}])
+
+        async def view_logs() -> int:
+            status, size = await asgi_get(app, "/admin/dashboard/logs", next(queries), cookie)
+            if status != 200:
+                raise RuntimeError(f"HTTP {status}")
+            return size
+        return view_logs
+
+
+def write_synthetic_log(path, lines: int):
+    """Log con el formato del proxy: mayoría de INFO/DEBUG y algún WARNING/ERROR."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    levels = ["INFO", "DEBUG", "INFO", "SUCCESS", "DEBUG", "INFO", "WARNING", "INFO", "DEBUG", "ERROR"]
+    with open(path, "w", encoding="utf-8") as f:
+        for number in range(lines):
+            second = number // 50
+            f.write(f"2024-01-15 {second // 3600 % 24:02d}:{second // 60 % 60:02d}:{second % 60:02d}.{number % 1000:03d} | "
+                    f"{levels[number % len(levels)]: <8} | implementation.dicom_services.dimse_scp:handle_store:185 - "
+                    f"Instancia 1.2.826.0.1.3680043.8.498.{number} entregada a la recuperación con Message ID {number % 5000}.\n")
+
+
+async def asgi_get(app, path: str, query: dict, cookie: bytes):
+    """Petición GET directa a la aplicación ASGI (sin servidor HTTP); devuelve (estado, bytes del cuerpo)."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": urlencode(query).encode(), "root_path": "",
+             "headers": [(b"host", b"bench"), (b"cookie", cookie)], "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+    status, size = None, 0
+    request_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status, size
+
+
+async def run(args) -> dict:
+    bench = Bench(args)
+    bench.start()
+    report = {
+        "commit": _git_commit(), "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(), "parameters": vars(args), "scenarios": {},
+    }
+    try:
+        for name in args.scenarios:
+            if name == "find":
+                operation, unit = bench.find, "results"
+            elif name == "retrieve":
+                operation, unit = bench.retrieve_operation(), "instances"
+            elif name == "translator":
+                operation, unit = bench.translator_operation(args.operations + args.warmup), "datasets"
+            else:
+                operation, unit = bench.logs_operation(), "bytes"
+            try:
+                for _ in range(args.warmup):  # asociaciones del pool, plantillas, etc.
+                    await operation()
+            except Exception as e:
+                logger.error(f"Escenario '{name}' omitido: falló el calentamiento ({e})")
+                report["scenarios"][name] = {"error": str(e) or type(e).__name__}
+                continue
+            report["scenarios"][name] = await drive(operation, args.operations, args.concurrency, unit)
+            logger.warning(f"Escenario '{name}' terminado: {report['scenarios'][name]['operations_per_second']} op/s")
+    finally:
+        bench.stop()
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+# --- Comparación de resultados ---
+def compare(baseline: dict, current: dict) -> dict:
+    """Cambio relativo (actual / anterior) de rendimiento, latencias y memoria por escenario."""
+    def ratio(new, old):
+        return round(new / old, 3) if new is not None and old else None
+
+    scenarios = {}
+    for name, new in current["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        scenarios[name] = {
+            "operations_per_second": ratio(new["operations_per_second"], old["operations_per_second"]),
+            "units_per_second": ratio(new["units_per_second"], old["units_per_second"]),
+            **{f"latency_{p}": ratio(new["latency_ms"].get(p), old["latency_ms"].get(p)) for p in ("p50", "p95", "p99")},
+            "peak_rss_mb": ratio(new["peak_rss_mb"], old["peak_rss_mb"]),
+            "errors": [old["errors"], new["errors"]],
+        }
+    return {"baseline": baseline.get("commit"), "current": current.get("commit"), "ratios": scenarios}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de pruebas del proxy contra PACS de prueba locales (resultado en JSON).")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--pacs", type=int, default=2, help="número de PACS de prueba")
+    parser.add_argument("--studies", type=int, default=8, help="estudios por PACS")
+    parser.add_argument("--instances", type=int, default=20, help="instancias por estudio")
+    parser.add_argument("--rows", type=int, default=256, help="filas/columnas de cada imagen")
+    parser.add_argument("--latency", type=float, default=0.0, help="retardo del PACS por respuesta o instancia (s)")
+    parser.add_argument("--strategy", choices=dimse_scu.RETRIEVAL_STRATEGIES, default="C-MOVE")
+    parser.add_argument("--concurrency", type=int, default=8, help="operaciones simultáneas")
+    parser.add_argument("--operations", type=int, default=100, help="operaciones medidas por escenario")
+    parser.add_argument("--warmup", type=int, default=2, help="operaciones previas sin medir")
+    parser.add_argument("--batch", type=int, default=100, help="datasets por operación del traductor")
+    parser.add_argument("--log-lines", type=int, default=200000, help="líneas del log sintético")
+    parser.add_argument("--pacs-port", type=int, default=11213, help="puerto del primer PACS (los demás, consecutivos)")
+    parser.add_argument("--scp-port", type=int, default=11212)
+    parser.add_argument("--proxy-aet", default="BENCHPROXY")
+    parser.add_argument("--output", help="archivo donde guardar el JSON (además de imprimirlo)")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTERIOR", "ACTUAL"), help="compara dos resultados guardados y termina")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        if args.compare:
+            with open(args.compare[0], encoding="utf-8") as old, open(args.compare[1], encoding="utf-8") as new:
+                print(json.dumps(compare(json.load(old), json.load(new)), indent=2))
+            return
+
+        if not args.verbose:
+            logger.remove()
+            logger.add(sys.stderr, level="WARNING")
+        database.DATABASE_FILE = os.path.join(_workdir, "bench.db")
+        database.initialize_database()
+        crud.reload_config()
+
+        params = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")}
+        report = asyncio.run(run(argparse.Namespace(**params)))
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+        print(output)
+    finally:
+        shutil.rmtree(_workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
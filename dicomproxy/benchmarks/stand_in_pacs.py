@@ -0,0 +1,144 @@
+"""
+PACS de prueba local (Query/Retrieve SCP) para los benchmarks.
+Sirve estudios sintéticos desde memoria y responde a C-ECHO, C-FIND,
+C-MOVE y C-GET sin depender de ningún PACS real.
+"""
+import time
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian, CTImageStorage
+from pynetdicom import AE, evt, StoragePresentationContexts
+from pynetdicom.sop_class import (
+    StudyRootQueryRetrieveInformationModelFind,
+    StudyRootQueryRetrieveInformationModelMove,
+    StudyRootQueryRetrieveInformationModelGet,
+    Verification,
+)
+
+
+def make_study(instances: int, rows: int = 256, frames: int = 1, study_uid: str = None, series_uid: str = None) -> list:
+    """Genera un estudio CT sintético de una serie con 'instances' imágenes de 16 bits."""
+    study_uid = study_uid or generate_uid()
+    series_uid = series_uid or generate_uid()
+    shape = (frames, rows, rows) if frames > 1 else (rows, rows)
+    pixels = (np.arange(rows * rows * frames, dtype=np.uint16) % 4096).reshape(shape).tobytes()
+    study = []
+    for number in range(1, instances + 1):
+        ds = Dataset()
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = generate_uid()
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.PatientName = "BENCH^PACIENTE"
+        ds.PatientID = "BENCH001"
+        ds.StudyDate = "20240101"
+        ds.Modality = "CT"
+        ds.InstanceNumber = number
+        ds.Rows = ds.Columns = rows
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+        ds.WindowCenter, ds.WindowWidth = 40, 400
+        if frames > 1:
+            ds.NumberOfFrames = frames
+        ds.PixelData = pixels
+        study.append(ds)
+    return study
+
+
+class StandInPACS:
+    """
+    Q/R SCP en 127.0.0.1. Los C-MOVE se envían a 'move_destination' (host, puerto)
+    sea cual sea el AET destino; 'latency' añade un retardo por respuesta para
+    simular un PACS lento.
+    """
+
+    def __init__(self, port: int, ae_title: str = "BENCHPACS", move_destination=None, latency: float = 0.0):
+        self.port = port
+        self.ae_title = ae_title
+        self.move_destination = move_destination
+        self.latency = latency
+        self.instances: list = []
+        self._server = None
+
+    def add(self, instances):
+        self.instances.extend(instances)
+
+    def config(self, strategy: str = "C-MOVE", pacs_id: int = 1) -> dict:
+        """Fila de 'pacs_configs' equivalente, para pasarla a las funciones DIMSE del proxy."""
+        return {"id": pacs_id, "aetitle": self.ae_title, "ip_address": "127.0.0.1", "port": self.port,
+                "description": f"PACS de prueba {self.ae_title}", "is_active": 1, "retrieval_strategy": strategy}
+
+    def _match(self, identifier) -> list:
+        matches = self.instances
+        for keyword in ("StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "PatientID"):
+            value = identifier.get(keyword)
+            if not value:
+                continue
+            wanted = {value} if isinstance(value, str) else set(value)
+            matches = [ds for ds in matches if ds.get(keyword) in wanted]
+        return matches
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _handle_find(self, event):
+        identifier = event.identifier
+        level = identifier.get("QueryRetrieveLevel", "STUDY")
+        keys = {"STUDY": "StudyInstanceUID", "SERIES": "SeriesInstanceUID"}.get(level, "SOPInstanceUID")
+        seen = set()
+        for ds in self._match(identifier):
+            if event.is_cancelled:
+                yield 0xFE00, None
+                return
+            if ds.get(keys) in seen:
+                continue
+            seen.add(ds.get(keys))
+            response = Dataset()
+            response.QueryRetrieveLevel = level
+            for element in identifier:
+                if element.keyword and element.keyword != "QueryRetrieveLevel":
+                    setattr(response, element.keyword, ds.get(element.keyword, element.value))
+            self._delay()
+            yield 0xFF00, response
+
+    def _handle_move(self, event):
+        matches = self._match(event.identifier)
+        yield self.move_destination
+        yield len(matches)
+        for ds in matches:
+            self._delay()
+            yield 0xFF00, ds
+
+    def _handle_get(self, event):
+        matches = self._match(event.identifier)
+        yield len(matches)
+        for ds in matches:
+            self._delay()
+            yield 0xFF00, ds
+
+    def start(self):
+        ae = AE(ae_title=self.ae_title)
+        ae.maximum_associations = 64
+        for context in (StudyRootQueryRetrieveInformationModelFind, StudyRootQueryRetrieveInformationModelMove,
+                        StudyRootQueryRetrieveInformationModelGet, Verification):
+            ae.add_supported_context(context)
+        # Rol SCU de almacenamiento para las sub-operaciones C-GET y peticiones para las de C-MOVE
+        for cx in StoragePresentationContexts:
+            ae.add_supported_context(cx.abstract_syntax, scu_role=True, scp_role=True)
+            ae.add_requested_context(cx.abstract_syntax)
+        handlers = [(evt.EVT_C_FIND, self._handle_find), (evt.EVT_C_MOVE, self._handle_move),
+                    (evt.EVT_C_GET, self._handle_get)]
+        self._server = ae.start_server(("127.0.0.1", self.port), block=False, evt_handlers=handlers)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
@@ -1,22 +1,83 @@
 import sys
-import os
+import queue
 import shutil
+import socket
+import threading
 from pathlib import Path
 from datetime import datetime
 from loguru import logger
 
+from implementation.config.settings import settings
+from implementation.dicom_services.ipc import pack_frame
+from implementation.tracing import log_patcher
+
 file_handler_id = None
-LOGS_DIR = Path(__file__).resolve().parent.parent.parent / "logs"
+LOGS_DIR = Path(settings.LOGS_DIR).resolve()
 ACTIVE_LOG_FILE = LOGS_DIR / "DicomProxy_Actual.log"
+# Formato de cada línea del archivo (el visor, el índice y el log en vivo lo interpretan)
+FILE_FORMAT = "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {extra[trace]}{message}"
+
+
+class LogForwarder:
+    """
+    Sink de loguru de los workers HTTP cuando hay gateway DIMSE: el archivo de log
+    tiene un único escritor (el gateway, que es también quien lo rota), así que cada
+    línea ya formateada se le envía por el socket desde un hilo propio. Si el gateway
+    no está disponible las líneas se escriben en stderr.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000):
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        threading.Thread(target=self._run, name="log-forwarder", daemon=True).start()
+
+    def write(self, message):
+        try:
+            self._queue.put_nowait((message.record["level"].name, str(message)))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        sock = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = b"".join(pack_frame({"level": level, "line": line}) for level, line in batch)
+            try:
+                if sock is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(settings.DIMSE_GATEWAY_TIMEOUT)
+                    sock.connect(self.path)
+                    sock.sendall(pack_frame({"op": "log"}))
+                sock.sendall(data)
+            except OSError:
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                for _, line in batch:
+                    sys.stderr.write(line)
+
 
-def setup_logging():
+def setup_logging(forward_to: str = None):
+    """Configura loguru. Con 'forward_to' (socket del gateway DIMSE) el archivo lo escribe el gateway."""
     global file_handler_id
     logger.remove()
+    # Cada línea lleva '[trace=...]' si se escribe durante una petición trazada
+    logger.configure(patcher=log_patcher)
     logger.add(sys.stdout, level="INFO", format="...") # Abreviado por simplicidad
+    if forward_to:
+        file_handler_id = logger.add(LogForwarder(forward_to).write, level="DEBUG", format=FILE_FORMAT, backtrace=True, diagnose=True)
+        logger.info(f"✅ Sistema de logging configurado (líneas enviadas al gateway DIMSE en '{forward_to}').")
+        return
     file_handler_id = logger.add(
         ACTIVE_LOG_FILE,
         level="DEBUG",
-        format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {message}",
+        format=FILE_FORMAT,
         rotation="50 MB",
         retention="30 days",
         enqueue=True,
@@ -11,6 +11,105 @@ class DicomSettings:
     PACS_HOST: str = os.getenv("PACS_HOST", "127.0.0.1")
     PACS_PORT: int = int(os.getenv("PACS_PORT", "104"))
     PACS_AET: str = os.getenv("PACS_AET", "ANY_SCP")
+
+    # Pool de asociaciones DIMSE reutilizables (C-FIND)
+    POOL_MAX_ASSOCIATIONS_PER_PACS: int = int(os.getenv("POOL_MAX_ASSOCIATIONS_PER_PACS", "4"))
+    POOL_IDLE_TIMEOUT: float = float(os.getenv("POOL_IDLE_TIMEOUT", "60"))
+    POOL_HEALTH_CHECK_INTERVAL: float = float(os.getenv("POOL_HEALTH_CHECK_INTERVAL", "15"))
+
+    # Motor de consultas federadas: hilos compartidos para todos los C-FIND
+    QUERY_MAX_WORKERS: int = int(os.getenv("QUERY_MAX_WORKERS", "16"))
+
+    # Sondeo C-ECHO de los PACS: intervalo, timeout del sondeo y fallos seguidos para darlo por caído
+    HEALTH_PROBE_INTERVAL: float = float(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+    HEALTH_PROBE_TIMEOUT: float = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+    HEALTH_PROBE_MAX_WORKERS: int = int(os.getenv("HEALTH_PROBE_MAX_WORKERS", "4"))
+    HEALTH_FAILURE_THRESHOLD: int = int(os.getenv("HEALTH_FAILURE_THRESHOLD", "2"))
+    # Timeout por PACS = latencia observada x factor, acotado (sin datos se usa el máximo)
+    HEALTH_TIMEOUT_FACTOR: float = float(os.getenv("HEALTH_TIMEOUT_FACTOR", "4"))
+    HEALTH_TIMEOUT_MIN: float = float(os.getenv("HEALTH_TIMEOUT_MIN", "5"))
+    HEALTH_TIMEOUT_MAX: float = float(os.getenv("HEALTH_TIMEOUT_MAX", "30"))
+    # Peticiones duplicadas a PACS espejo (mismo 'mirror_group') si el primero tarda
+    QUERY_HEDGING: bool = os.getenv("QUERY_HEDGING", "1").lower() in ("1", "true", "yes")
+    QUERY_HEDGE_FACTOR: float = float(os.getenv("QUERY_HEDGE_FACTOR", "2"))
+    QUERY_HEDGE_MIN_DELAY: float = float(os.getenv("QUERY_HEDGE_MIN_DELAY", "0.2"))
+
+    # Plazo de cada búsqueda federada: al vencer se devuelven los resultados parciales
+    QUERY_DEADLINE: float = float(os.getenv("QUERY_DEADLINE", "10"))
+    # Resultados C-FIND recibidos y aún no enviados al cliente; con el búfer lleno se deja de leer de los PACS
+    QUERY_STREAM_BUFFER: int = int(os.getenv("QUERY_STREAM_BUFFER", "1000"))
+    # Circuito por PACS: fallos/timeouts seguidos para abrirlo y segundos hasta la búsqueda de prueba
+    BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+    BREAKER_RESET_TIMEOUT: float = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+    # Admisión de operaciones DIMSE salientes: huecos globales, colas (total y por cliente) y espera máxima
+    DIMSE_MAX_CONCURRENT: int = int(os.getenv("DIMSE_MAX_CONCURRENT", "32"))
+    DIMSE_MAX_QUEUE: int = int(os.getenv("DIMSE_MAX_QUEUE", "256"))
+    DIMSE_MAX_QUEUE_PER_CLIENT: int = int(os.getenv("DIMSE_MAX_QUEUE_PER_CLIENT", "64"))
+    DIMSE_QUEUE_TIMEOUT: float = float(os.getenv("DIMSE_QUEUE_TIMEOUT", "30"))
+
+    # Caché de respuestas C-FIND (TTL en segundos, límites en número de identificadores)
+    QUERY_CACHE_TTL: float = float(os.getenv("QUERY_CACHE_TTL", "30"))
+    QUERY_CACHE_MAX_RESULTS: int = int(os.getenv("QUERY_CACHE_MAX_RESULTS", "50000"))
+    QUERY_CACHE_MAX_ENTRY_RESULTS: int = int(os.getenv("QUERY_CACHE_MAX_ENTRY_RESULTS", "5000"))
+
+    # Storage SCP persistente y recuperaciones C-MOVE
+    STORAGE_SCP_MAX_ASSOCIATIONS: int = int(os.getenv("STORAGE_SCP_MAX_ASSOCIATIONS", "32"))
+    RETRIEVE_MAX_WORKERS: int = int(os.getenv("RETRIEVE_MAX_WORKERS", "8"))
+    # Instancias recibidas y aún no enviadas al cliente por recuperación; con el búfer lleno
+    # el C-STORE espera y el PACS deja de enviar
+    RETRIEVE_BUFFER: int = int(os.getenv("RETRIEVE_BUFFER", "16"))
+
+    # Gateway DIMSE en un proceso aparte (socket Unix): vacío = todo en el proceso web (un solo worker)
+    DIMSE_GATEWAY_SOCKET: str = os.getenv("DIMSE_GATEWAY_SOCKET", "")
+    DIMSE_GATEWAY_TIMEOUT: float = float(os.getenv("DIMSE_GATEWAY_TIMEOUT", "5"))
+    # Cada cuántos segundos comprueba cada proceso si otro ha cambiado la configuración en la BD
+    CONFIG_RELOAD_INTERVAL: float = float(os.getenv("CONFIG_RELOAD_INTERVAL", "2"))
+
+    # Conexiones SQLite reutilizables del pool (base de datos del proyecto)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "8"))
+
+    # Spool de instancias recibidas: por encima de este tamaño nunca se mantienen en RAM
+    SPOOL_DIR: str = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'spool'))
+    SPOOL_INLINE_MAX_BYTES: int = int(os.getenv("SPOOL_INLINE_MAX_BYTES", str(1024 * 1024)))
+
+    # Caché local de instancias en disco (presupuesto en bytes, expulsión 'lru' o 'lfu')
+    INSTANCE_STORE_DIR: str = os.getenv("INSTANCE_STORE_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'instance_store'))
+    INSTANCE_STORE_MAX_BYTES: int = int(os.getenv("INSTANCE_STORE_MAX_BYTES", str(10 * 1024 ** 3)))
+    INSTANCE_STORE_EVICTION: str = os.getenv("INSTANCE_STORE_EVICTION", "lru")
+
+    # Imágenes renderizadas (WADO-RS /rendered y /thumbnail) y su caché en memoria
+    RENDER_MAX_WORKERS: int = int(os.getenv("RENDER_MAX_WORKERS", "4"))
+    RENDER_CACHE_MAX_BYTES: int = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", "128"))
+    # Instancias transcodificadas a la sintaxis de transferencia pedida en Accept (caché en memoria)
+    TRANSCODE_CACHE_MAX_BYTES: int = int(os.getenv("TRANSCODE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    # Pool de procesos para el trabajo de CPU (0 = todo en el propio proceso) y tareas pendientes como máximo
+    CPU_POOL_WORKERS: int = int(os.getenv("CPU_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+    CPU_POOL_MAX_PENDING: int = int(os.getenv("CPU_POOL_MAX_PENDING", "64"))
+    # Tamaño a partir del cual el trabajo va al pool: bytes de la instancia (renderizado, transcodificación), resultados QIDO por lote
+    CPU_POOL_RENDER_MIN_BYTES: int = int(os.getenv("CPU_POOL_RENDER_MIN_BYTES", str(2 * 1024 * 1024)))
+    CPU_POOL_TRANSCODE_MIN_BYTES: int = int(os.getenv("CPU_POOL_TRANSCODE_MIN_BYTES", str(1024 * 1024)))
+    CPU_POOL_TRANSLATE_BATCH: int = int(os.getenv("CPU_POOL_TRANSLATE_BATCH", "256"))
+
+    # Directorio de los logs (activo y archivados) que muestra el visor
+    LOGS_DIR: str = os.getenv("LOGS_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'logs'))
+
+    # Índice de texto completo de los logs (SQLite FTS5, base de datos propia)
+    LOG_INDEX_DB: str = os.getenv("LOG_INDEX_DB", os.path.join(os.path.dirname(__file__), '..', '..', 'logs', 'log_index.db'))
+    LOG_INDEX_INTERVAL: float = float(os.getenv("LOG_INDEX_INTERVAL", "2"))
+
+    # Trazas por petición: spans exportados en OTLP-JSON a un archivo local (junto a los logs)
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "1").lower() in ("1", "true", "yes")
+    TRACE_EXPORT_FILE: str = os.getenv("TRACE_EXPORT_FILE", os.path.join(os.path.dirname(__file__), '..', '..', 'logs', 'traces.otlp.jsonl'))
+    TRACE_EXPORT_INTERVAL: float = float(os.getenv("TRACE_EXPORT_INTERVAL", "2"))
+    TRACE_EXPORT_MAX_BYTES: int = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+    TRACE_MAX_PENDING: int = int(os.getenv("TRACE_MAX_PENDING", "20000"))
+
+    # Log en vivo: intervalo de lectura, tamaño de lote y entradas pendientes por cliente
+    LOG_TAIL_INTERVAL: float = float(os.getenv("LOG_TAIL_INTERVAL", "0.5"))
+    LOG_TAIL_BATCH: int = int(os.getenv("LOG_TAIL_BATCH", "200"))
+    LOG_TAIL_BUFFER: int = int(os.getenv("LOG_TAIL_BUFFER", "2000"))
     
     SECRET_KEY: str = os.getenv("SECRET_KEY", "default_secret_key")
     ADMIN_USER: str = os.getenv("ADMIN_USER", "admin")
@@ -1,54 +1,182 @@
-from .database import get_db_connection
-from sqlalchemy import text
+import threading
+from loguru import logger
+
+from .database import connection
+
+
+class ConfigSnapshot:
+    """
+    Copia en memoria de 'pacs_configs' y 'proxy_config'. Es inmutable: cada cambio
+    desde el panel crea una instantánea nueva y la sustituye de una sola vez, así
+    que las búsquedas leen siempre una configuración coherente sin tocar el disco.
+    """
+
+    def __init__(self, pacs: tuple, proxy: dict, version: int):
+        self.pacs = pacs
+        self.active_pacs = tuple(pacs_config for pacs_config in pacs if pacs_config['is_active'])
+        self.proxy = proxy
+        self.version = version
+
+
+_snapshot = None
+_snapshot_lock = threading.RLock()
+
+
+# Clave de 'proxy_config' que cuenta los cambios de configuración (la comparten todos los procesos)
+CONFIG_VERSION_KEY = "config_version"
+
+
+def _load_snapshot(conn) -> ConfigSnapshot:
+    pacs = tuple(dict(row) for row in conn.execute('SELECT * FROM pacs_configs ORDER BY description'))
+    proxy = {row['key']: row['value'] for row in conn.execute('SELECT key, value FROM proxy_config')}
+    version = int(proxy.pop(CONFIG_VERSION_KEY, 0))
+    return ConfigSnapshot(pacs, proxy, version)
+
+
+def reload_config() -> ConfigSnapshot:
+    """Vuelve a leer la configuración de la BD y publica la nueva instantánea."""
+    global _snapshot
+    with _snapshot_lock:
+        with connection() as conn:
+            snapshot = _load_snapshot(conn)
+        _snapshot = snapshot
+    logger.debug(f"Configuración en memoria actualizada (versión {snapshot.version}, {len(snapshot.pacs)} PACS).")
+    return snapshot
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    snapshot = _snapshot
+    return snapshot if snapshot is not None else reload_config()
+
+
+def _write(sql_statements):
+    """Aplica las sentencias en una transacción y publica la instantánea con el resultado."""
+    with _snapshot_lock:
+        with connection() as conn:
+            for sql, params in sql_statements:
+                conn.execute(sql, params)
+            # Los demás procesos (workers HTTP, gateway DIMSE) ven el cambio por la versión
+            conn.execute("UPDATE proxy_config SET value = CAST(value AS INTEGER) + 1 WHERE key = ?", (CONFIG_VERSION_KEY,))
+            conn.commit()
+    return reload_config()
+
+
+def stored_config_version() -> int:
+    with connection() as conn:
+        row = conn.execute("SELECT value FROM proxy_config WHERE key = ?", (CONFIG_VERSION_KEY,)).fetchone()
+    return int(row['value']) if row else 0
+
+
+class ConfigWatcher:
+    """
+    Con varios procesos (workers HTTP y gateway DIMSE) cada uno tiene su instantánea:
+    este hilo comprueba cada 'interval' segundos la versión guardada en la BD y, si otro
+    proceso ha cambiado la configuración, la recarga y avisa a 'on_change'.
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self.reloads = 0
+
+    def start(self, interval: float, on_change=None):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval, on_change), name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def check(self) -> bool:
+        """Recarga la instantánea si la versión de la BD es otra. Devuelve si ha cambiado."""
+        if stored_config_version() == get_config_snapshot().version:
+            return False
+        snapshot = reload_config()
+        self.reloads += 1
+        logger.info(f"Configuración cambiada por otro proceso; recargada (versión {snapshot.version}).")
+        return True
+
+    def _run(self, interval: float, on_change):
+        while not self._stop.wait(interval):
+            try:
+                if self.check() and on_change is not None:
+                    on_change()
+            except Exception as e:
+                logger.error(f"No se pudo comprobar la versión de la configuración: {e}")
+
+
+config_watcher = ConfigWatcher()
+
 
 def get_all_pacs():
-    conn = get_db_connection()
-    pacs_list = conn.execute('SELECT * FROM pacs_configs ORDER BY description').fetchall()
-    conn.close()
-    return pacs_list
-
-def add_pacs_config(description: str, aetitle: str, ip_address: str, port: int):
-    conn = get_db_connection()
-    count = conn.execute("SELECT COUNT(id) FROM pacs_configs").fetchone()[0]
-    is_active = 1 if count == 0 else 0
-    conn.execute('INSERT INTO pacs_configs (description, aetitle, ip_address, port, is_active) VALUES (?, ?, ?, ?, ?)',
-                 (description, aetitle, ip_address, port, is_active))
-    conn.commit()
-    conn.close()
-
-# --- NUEVAS FUNCIONES ---
+    return list(get_config_snapshot().pacs)
+
+def get_active_pacs():
+    """PACS marcados como activos (de la instantánea en memoria)."""
+    return list(get_config_snapshot().active_pacs)
+
+def _pacs_id(pacs_id):
+    """Id numérico del PACS, o None si falta o no es válido (llega tal cual del JSON del panel)."""
+    try:
+        return int(pacs_id)
+    except (TypeError, ValueError):
+        return None
+
+def _find_pacs(snapshot: ConfigSnapshot, pacs_id):
+    pacs_id = _pacs_id(pacs_id)
+    if pacs_id is None:
+        return None
+    return next((pacs for pacs in snapshot.pacs if pacs['id'] == pacs_id), None)
+
+def get_pacs(pacs_id: int):
+    """PACS con ese id, o None si no existe o el id no es válido."""
+    return _find_pacs(get_config_snapshot(), pacs_id)
+
+def add_pacs_config(description: str, aetitle: str, ip_address: str, port: int, retrieval_strategy: str = "C-MOVE",
+                    mirror_group: str = None, max_associations: int = None):
+    # El primer PACS queda activo; se decide en la propia sentencia (la instantánea de otro proceso puede estar atrasada)
+    _write([('INSERT INTO pacs_configs (description, aetitle, ip_address, port, is_active, retrieval_strategy, mirror_group, max_associations) '
+             'VALUES (?, ?, ?, ?, NOT EXISTS (SELECT 1 FROM pacs_configs), ?, ?, ?)',
+             (description, aetitle, ip_address, port, retrieval_strategy, mirror_group or None, max_associations or None))])
+
+def update_pacs_retrieval_strategy(pacs_id: int, retrieval_strategy: str):
+    """Cambia el modo de recuperación (C-MOVE / C-GET) de un PACS."""
+    _write([('UPDATE pacs_configs SET retrieval_strategy = ? WHERE id = ?', (retrieval_strategy, pacs_id))])
+
+def update_pacs_mirror_group(pacs_id: int, mirror_group: str):
+    """Asigna el grupo de espejos del PACS (vacío = sin grupo)."""
+    _write([('UPDATE pacs_configs SET mirror_group = ? WHERE id = ?', ((mirror_group or "").strip() or None, pacs_id))])
+
+def update_pacs_max_associations(pacs_id: int, max_associations: int = None):
+    """Límite de asociaciones simultáneas del PACS (None = valor por defecto)."""
+    _write([('UPDATE pacs_configs SET max_associations = ? WHERE id = ?', (max_associations or None, pacs_id))])
+
+def toggle_pacs_active(pacs_id: int):
+    """Activa o desactiva un PACS. Devuelve el nuevo estado, o None si no existe."""
+    pacs_id = _pacs_id(pacs_id)
+    if pacs_id is None:
+        return None
+    # Se invierte en SQL y se lee el resultado: dos cambios desde workers distintos no se pisan
+    snapshot = _write([('UPDATE pacs_configs SET is_active = 1 - is_active WHERE id = ?', (pacs_id,))])
+    pacs = _find_pacs(snapshot, pacs_id)
+    return None if pacs is None else pacs['is_active']
+
+def delete_pacs_config(pacs_id: int) -> bool:
+    if get_pacs(pacs_id) is None:
+        return False
+    _write([('DELETE FROM pacs_configs WHERE id = ?', (_pacs_id(pacs_id),))])
+    return True
+
 def get_proxy_config():
-    """Obtiene la configuración local del proxy desde la BD."""
-    conn = get_db_connection()
-    config_rows = conn.execute('SELECT key, value FROM proxy_config').fetchall()
-    conn.close()
-    # Convierte la lista de filas en un diccionario
-    return {row['key']: row['value'] for row in config_rows}
+    """Configuración local del proxy (copia del diccionario de la instantánea)."""
+    return dict(get_config_snapshot().proxy)
 
 def update_proxy_config(proxy_aet: str, proxy_port: int):
     """Actualiza la configuración local del proxy."""
-    conn = get_db_connection()
-    conn.execute("UPDATE proxy_config SET value = ? WHERE key = 'proxy_aet'", (proxy_aet,))
-    conn.execute("UPDATE proxy_config SET value = ? WHERE key = 'proxy_port'", (str(proxy_port),))
-    conn.commit()
-    conn.close()
-
-
-def get_local_config(db):
-    query = text("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    result = db.execute(query).fetchone()
-    if result:
-        return dict(result._mapping)
-    else:
-        return None
-
-def update_local_config(db, aetitle: str, port: int, ip: str = None):
-    if not ip:
-        import socket
-        try:
-            ip = socket.gethostbyname(socket.gethostname())
-        except:
-            ip = "127.0.0.1"
-    query = text("UPDATE local_config SET aetitle=:aetitle, ip=:ip, port=:port WHERE id=1;")
-    db.execute(query, {"aetitle": aetitle, "ip": ip, "port": port})
-    db.commit()
+    _write([("UPDATE proxy_config SET value = ? WHERE key = 'proxy_aet'", (proxy_aet,)),
+            ("UPDATE proxy_config SET value = ? WHERE key = 'proxy_port'", (str(proxy_port),))])
@@ -1,17 +1,117 @@
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from loguru import logger
 
+from implementation.config.settings import settings
+from implementation import metrics
+
 DATABASE_FILE = Path(__file__).resolve().parent.parent / "dicomproxy.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Sentencias preparadas que cada conexión mantiene en caché (se reutilizan al reutilizar la conexión)
+STATEMENT_CACHE_SIZE = 256
+# Conexiones que miden el tiempo de cada sentencia (métrica sqlite_query_seconds)
+_TimedConnection = metrics.sqlite_factory("config")
+
+
+class ConnectionPool:
+    """
+    Conexiones SQLite reutilizables entre peticiones y hilos. Cada conexión se abre
+    una sola vez en modo WAL (lectores y escritor no se bloquean entre sí) y
+    conserva su caché de sentencias preparadas. Si todas están ocupadas se abre
+    una conexión extra que se cierra al devolverla.
+    """
+
+    def __init__(self, path, size: int):
+        self.path = Path(path)
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE, factory=_TimedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            self._opened += 1
+        return self._open()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+            return
+        with self._lock:
+            self._opened -= 1
+        conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def stats(self) -> dict:
+        return {"path": str(self.path), "open": self._opened, "idle": self._idle.qsize(), "size": self.size}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Pool de la base de datos del proyecto (se crea al primer uso, con el DATABASE_FILE vigente)."""
+    global _pool
+    if _pool is None or _pool.path != Path(DATABASE_FILE):
+        with _pool_lock:
+            if _pool is None or _pool.path != Path(DATABASE_FILE):
+                if _pool is not None:
+                    _pool.close_all()
+                _pool = ConnectionPool(DATABASE_FILE, settings.DB_POOL_SIZE)
+    return _pool
+
+
+@contextmanager
+def connection():
+    """
+    Conexión del pool para un bloque 'with'. Al salir se confirma lo escrito; si
+    hubo una excepción se deshace. La conexión vuelve al pool en ambos casos.
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    finally:
+        pool.release(conn)
+
 
 def initialize_database():
     logger.info("Verificando inicialización de la base de datos...")
-    conn = get_db_connection()
+    with connection() as conn:
+        _create_schema(conn)
+    logger.info("Base de datos lista.")
+
+
+def _create_schema(conn):
     cursor = conn.cursor()
     # Tabla de PACS remotos
     cursor.execute("""
@@ -20,6 +120,16 @@ def initialize_database():
         port INTEGER NOT NULL, description TEXT, is_active BOOLEAN NOT NULL CHECK (is_active IN (0, 1))
     );
     """)
+    # Migración: modo de recuperación por PACS ('C-MOVE' o 'C-GET')
+    columns = {row['name'] for row in cursor.execute("PRAGMA table_info(pacs_configs)")}
+    if 'retrieval_strategy' not in columns:
+        cursor.execute("ALTER TABLE pacs_configs ADD COLUMN retrieval_strategy TEXT NOT NULL DEFAULT 'C-MOVE'")
+    # Migración: grupo de PACS espejo (mismos estudios; basta con la respuesta de uno)
+    if 'mirror_group' not in columns:
+        cursor.execute("ALTER TABLE pacs_configs ADD COLUMN mirror_group TEXT")
+    # Migración: asociaciones simultáneas permitidas por el PACS (NULL = POOL_MAX_ASSOCIATIONS_PER_PACS)
+    if 'max_associations' not in columns:
+        cursor.execute("ALTER TABLE pacs_configs ADD COLUMN max_associations INTEGER")
     # NUEVA TABLA: para la configuración local del proxy
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS proxy_config (
@@ -27,9 +137,30 @@ def initialize_database():
         value TEXT NOT NULL
     );
     """)
+    # Índice de la caché local de instancias (archivos en INSTANCE_STORE_DIR)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS instance_cache (
+        sop_instance_uid TEXT PRIMARY KEY, study_uid TEXT, series_uid TEXT, sop_class_uid TEXT,
+        transfer_syntax TEXT, size INTEGER NOT NULL, path TEXT NOT NULL,
+        created_at REAL NOT NULL, last_access REAL NOT NULL, access_count INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    # Migración: manejadores de la instancia aún en uso (mientras haya alguno no se expulsa)
+    columns = {row['name'] for row in cursor.execute("PRAGMA table_info(instance_cache)")}
+    if 'pins' not in columns:
+        cursor.execute("ALTER TABLE instance_cache ADD COLUMN pins INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_instance_cache_study ON instance_cache (study_uid)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_instance_cache_series ON instance_cache (series_uid)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_instance_cache_access ON instance_cache (last_access)")
+    # Estudios/series recuperados completos en la caché
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS instance_cache_complete (
+        uid TEXT PRIMARY KEY, level TEXT NOT NULL, completed_at REAL NOT NULL
+    );
+    """)
     # Insertar valores por defecto si no existen
     cursor.execute("INSERT OR IGNORE INTO proxy_config (key, value) VALUES ('proxy_aet', 'DICOMPROXY')")
     cursor.execute("INSERT OR IGNORE INTO proxy_config (key, value) VALUES ('proxy_port', '11112')")
+    # Contador de cambios de configuración, para que cada proceso sepa cuándo recargarla
+    cursor.execute("INSERT OR IGNORE INTO proxy_config (key, value) VALUES ('config_version', '0')")
     conn.commit()
-    conn.close()
-    logger.info("Base de datos lista.")
@@ -0,0 +1,293 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pynetdicom import AE
+from pynetdicom.sop_class import (
+    StudyRootQueryRetrieveInformationModelFind,
+    StudyRootQueryRetrieveInformationModelMove,
+    Verification,
+)
+from loguru import logger
+
+from implementation.config.settings import settings
+from implementation import metrics, tracing
+
+
+# Contextos del pool principal: C-FIND, C-MOVE y C-ECHO para la verificación
+DEFAULT_REQUESTED_CONTEXTS = [
+    StudyRootQueryRetrieveInformationModelFind,
+    StudyRootQueryRetrieveInformationModelMove,
+    Verification,
+]
+
+
+def pacs_key(pacs_config) -> tuple:
+    """Clave del pool para una fila de 'pacs_configs': (AE Title, IP, Puerto)."""
+    return (pacs_config['aetitle'], pacs_config['ip_address'], int(pacs_config['port']))
+
+
+class _PooledAssociation:
+    __slots__ = ("assoc", "created_at", "last_used", "last_checked")
+
+    def __init__(self, assoc):
+        now = time.monotonic()
+        self.assoc = assoc
+        self.created_at = now
+        self.last_used = now
+        self.last_checked = now
+
+
+class _PacsSlot:
+    """Estado del pool para un único PACS."""
+
+    def __init__(self):
+        self.idle = deque()
+        self.open_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class AssociationPool:
+    """
+    Pool de asociaciones DIMSE reutilizables, una cola por PACS.
+    Por defecto negocia C-FIND/C-MOVE; 'requested_contexts', 'ext_neg' y
+    'evt_handlers' permiten pools con otra negociación (p. ej. C-GET).
+    Mantiene abiertas las asociaciones ociosas, limita cuántas puede haber abiertas
+    a la vez por PACS, las verifica con C-ECHO antes de reutilizarlas y cierra las
+    que superan el tiempo máximo de inactividad.
+    """
+
+    def __init__(self, ae_title: str, max_per_pacs: int, idle_timeout: float,
+                 health_check_interval: float, acquire_timeout: float = 30.0,
+                 requested_contexts=None, ext_neg=None, evt_handlers=None):
+        self.ae_title = ae_title
+        self.requested_contexts = requested_contexts or DEFAULT_REQUESTED_CONTEXTS
+        self.ext_neg = ext_neg
+        self.evt_handlers = evt_handlers
+        self.max_per_pacs = max(1, max_per_pacs)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._slots: dict[tuple, _PacsSlot] = {}
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+    # --- Construcción de asociaciones ---
+    def _build_ae(self) -> AE:
+        ae = AE(ae_title=self.ae_title)
+        for context in self.requested_contexts:
+            if isinstance(context, tuple):
+                ae.add_requested_context(*context)
+            else:
+                ae.add_requested_context(context)
+        return ae
+
+    def _open(self, key: tuple, timeout: float | None = None):
+        aet, ip, port = key
+        ae = self._build_ae()
+        if timeout is not None:
+            ae.connection_timeout = ae.acse_timeout = timeout
+        started = time.perf_counter()
+        with tracing.span("DIMSE associate", tracing.KIND_CLIENT, **{"dicom.aet": aet, "net.peer.name": ip, "net.peer.port": port}) as associate_span:
+            try:
+                assoc = ae.associate(ip, port, ae_title=aet, ext_neg=self.ext_neg, evt_handlers=self.evt_handlers)
+            except Exception:
+                metrics.association_setup_seconds.labels(f"{aet}@{ip}:{port}", "error").observe(time.perf_counter() - started)
+                raise
+            metrics.association_setup_seconds.labels(f"{aet}@{ip}:{port}", "ok" if assoc.is_established else "rejected").observe(time.perf_counter() - started)
+            if not assoc.is_established:
+                associate_span.fail("Asociación rechazada o sin respuesta")
+        if not assoc.is_established:
+            return None
+        return _PooledAssociation(assoc)
+
+    def _is_healthy(self, pooled: _PooledAssociation) -> bool:
+        if not pooled.assoc.is_established:
+            return False
+        if time.monotonic() - pooled.last_checked < self.health_check_interval:
+            return True
+        try:
+            status = pooled.assoc.send_c_echo()
+        except Exception as e:
+            logger.debug(f"C-ECHO de verificación falló en asociación del pool: {e}")
+            return False
+        pooled.last_checked = time.monotonic()
+        return bool(status) and status.Status == 0x0000
+
+    @staticmethod
+    def _close(pooled: _PooledAssociation):
+        try:
+            if pooled.assoc.is_established:
+                pooled.assoc.release()
+        except Exception:
+            pooled.assoc.abort()
+
+    # --- API pública ---
+    @contextmanager
+    def acquire(self, pacs_config, timeout: float | None = None):
+        """
+        Entrega una asociación establecida con el PACS indicado y la devuelve al pool
+        al terminar. Si el bloque lanza una excepción la asociación se descarta.
+        Entrega None si no se pudo establecer la asociación. 'timeout' acota la espera
+        de un hueco, el establecimiento y cada respuesta DIMSE mientras se usa.
+        """
+        key = pacs_key(pacs_config)
+        pooled = self._checkout(key, timeout, pacs_config.get('max_associations') or self.max_per_pacs)
+        if pooled is None:
+            yield None
+            return
+        default_dimse_timeout = pooled.assoc.dimse_timeout
+        if timeout is not None:
+            pooled.assoc.dimse_timeout = timeout
+        try:
+            yield pooled.assoc
+        except BaseException:
+            self._discard(key, pooled)
+            raise
+        else:
+            pooled.assoc.dimse_timeout = default_dimse_timeout
+            self._checkin(key, pooled)
+
+    def _checkout(self, key: tuple, timeout: float | None = None, limit: int | None = None):
+        limit = max(1, int(limit or self.max_per_pacs))
+        deadline = time.monotonic() + (self.acquire_timeout if timeout is None else min(timeout, self.acquire_timeout))
+        while True:
+            stale = []
+            with self._cond:
+                slot = self._slots.setdefault(key, _PacsSlot())
+                self._ensure_reaper()
+                while slot.idle:
+                    pooled = slot.idle.pop()  # LIFO: la más reciente tiene menos riesgo de estar cerrada
+                    if pooled.assoc.is_established:
+                        break
+                    slot.open_count -= 1
+                    slot.evictions += 1
+                    stale.append(pooled)
+                else:
+                    pooled = None
+                if pooled is None:
+                    if slot.open_count >= limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._cond.wait(timeout=remaining):
+                            logger.warning(f"Tiempo agotado esperando una asociación libre del pool para {key[0]}@{key[1]}:{key[2]}")
+                            return None
+                        continue
+                    slot.open_count += 1
+                    slot.misses += 1
+            for old in stale:
+                self._close(old)
+
+            if pooled is not None:
+                # La verificación con C-ECHO se hace fuera del candado
+                if self._is_healthy(pooled):
+                    with self._cond:
+                        slot.hits += 1
+                    pooled.last_used = time.monotonic()
+                    return pooled
+                logger.debug(f"Asociación del pool con {key[0]} no superó la verificación; se descarta.")
+                self._discard(key, pooled)
+                continue
+
+            # Hueco reservado: abrir una asociación nueva
+            try:
+                pooled = self._open(key, timeout)
+            except Exception as e:
+                logger.error(f"Error al abrir asociación con {key[0]}@{key[1]}:{key[2]}: {e}")
+                pooled = None
+            if pooled is None:
+                with self._cond:
+                    slot.open_count -= 1
+                    self._cond.notify()
+            return pooled
+
+    def _checkin(self, key: tuple, pooled: _PooledAssociation):
+        if self._closed or not pooled.assoc.is_established:
+            self._discard(key, pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._slots[key].idle.append(pooled)
+            self._cond.notify()
+
+    def _discard(self, key: tuple, pooled: _PooledAssociation):
+        with self._cond:
+            slot = self._slots[key]
+            slot.open_count -= 1
+            slot.evictions += 1
+            self._cond.notify()
+        self._close(pooled)
+
+    def evict_idle(self, max_idle: float | None = None) -> int:
+        """Cierra las asociaciones ociosas que superan 'max_idle' segundos (por defecto idle_timeout)."""
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            for slot in self._slots.values():
+                keep = deque()
+                for pooled in slot.idle:
+                    if now - pooled.last_used >= max_idle or not pooled.assoc.is_established:
+                        expired.append(pooled)
+                        slot.open_count -= 1
+                        slot.evictions += 1
+                    else:
+                        keep.append(pooled)
+                slot.idle = keep
+            if expired:
+                self._cond.notify_all()
+        for pooled in expired:
+            self._close(pooled)
+        if expired:
+            logger.debug(f"Pool DIMSE: {len(expired)} asociaciones ociosas cerradas.")
+        return len(expired)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_loop, name="dimse-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(1.0, self.idle_timeout / 2)
+        while not self._closed:
+            time.sleep(interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error en la limpieza del pool DIMSE: {e}")
+
+    def close_all(self):
+        """Libera todas las asociaciones ociosas y no acepta más devoluciones."""
+        self._closed = True
+        self.evict_idle(max_idle=0)
+
+    def stats(self) -> dict:
+        """Contadores de aciertos/fallos del pool por PACS y totales."""
+        with self._cond:
+            per_pacs = {
+                f"{aet}@{ip}:{port}": {
+                    "hits": slot.hits, "misses": slot.misses, "evictions": slot.evictions,
+                    "open": slot.open_count, "idle": len(slot.idle),
+                }
+                for (aet, ip, port), slot in self._slots.items()
+            }
+        hits = sum(p["hits"] for p in per_pacs.values())
+        misses = sum(p["misses"] for p in per_pacs.values())
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "max_per_pacs": self.max_per_pacs,
+            "pacs": per_pacs,
+        }
+
+
+association_pool = AssociationPool(
+    ae_title=settings.PROXY_AET,
+    max_per_pacs=settings.POOL_MAX_ASSOCIATIONS_PER_PACS,
+    idle_timeout=settings.POOL_IDLE_TIMEOUT,
+    health_check_interval=settings.POOL_HEALTH_CHECK_INTERVAL,
+)
@@ -0,0 +1,117 @@
+import threading
+import time
+from loguru import logger
+
+from implementation.config.settings import settings
+from implementation.dicom_services.association_pool import pacs_key
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Estado del circuito de un PACS (cerrado, abierto o semiabierto)."""
+
+    def __init__(self, description: str):
+        self.description = description
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+        self.last_failure = None
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state, "consecutive_failures": self.consecutive_failures,
+            "opened_at": self.opened_at, "times_opened": self.times_opened,
+            "rejected": self.rejected, "last_failure": self.last_failure,
+        }
+
+
+class CircuitBreakers:
+    """
+    Un circuito por PACS para las búsquedas C-FIND. Tras 'failure_threshold' fallos o
+    timeouts seguidos el circuito se abre y el PACS deja de consultarse; pasado
+    'reset_timeout' se deja pasar una única búsqueda de prueba (semiabierto): si
+    responde, el circuito se cierra; si no, vuelve a abrirse.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[tuple, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, pacs_config) -> CircuitBreaker:
+        key = pacs_key(pacs_config)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(pacs_config['description'])
+        return breaker
+
+    def available(self, pacs_config) -> bool:
+        """Si una búsqueda podría pasar ahora mismo (no reserva la prueba del estado semiabierto)."""
+        with self._lock:
+            breaker = self._get(pacs_config)
+            if breaker.state == CLOSED:
+                return True
+            if breaker.state == OPEN:
+                return time.monotonic() - breaker.opened_at >= self.reset_timeout
+            return not breaker.trial_in_flight
+
+    def acquire(self, pacs_config) -> bool:
+        """Pide paso para una búsqueda. En semiabierto solo se concede a la búsqueda de prueba."""
+        with self._lock:
+            breaker = self._get(pacs_config)
+            if breaker.state == OPEN and time.monotonic() - breaker.opened_at >= self.reset_timeout:
+                breaker.state = HALF_OPEN
+                breaker.trial_in_flight = False
+            if breaker.state == CLOSED:
+                return True
+            if breaker.state == HALF_OPEN and not breaker.trial_in_flight:
+                breaker.trial_in_flight = True
+                logger.info(f"Circuito de '{breaker.description}' semiabierto: búsqueda de prueba.")
+                return True
+            breaker.rejected += 1
+            return False
+
+    def record_success(self, pacs_config):
+        with self._lock:
+            breaker = self._get(pacs_config)
+            breaker.consecutive_failures = 0
+            breaker.trial_in_flight = False
+            if breaker.state != CLOSED:
+                breaker.state = CLOSED
+                breaker.opened_at = None
+                logger.success(f"Circuito de '{breaker.description}' cerrado: el PACS vuelve a responder.")
+
+    def record_failure(self, pacs_config, reason: str):
+        with self._lock:
+            breaker = self._get(pacs_config)
+            breaker.consecutive_failures += 1
+            breaker.trial_in_flight = False
+            breaker.last_failure = reason
+            if breaker.state == HALF_OPEN or (breaker.state == CLOSED and breaker.consecutive_failures >= self.failure_threshold):
+                breaker.state = OPEN
+                breaker.opened_at = time.monotonic()
+                breaker.times_opened += 1
+                logger.warning(f"Circuito de '{breaker.description}' abierto tras {breaker.consecutive_failures} fallos seguidos ({reason}).")
+
+    def release(self, pacs_config):
+        """La búsqueda terminó sin veredicto (cancelada por el cliente o por otro espejo)."""
+        with self._lock:
+            self._get(pacs_config).trial_in_flight = False
+
+    def state_of(self, pacs_config) -> dict:
+        with self._lock:
+            breaker = self._breakers.get(pacs_key(pacs_config))
+            return breaker.to_dict() if breaker is not None else CircuitBreaker(pacs_config['description']).to_dict()
+
+
+circuit_breakers = CircuitBreakers(
+    failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+)
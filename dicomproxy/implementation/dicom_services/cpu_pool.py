@@ -0,0 +1,201 @@
+import asyncio
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from loguru import logger
+
+from implementation import metrics, tracing
+from implementation.config.settings import settings
+
+# Ventana (segundos) sobre la que se calcula la utilización del pool
+UTILIZATION_WINDOW = 60.0
+
+
+def _init_worker():
+    # Los procesos del pool no escriben en el archivo de log ni atienden Ctrl+C (los apaga el padre)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+def _execute(fn, shared, args):
+    """
+    Se ejecuta en el proceso del pool: abre el bloque de memoria compartida (si lo
+    hay) y pasa a 'fn' una vista de cada parte, sin copiarla. Devuelve el resultado
+    y el tiempo de trabajo.
+    """
+    started = time.perf_counter()
+    if shared is None:
+        return fn(*args), time.perf_counter() - started
+    name, offsets = shared
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        parts = [block.buf[start:start + size] for start, size in offsets]
+        try:
+            result = fn(parts, *args)
+        finally:
+            for part in parts:
+                part.release()
+    finally:
+        try:
+            block.close()
+        except BufferError:
+            # Alguna vista sigue viva (p. ej. en una traza de excepción); se libera con ella
+            pass
+    return result, time.perf_counter() - started
+
+
+class _SharedBlock:
+    """Bloque de memoria compartida con varias partes contiguas; lo crea y lo libera el proceso padre."""
+
+    def __init__(self, parts):
+        sizes = [len(part) for part in parts]
+        self._block = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+        self.offsets = []
+        position = 0
+        for part, size in zip(parts, sizes):
+            self._block.buf[position:position + size] = part
+            self.offsets.append((position, size))
+            position += size
+
+    @property
+    def ref(self) -> tuple:
+        return self._block.name, self.offsets
+
+    def release(self):
+        self._block.close()
+        self._block.unlink()
+
+
+class CpuPool:
+    """
+    Pool de procesos para las etapas que consumen CPU con el GIL tomado (renderizado
+    y transcodificación de instancias grandes, traducción a DICOM JSON de búsquedas
+    con muchos resultados), para que no bloqueen el event loop ni el resto de
+    peticiones. Cada etapa tiene un umbral de tamaño: por debajo (o sin sitio en la cola) se ejecuta en el propio
+    proceso, porque enviarla costaría más que hacerla. Los bytes grandes viajan en
+    memoria compartida; por la tubería del pool solo pasa su nombre.
+    Los procesos se crean con 'spawn' al enviar la primera tarea.
+    """
+
+    def __init__(self, workers: int, max_pending: int, thresholds: dict):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.thresholds = thresholds
+        self._executor = None
+        self._lock = threading.Lock()
+        self._recent = deque()  # (fin, segundos de trabajo) de las tareas recientes
+        self.pending = 0
+        self.restarts = 0
+        self.tasks = {}
+        self.busy_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_worker)
+                logger.info(f"Pool de procesos para trabajo de CPU iniciado ({self.workers} procesos).")
+            return self._executor
+
+    def _count(self, stage: str, route: str):
+        key = f"{stage}/{route}"
+        self.tasks[key] = self.tasks.get(key, 0) + 1
+        metrics.cpu_tasks_total.labels(stage, route).inc()
+
+    def should_offload(self, stage: str, size: int) -> bool:
+        return self.workers > 0 and size >= self.thresholds.get(stage, float("inf"))
+
+    async def run(self, stage: str, size: int, fn, *args, shared=None, inline=None):
+        """
+        Ejecuta fn(*args) en un proceso del pool si 'size' alcanza el umbral de la etapa;
+        si no, devuelve 'await inline()' (el camino habitual en este proceso). 'fn' debe
+        ser una función de módulo y sus argumentos, serializables. Con 'shared' (lista de
+        bytes) 'fn' recibe primero la lista de vistas de esas partes en memoria compartida.
+        """
+        if not self.should_offload(stage, size):
+            self._count(stage, "inline")
+            return await inline()
+        if self.pending >= self.max_pending:
+            self._count(stage, "overflow")
+            return await inline()
+        self._count(stage, "process")
+        started = time.perf_counter()
+        self.pending += 1
+        block = _SharedBlock(shared) if shared is not None else None
+        try:
+            with tracing.span(f"CPU pool {stage}", **{"cpu.size": size}) as task_span:
+                future = self._get_executor().submit(_execute, fn, block.ref if block else None, args)
+                result, busy = await asyncio.wrap_future(future)
+                task_span.set("cpu.busy_ms", round(busy * 1000, 3))
+        except BrokenProcessPool as e:
+            self._restart(e)
+            self._count(stage, "fallback")
+            return await inline()
+        finally:
+            self.pending -= 1
+            if block is not None:
+                block.release()
+        self._record(stage, busy)
+        metrics.cpu_task_seconds.labels(stage).observe(time.perf_counter() - started)
+        return result
+
+    def _record(self, stage: str, busy: float):
+        now = time.monotonic()
+        with self._lock:
+            self.busy_seconds += busy
+            self._recent.append((now, busy))
+            while self._recent and self._recent[0][0] < now - UTILIZATION_WINDOW:
+                self._recent.popleft()
+        metrics.cpu_busy_seconds_total.labels(stage).inc(busy)
+
+    def _restart(self, error):
+        """Un proceso del pool murió (p. ej. sin memoria): se descarta el pool y se creará otro."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.restarts += 1
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        logger.error(f"Pool de procesos roto ({error}); la tarea se ejecuta en el propio proceso y el pool se recrea.")
+
+    def utilization(self) -> float:
+        """Fracción del tiempo de los procesos ocupada en el último minuto."""
+        if self.workers <= 0:
+            return 0.0
+        horizon = time.monotonic() - UTILIZATION_WINDOW
+        with self._lock:
+            busy = sum(seconds for finished, seconds in self._recent if finished >= horizon)
+        return round(min(busy / (self.workers * UTILIZATION_WINDOW), 1.0), 4)
+
+    def queued(self) -> int:
+        """Tareas enviadas que esperan un proceso libre."""
+        return max(self.pending - self.workers, 0)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "started": self._executor is not None, "pending": self.pending,
+                "queued": self.queued(), "max_pending": self.max_pending, "utilization": self.utilization(),
+                "busy_seconds": round(self.busy_seconds, 3), "restarts": self.restarts,
+                "thresholds": self.thresholds, "tasks": dict(self.tasks)}
+
+
+cpu_pool = CpuPool(
+    workers=settings.CPU_POOL_WORKERS,
+    max_pending=settings.CPU_POOL_MAX_PENDING,
+    thresholds={"render": settings.CPU_POOL_RENDER_MIN_BYTES, "transcode": settings.CPU_POOL_TRANSCODE_MIN_BYTES,
+                "translate": settings.CPU_POOL_TRANSLATE_BATCH},
+)
+
+metrics.registry.callback_gauge("cpu_pool_queue_depth", "Tareas de CPU esperando un proceso libre del pool.", cpu_pool.queued)
+metrics.registry.callback_gauge("cpu_pool_utilization", "Utilización de los procesos del pool en el último minuto (0..1).", cpu_pool.utilization)
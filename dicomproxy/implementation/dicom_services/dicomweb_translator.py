@@ -1,51 +1,312 @@
+import base64
+import functools
+import json
+import struct
+import time
+from pydicom.datadict import dictionary_VR
+from pydicom.dataelem import RawDataElement
 from pydicom.dataset import Dataset
-from pydicom.sequence import Sequence
-from pydicom.tag import Tag
+from pydicom.filewriter import correct_ambiguous_vr_element
+from pydicom.multival import MultiValue
 from loguru import logger
 
-def _format_value(elem):
-    """Formatea el valor del elemento DICOM para JSON."""
-    if elem.VR == 'PN':
-        # Los nombres de persona tienen una estructura especial
-        return [{"Alphabetic": str(name)} for name in elem.value] if isinstance(elem.value, list) else [{"Alphabetic": str(elem.value)}]
-    elif isinstance(elem.value, list):
-        return elem.value
-    elif elem.value is None:
-        return []
+from implementation import metrics
+from implementation.dicom_services import ipc
+from implementation.dicom_services.cpu_pool import cpu_pool
+
+try:
+    # Backend JSON rápido opcional; si no está instalado se usa el módulo estándar
+    import orjson
+except ImportError:
+    orjson = None
+
+# Valores binarios mayores que esto se sustituyen por un BulkDataURI (si se puede construir)
+BULKDATA_THRESHOLD = 1024
+
+_BINARY_VRS = {"OB", "OD", "OF", "OL", "OV", "OW", "UN"}
+
+# VR de texto con un único valor (la barra invertida no separa valores)
+_TEXT_VRS = {"LT", "ST", "UT", "UR"}
+
+# VR numéricos binarios: formato struct de cada valor
+_STRUCT_FORMATS = {"US": "H", "SS": "h", "UL": "L", "SL": "l", "FL": "f", "FD": "d", "UV": "Q", "SV": "q"}
+
+# Juegos de caracteres que se decodifican directamente desde los bytes recibidos
+_SIMPLE_CHARSETS = {None: "latin_1", "": "latin_1", "ISO_IR 6": "latin_1", "ISO_IR 100": "latin_1", "ISO_IR 192": "utf_8"}
+
+# VR de diccionario de cada tag (para VR implícito), calculado una sola vez por tag
+_DICTIONARY_VRS: dict = {}
+
+# Cadena 'GGGGEEEE' de cada tag, calculada una sola vez por tag
+_TAG_KEYS: dict = {}
+
+
+def _tag_key(tag: int) -> str:
+    key = _TAG_KEYS.get(tag)
+    if key is None:
+        key = _TAG_KEYS[tag] = f"{tag:08X}"
+    return key
+
+
+def _values(value) -> list:
+    if isinstance(value, (MultiValue, list, tuple)):
+        return list(value)
+    return [value]
+
+
+# --- Codificadores por VR (valor del elemento -> lista JSON) ---
+def _strings(value) -> list:
+    if type(value) is str:
+        return [value]
+    return [None if item is None or item == "" else str(item) for item in _values(value)]
+
+
+def _integers(value) -> list:
+    return [None if item is None or item == "" else int(item) for item in _values(value)]
+
+
+def _decimals(value) -> list:
+    result = []
+    for item in _values(value):
+        if item is None or item == "":
+            result.append(None)
+            continue
+        number = float(item)
+        result.append(int(number) if number.is_integer() and abs(number) < 2 ** 53 else number)
+    return result
+
+
+def _floats(value) -> list:
+    return [float(item) for item in _values(value)]
+
+
+def _large_integers(value) -> list:
+    # Enteros de 64 bits fuera del rango exacto de un double se envían como cadena (PS3.18, F.2.3.1)
+    return [int(item) if abs(int(item)) < 2 ** 53 else str(int(item)) for item in _values(value)]
+
+
+def _person_names(value) -> list:
+    result = []
+    for name in _values(value):
+        if name is None or name == "":
+            result.append(None)
+            continue
+        if isinstance(name, str):
+            groups = name.split("=")
+            components = {"Alphabetic": groups[0]}
+            if len(groups) > 1 and groups[1]:
+                components["Ideographic"] = groups[1]
+            if len(groups) > 2 and groups[2]:
+                components["Phonetic"] = groups[2]
+            result.append(components)
+            continue
+        components = {"Alphabetic": name.alphabetic}
+        if name.ideographic:
+            components["Ideographic"] = name.ideographic
+        if name.phonetic:
+            components["Phonetic"] = name.phonetic
+        result.append(components)
+    return result
+
+
+def _attribute_tags(value) -> list:
+    return [f"{int(item):08X}" for item in _values(value)]
+
+
+_VALUE_ENCODERS = {
+    "AE": _strings, "AS": _strings, "CS": _strings, "DA": _strings, "DT": _strings, "LO": _strings,
+    "LT": _strings, "SH": _strings, "ST": _strings, "TM": _strings, "UC": _strings, "UI": _strings,
+    "UR": _strings, "UT": _strings,
+    "IS": _integers, "US": _integers, "SS": _integers, "UL": _integers, "SL": _integers,
+    "DS": _decimals,
+    "FL": _floats, "FD": _floats,
+    "UV": _large_integers, "SV": _large_integers,
+    "PN": _person_names,
+    "AT": _attribute_tags,
+}
+
+
+def _resolve_vr(element, ds) -> str:
+    """
+    VR concreto de un elemento con VR ambiguo ('US or SS', 'OB or OW'...), según el
+    resto del dataset; si no se puede resolver, el primero compatible con el valor.
+    """
+    try:
+        element = correct_ambiguous_vr_element(element, ds, True)
+    except Exception:
+        pass
+    vr = str(element.VR)
+    if " or " not in vr:
+        return vr
+    candidates = vr.split(" or ")
+    binary = isinstance(element.value, (bytes, bytearray))
+    return next((candidate for candidate in candidates if (candidate in _BINARY_VRS) == binary), candidates[0])
+
+
+def _element_to_dict(element, bulkdata_uri, encoding, ds=None) -> dict:
+    vr = str(element.VR)
+    if " or " in vr:
+        vr = _resolve_vr(element, ds)
+    value = element.value
+    entry = {"vr": vr}
+    if value is None or (type(value) is str and not value):
+        return entry
+    if vr == "SQ":
+        if len(value):
+            # Los ítems heredan el juego de caracteres del dataset que los contiene
+            # y sus valores binarios van siempre en línea (el BulkDataURI solo direcciona tags de primer nivel)
+            entry["Value"] = [_dataset_to_dict(item, None, None, encoding) for item in value]
+        return entry
+    if vr in _BINARY_VRS:
+        if not len(value):
+            return entry
+        uri = bulkdata_uri(element.tag) if bulkdata_uri is not None and len(value) > BULKDATA_THRESHOLD else None
+        if uri is not None:
+            entry["BulkDataURI"] = uri
+        elif isinstance(value, (bytes, bytearray)):
+            entry["InlineBinary"] = base64.b64encode(value).decode("ascii")
+        return entry
+    encoder = _VALUE_ENCODERS.get(vr, _strings)
+    encoded = encoder(value)
+    if encoded:
+        entry["Value"] = encoded
+    return entry
+
+
+def _raw_to_dict(raw: RawDataElement, vr: str, encoding: str) -> dict:
+    """
+    Camino rápido para elementos aún sin convertir (como llegan en las respuestas
+    C-FIND): se decodifican los bytes directamente según el VR, sin crear el
+    DataElement de pydicom.
+    """
+    entry = {"vr": vr}
+    value = raw.value
+    if not value:
+        return entry
+    number_format = _STRUCT_FORMATS.get(vr)
+    if number_format is not None:
+        count = len(value) // struct.calcsize("<" + number_format)
+        values = struct.unpack(f"{'<' if raw.is_little_endian else '>'}{count}{number_format}", value)
+    elif vr == "AT":
+        pairs = struct.unpack(f"{'<' if raw.is_little_endian else '>'}{len(value) // 2}H", value)
+        values = [pairs[index] << 16 | pairs[index + 1] for index in range(0, len(pairs), 2)]
     else:
-        # pydicom a veces devuelve tipos no serializables (ej. DS)
-        return [str(elem.value)]
-
-def _dataset_to_dicomweb_dict(ds: Dataset) -> dict:
-    """Convierte un único dataset de pydicom a un diccionario con formato DICOMweb."""
-    dicomweb_dict = {}
-    for elem in ds:
-        tag_str = f"{elem.tag.group:04X}{elem.tag.element:04X}"
-        
-        if elem.VR == 'SQ':
-            # Para secuencias, se procesa cada item recursivamente
-            value = [_dataset_to_dicomweb_dict(item) for item in elem.value]
+        text = value.decode(encoding)
+        if vr in _TEXT_VRS:
+            values = [text.rstrip(" \x00")]
         else:
-            value = _format_value(elem)
+            values = [item.strip(" \x00") for item in text.split("\\")]
+    encoded = _VALUE_ENCODERS[vr](values)
+    if encoded and any(item is not None for item in encoded):
+        entry["Value"] = encoded
+    return entry
 
-        dicomweb_dict[tag_str] = {
-            "vr": elem.VR,
-            "Value": value
-        }
-    return dicomweb_dict
 
-def pydicom_to_dicomweb_json(datasets: list[Dataset]) -> list[dict]:
+def dataset_to_dicomweb_dict(ds: Dataset, include=None, bulkdata_uri=None) -> dict:
+    """
+    Convierte un dataset de pydicom al modelo DICOM JSON (PS3.18, anexo F).
+    'include' limita la salida a un conjunto de tags (None = todos). Los valores
+    binarios grandes de primer nivel se sustituyen por BulkDataURI = bulkdata_uri(tag);
+    sin 'bulkdata_uri' (o si devuelve None) van en línea como InlineBinary.
+    """
+    started = time.perf_counter()
+    result = _dataset_to_dict(ds, include, bulkdata_uri, "latin_1")
+    metrics.translator_seconds.observe(time.perf_counter() - started)
+    return result
+
+
+def _dataset_to_dict(ds: Dataset, include, bulkdata_uri, encoding) -> dict:
+    if 0x00080005 in ds:
+        # Con juegos de caracteres múltiples (extensiones ISO 2022) se usa la conversión de pydicom
+        charset = ds.SpecificCharacterSet
+        encoding = None if isinstance(charset, MultiValue) else _SIMPLE_CHARSETS.get(charset)
+    # Tags como enteros: ordenar y filtrar enteros evita las comparaciones de BaseTag en Python
+    elements = sorted((int(tag), element) for tag, element in ds.items())
+    result = {}
+    for tag, element in elements:
+        if include is not None and tag not in include:
+            continue
+        if encoding is not None and isinstance(element, RawDataElement) and element.value is not None:
+            vr = element.VR or _dictionary_vr(tag)
+            if vr in _VALUE_ENCODERS:
+                result[_tag_key(tag)] = _raw_to_dict(element, vr, encoding)
+                continue
+        result[_tag_key(tag)] = _element_to_dict(ds[tag], bulkdata_uri, encoding, ds)
+    return result
+
+
+def instance_bulkdata_uri(ds: Dataset, tag) -> str:
+    """
+    BulkDataURI de un valor binario de un resultado de búsqueda, servido por la ruta
+    '.../instances/{uid}/bulkdata/{tag}'. None si el resultado no identifica la instancia.
+    """
+    study_uid, series_uid, instance_uid = (ds.get(keyword) for keyword in ("StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID"))
+    if not (study_uid and series_uid and instance_uid):
+        return None
+    return f"/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/bulkdata/{int(tag):08X}"
+
+
+def result_to_json_bytes(ds: Dataset, include=None) -> bytes:
+    """Un resultado de búsqueda QIDO-RS como DICOM JSON, con BulkDataURI hacia su instancia."""
+    return dataset_to_dicomweb_json_bytes(ds, include, functools.partial(instance_bulkdata_uri, ds))
+
+
+def _dictionary_vr(tag: int):
+    """VR del diccionario para elementos en VR implícito (None si es privado o ambiguo)."""
+    if tag not in _DICTIONARY_VRS:
+        try:
+            vr = dictionary_VR(tag)
+        except KeyError:
+            vr = None
+        _DICTIONARY_VRS[tag] = vr if vr is not None and len(vr) == 2 else None
+    return _DICTIONARY_VRS[tag]
+
+
+if orjson is not None:
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def _dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+
+def dataset_to_dicomweb_json_bytes(ds: Dataset, include=None, bulkdata_uri=None) -> bytes:
+    """Serializa un único dataset como objeto DICOMweb JSON (para respuestas en streaming)."""
+    return _dumps(dataset_to_dicomweb_dict(ds, include, bulkdata_uri))
+
+
+def _json_bytes_shared(parts, include) -> list:
+    # En un proceso del pool: cada parte es un identificador en Implicit VR Little Endian
+    return [result_to_json_bytes(ipc.decode_dataset(part), include) for part in parts]
+
+
+async def datasets_to_json_bytes(datasets: list, include=None) -> list:
+    """
+    Serializa un lote de resultados de búsqueda. Los lotes de CPU_POOL_TRANSLATE_BATCH
+    resultados o más se traducen en el pool de procesos (los identificadores viajan
+    codificados en memoria compartida); los pequeños, aquí mismo.
+    """
+    async def inline():
+        return [result_to_json_bytes(ds, include) for ds in datasets]
+    if not cpu_pool.should_offload("translate", len(datasets)):
+        return await cpu_pool.run("translate", len(datasets), None, inline=inline)
+    return await cpu_pool.run("translate", len(datasets), _json_bytes_shared, include,
+                              shared=[ipc.encode_dataset(ds) for ds in datasets], inline=inline)
+
+
+def pydicom_to_dicomweb_json(datasets: list[Dataset], include=None) -> list[dict]:
     """
     Convierte una lista de datasets de pydicom a una lista de diccionarios
     conformes con el estándar DICOMweb QIDO-RS.
     """
     if not datasets:
         return []
-    
+
     logger.info(f"Traduciendo {len(datasets)} datasets al formato DICOMweb JSON.")
     try:
-        return [_dataset_to_dicomweb_dict(ds) for ds in datasets]
+        return [dataset_to_dicomweb_dict(ds, include) for ds in datasets]
     except Exception as e:
         logger.error(f"Error durante la traducción a DICOMweb JSON: {e}")
         return []
-
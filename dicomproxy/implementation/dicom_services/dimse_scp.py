@@ -1,73 +1,233 @@
 import asyncio
-from pynetdicom import AE, evt, AllStoragePresentationContexts, ALL_TRANSFER_SYNTAXES
-from pynetdicom.pdu_primitives import SCP_SCU_RoleSelectionNegotiation
+import itertools
+import threading
+import time
+from pynetdicom import AE, evt, AllStoragePresentationContexts, ALL_TRANSFER_SYNTAXES, _config
 from loguru import logger
-import pydicom
 
-async def handle_store(event, queue: asyncio.Queue):
+from implementation import metrics, tracing
+from implementation.config.settings import settings
+from implementation.dicom_services.spool import SpooledInstance, prepare_spool_dir
+from implementation.dicom_services.instance_store import instance_store
+
+# pynetdicom escribe cada C-STORE recibido directamente a un archivo temporal en formato
+# DICOM, sin decodificarlo; el manejador solo recibe la ruta.
+_config.STORE_RECV_CHUNKED_DATASET = True
+
+# Estados C-STORE
+STATUS_SUCCESS = 0x0000
+STATUS_OUT_OF_RESOURCES = 0xA700
+STATUS_PROCESSING_FAILURE = 0x0110
+
+# Cada cuánto comprueba un C-STORE que espera hueco en el búfer si la recuperación se abandonó
+_BUFFER_POLL_SECONDS = 0.2
+
+
+class RetrieveRequest:
     """
-    Este es el manejador de eventos que se activa cuando el PACS nos envía una imagen (C-STORE).
+    Recuperación en curso a la espera de instancias del Storage SCP.
+    Las instancias se entregan (en el event loop que la creó) como manejadores
+    SpooledInstance que se leen con 'get'; None marca el final de la recuperación.
+    El búfer es acotado: con RETRIEVE_BUFFER instancias sin consumir, el hilo de la
+    asociación espera antes de aceptar la siguiente y el PACS deja de enviar.
     """
-    try:
-        # El dataset DICOM (la imagen) viene en el evento
-        dataset = event.dataset
-        dataset.file_meta = event.file_meta
-
-        logger.success("¡Instancia DICOM recibida por el C-STORE SCP!")
-        
-        # Guardamos el dataset en un objeto BytesIO en memoria
-        with pydicom.filebase.DicomBytesIO() as buffer:
-            dataset.save_as(buffer, write_like_original=False)
-            dicom_bytes = buffer.getvalue()
-        
-        # Ponemos los bytes de la instancia en la cola para que la petición web los recoja
-        await queue.put(dicom_bytes)
-        
-        logger.info("Instancia puesta en la cola para ser enviada al cliente web.")
-        
-        # Devolvemos un estado de éxito al PACS
-        return 0x0000
-    except Exception as e:
-        logger.error(f"Error en el manejador C-STORE: {e}")
-        await queue.put(None) # Señal de error
-        return 0xA700 # Out of resources
-
-async def start_scp_server(queue: asyncio.Queue, port: int, aet: str):
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, message_id: int, study_uid: str = None,
+                 series_uid: str = None, expected_uids=None):
+        self.loop = loop
+        self.message_id = message_id
+        self.study_uid = study_uid
+        self.series_uid = series_uid
+        self.expected_uids = set(expected_uids or ())
+        self.slots = threading.Semaphore(settings.RETRIEVE_BUFFER)
+        # Además de las instancias cabe la marca de fin, que no espera hueco
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.RETRIEVE_BUFFER + 1)
+        self.closed = threading.Event()
+        self.received = 0
+        self.span = tracing.current_span()  # traza de la petición que espera las instancias
+
+    def deliver(self, item) -> bool:
+        """
+        Entrega una instancia desde el hilo de la asociación, esperando hueco en el búfer.
+        Si la recuperación se abandona mientras tanto, libera la instancia y devuelve False.
+        """
+        while not self.slots.acquire(timeout=_BUFFER_POLL_SECONDS):
+            if self.closed.is_set():
+                break
+        if self.closed.is_set():
+            item.release()
+            return False
+        self.received += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        return True
+
+    def finish(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    async def get(self):
+        """Siguiente instancia recibida (None al terminar); deja hueco para la siguiente."""
+        item = await self.queue.get()
+        if item is not None:
+            self.slots.release()
+        return item
+
+    def close(self):
+        """Abandona la recuperación: libera lo no consumido y desbloquea los C-STORE en espera."""
+        self.closed.set()
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                item.release()
+
+    def matches(self, study_uid: str, series_uid: str) -> bool:
+        if self.study_uid and study_uid != self.study_uid:
+            return False
+        if self.series_uid and series_uid != self.series_uid:
+            return False
+        return bool(self.study_uid)
+
+
+class StorageSCP:
     """
-    Inicia un servidor SCP temporal en un puerto específico y con un AET dado.
+    Storage SCP único y persistente que arranca con la aplicación.
+    Cada C-STORE entrante se enruta a la recuperación que lo espera por
+    Move Originator Message ID, por SOP Instance UID esperado o, en último
+    término, por el estudio/serie solicitados. El mismo manejador recibe los
+    C-STORE de las asociaciones C-GET salientes, enrutados por asociación.
     """
-    ae = AE(ae_title=aet)
-    
-    # Añadir todos los contextos de almacenamiento para aceptar cualquier tipo de imagen
-    ae.supported_contexts = AllStoragePresentationContexts
-    
-    # Definimos el manejador para el evento EVT_C_STORE
-    handlers = [(evt.EVT_C_STORE, handle_store, [queue])]
-
-    logger.info(f"Iniciando servidor C-STORE SCP temporal en el puerto {port} con AET {aet}")
-    
-    # Iniciar el servidor con un timeout de 15 segundos
-    # Si no recibe nada en 15s, se apagará para no quedar colgado.
-    try:
-        server = await asyncio.wait_for(
-            ae.start_server(('', port), block=False, evt_handlers=handlers),
-            timeout=2.0 # Timeout para el arranque del servidor
-        )
-        
-        # Esperar a que la cola reciba algo o se cumpla el timeout principal
-        await asyncio.wait_for(queue.get(), timeout=15.0)
-        # Una vez que la cola tiene un item, ya no necesitamos la tarea get(), así que la "des-obtenemos"
-        queue.task_done()
-        
-    except asyncio.TimeoutError:
-        logger.warning(f"Timeout esperando la instancia DICOM en el puerto {port}. El PACS no envió la imagen a tiempo.")
-        await queue.put(None) # Poner un None en la cola para señalar el timeout
-    except Exception as e:
-        logger.error(f"Error inesperado en el servidor SCP: {e}")
-        if not queue.full():
-            await queue.put(None)
-    finally:
-        if 'server' in locals() and server.is_running:
-            logger.info(f"Apagando servidor SCP del puerto {port}.")
-            server.shutdown()
 
+    def __init__(self):
+        self.ae_title = None
+        self.port = None
+        self._server = None
+        self._lock = threading.Lock()
+        self._by_message_id: dict[int, RetrieveRequest] = {}
+        self._by_uid: dict[str, RetrieveRequest] = {}
+        self._by_association: dict = {}
+        self._message_ids = itertools.cycle(range(1, 65536))
+        self.unrouted = 0
+
+    # --- Ciclo de vida ---
+    def start(self, aet: str, port: int):
+        if self._server is not None:
+            return
+        prepare_spool_dir()
+        ae = AE(ae_title=aet)
+        ae.maximum_associations = settings.STORAGE_SCP_MAX_ASSOCIATIONS
+        # Aceptar cualquier tipo de objeto en cualquier sintaxis de transferencia
+        for cx in AllStoragePresentationContexts:
+            ae.add_supported_context(cx.abstract_syntax, ALL_TRANSFER_SYNTAXES)
+        handlers = [(evt.EVT_C_STORE, self.handle_store)]
+        self._server = ae.start_server(('', port), block=False, evt_handlers=handlers)
+        self.ae_title = aet
+        self.port = port
+        logger.success(f"Storage SCP persistente escuchando en el puerto {port} con AET {aet}")
+
+    def stop(self):
+        if self._server is not None:
+            logger.info(f"Apagando Storage SCP del puerto {self.port}.")
+            self._server.shutdown()
+            self._server = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._server is not None
+
+    # --- Registro de recuperaciones ---
+    def register(self, study_uid: str = None, series_uid: str = None, expected_uids=None) -> RetrieveRequest:
+        """Reserva un Message ID libre y registra una recuperación a la espera de instancias."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for _ in range(65535):
+                message_id = next(self._message_ids)
+                if message_id not in self._by_message_id:
+                    break
+            else:
+                raise RuntimeError("No quedan Message ID libres para nuevas recuperaciones.")
+            request = RetrieveRequest(loop, message_id, study_uid, series_uid, expected_uids)
+            self._by_message_id[message_id] = request
+            for uid in request.expected_uids:
+                self._by_uid[uid] = request
+        return request
+
+    def unregister(self, request: RetrieveRequest):
+        with self._lock:
+            if self._by_message_id.get(request.message_id) is request:
+                del self._by_message_id[request.message_id]
+            for uid in request.expected_uids:
+                if self._by_uid.get(uid) is request:
+                    del self._by_uid[uid]
+
+    def bind_association(self, assoc, request: RetrieveRequest):
+        """
+        Asocia una asociación C-GET saliente a la recuperación que la usa: los C-STORE
+        que llegan por ella pertenecen a esa recuperación.
+        """
+        with self._lock:
+            self._by_association[assoc] = request
+
+    def unbind_association(self, assoc):
+        with self._lock:
+            self._by_association.pop(assoc, None)
+
+    def _route(self, message_id, instance: SpooledInstance, assoc=None):
+        with self._lock:
+            if assoc is not None and assoc in self._by_association:
+                return self._by_association[assoc]
+            if message_id is not None and message_id in self._by_message_id:
+                return self._by_message_id[message_id]
+            if instance.sop_instance_uid in self._by_uid:
+                return self._by_uid[instance.sop_instance_uid]
+            for request in self._by_message_id.values():
+                if request.matches(instance.study_uid, instance.series_uid):
+                    return request
+        return None
+
+    # --- Manejador C-STORE ---
+    def handle_store(self, event):
+        """
+        Manejador de EVT_C_STORE; se ejecuta en el hilo de la asociación entrante
+        (o de la asociación C-GET saliente).
+        Los bytes recibidos se conservan tal cual (sin decodificar ni recodificar)
+        y al consumidor solo le llega un manejador de la instancia.
+        """
+        started_ns = time.time_ns()
+        request_primitive = event.request
+        sop_uid = request_primitive.AffectedSOPInstanceUID
+        message_id = request_primitive.MoveOriginatorMessageID
+        try:
+            instance = SpooledInstance.from_received_file(event.dataset_path, sop_uid, request_primitive.AffectedSOPClassUID)
+            target = self._route(message_id, instance, event.assoc)
+            if target is None:
+                self.unrouted += 1
+                metrics.cstore_instances_total.labels("unrouted").inc()
+                instance.release()
+                logger.warning(f"Instancia {sop_uid} recibida sin ninguna recuperación que la espere; se rechaza.")
+                return STATUS_OUT_OF_RESOURCES
+            # El C-STORE se anota en la traza de la petición que espera la instancia
+            with tracing.span("C-STORE", tracing.KIND_SERVER, parent=target.span, start_ns=started_ns,
+                              **{"dicom.sop_instance_uid": sop_uid, "dicom.bytes": instance.size}):
+                try:
+                    # La instancia se guarda en la caché local antes de entregarla
+                    instance = instance_store.put(instance)
+                except Exception as e:
+                    logger.error(f"No se pudo guardar la instancia {sop_uid} en la caché local: {e}")
+                if not target.deliver(instance):
+                    logger.debug(f"Instancia {sop_uid} recibida tras abandonarse su recuperación; queda solo en la caché.")
+                metrics.cstore_instances_total.labels("stored").inc()
+                metrics.cstore_bytes_total.inc(instance.size)
+                logger.debug(f"Instancia {sop_uid} entregada a la recuperación con Message ID {target.message_id}.")
+            return STATUS_SUCCESS
+        except Exception as e:
+            logger.error(f"Error en el manejador C-STORE: {e}")
+            metrics.cstore_instances_total.labels("failed").inc()
+            return STATUS_PROCESSING_FAILURE
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._by_message_id)
+        return {"running": self.is_running, "ae_title": self.ae_title, "port": self.port,
+                "pending_retrievals": pending, "unrouted_instances": self.unrouted}
+
+
+storage_scp = StorageSCP()
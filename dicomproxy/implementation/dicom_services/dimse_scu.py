@@ -1,28 +1,110 @@
-from pynetdicom import AE, evt
-from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelFind
+from pynetdicom import evt, build_role, StoragePresentationContexts
+from pynetdicom.sop_class import (
+    StudyRootQueryRetrieveInformationModelFind,
+    StudyRootQueryRetrieveInformationModelMove,
+    StudyRootQueryRetrieveInformationModelGet,
+    Verification,
+)
+from pydicom.uid import (
+    ImplicitVRLittleEndian, ExplicitVRLittleEndian, DeflatedExplicitVRLittleEndian, RLELossless,
+    JPEGBaseline8Bit, JPEGExtended12Bit, JPEGLosslessSV1, JPEG2000Lossless, JPEG2000,
+)
 from pydicom.dataset import Dataset
 from loguru import logger
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+import time
 
 # Ahora importamos 'crud' para acceder a la base de datos
 from implementation import crud
+from implementation import metrics, tracing
 from implementation.config.settings import settings # Todavía lo usamos para el PROXY_AET
+from implementation.dicom_services.association_pool import association_pool, AssociationPool
+from implementation.dicom_services.dimse_scp import storage_scp
+from implementation.dicom_services.health import health_prober
+from implementation.dicom_services.circuit_breaker import circuit_breakers
+from implementation.dicom_services.scheduler import dimse_scheduler, Overloaded, current_client
+
+RETRIEVAL_STRATEGIES = ("C-MOVE", "C-GET")
+
+
+class FindError(Exception):
+    """El C-FIND no pudo completarse (sin asociación, timeout o estado de fallo del PACS)."""
+
+# Message ID de cada C-FIND, para poder cancelarlo con C-CANCEL
+_find_msg_ids = itertools.count(1)
 
-def perform_c_find(pacs_config: dict, query_params: dict):
-    """
-    Realiza una única operación C-FIND a un PACS específico.
-    Esta función está diseñada para ser ejecutada en un hilo separado.
-    """
-    aet = pacs_config['aetitle']
-    ip = pacs_config['ip_address']
-    port = pacs_config['port']
-    description = pacs_config['description']
-    
-    logger.info(f"Iniciando C-FIND en '{description}' ({aet}@{ip}:{port})")
 
-    ae = AE(ae_title=settings.PROXY_AET)
-    ae.add_requested_context(StudyRootQueryRetrieveInformationModelFind)
+class FindCall:
+    """C-FIND en curso sobre una asociación; 'cancel()' envía C-CANCEL desde cualquier hilo."""
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.assoc = None
+        self.msg_id = None
+        self.cancelled = False
+
+    def _bind(self, assoc, msg_id: int) -> bool:
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.assoc, self.msg_id = assoc, msg_id
+            return True
+
+    def _unbind(self):
+        with self._lock:
+            self.assoc = None
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            assoc, msg_id = self.assoc, self.msg_id
+        dimse_scheduler.interrupt()  # por si aún espera hueco en la cola
+        if assoc is not None and assoc.is_established:
+            try:
+                assoc.send_c_cancel(msg_id, query_model=StudyRootQueryRetrieveInformationModelFind)
+            except Exception as e:
+                logger.debug(f"No se pudo enviar C-CANCEL (Message ID {msg_id}): {e}")
+
+# Sintaxis propuestas para los C-STORE que llegan por C-GET (se aceptan tal cual, sin transcodificar)
+GET_TRANSFER_SYNTAXES = [
+    ExplicitVRLittleEndian, ImplicitVRLittleEndian, DeflatedExplicitVRLittleEndian, RLELossless,
+    JPEGBaseline8Bit, JPEGExtended12Bit, JPEGLosslessSV1, JPEG2000Lossless, JPEG2000,
+]
+
+# Pool de asociaciones C-GET: el almacenamiento llega por la misma asociación
+# (rol SCP negociado para cada clase de almacenamiento), sin puerto de entrada.
+get_association_pool = AssociationPool(
+    ae_title=settings.PROXY_AET,
+    max_per_pacs=settings.POOL_MAX_ASSOCIATIONS_PER_PACS,
+    idle_timeout=settings.POOL_IDLE_TIMEOUT,
+    health_check_interval=settings.POOL_HEALTH_CHECK_INTERVAL,
+    requested_contexts=[StudyRootQueryRetrieveInformationModelGet, Verification]
+    + [(cx.abstract_syntax, GET_TRANSFER_SYNTAXES) for cx in StoragePresentationContexts],
+    ext_neg=[build_role(cx.abstract_syntax, scp_role=True) for cx in StoragePresentationContexts],
+    evt_handlers=[(evt.EVT_C_STORE, storage_scp.handle_store)],
+)
+
+def retrieval_strategy(pacs_config) -> str:
+    """Modo de recuperación configurado para el PACS ('C-MOVE' por defecto)."""
+    if 'retrieval_strategy' in pacs_config.keys() and pacs_config['retrieval_strategy'] in RETRIEVAL_STRATEGIES:
+        return pacs_config['retrieval_strategy']
+    return "C-MOVE"
+
+# Pool de hilos compartido y acotado para todas las búsquedas C-FIND (síncronas y asíncronas)
+find_executor = ThreadPoolExecutor(max_workers=settings.QUERY_MAX_WORKERS, thread_name_prefix="dimse-find")
+
+def build_find_identifier(query_params) -> Dataset:
+    """
+    Construye el identificador C-FIND a partir de los parámetros de búsqueda.
+    Si ya se recibe un Dataset (p. ej. desde QIDO-RS) se usa tal cual; un dict
+    genera la búsqueda clásica a nivel STUDY por PatientID.
+    """
+    if isinstance(query_params, Dataset):
+        return query_params
     ds = Dataset()
     ds.QueryRetrieveLevel = "STUDY"
     if "PatientID" in query_params:
@@ -33,60 +115,185 @@ def perform_c_find(pacs_config: dict, query_params: dict):
     ds.StudyDate = ""
     ds.StudyDescription = ""
     ds.ModalitiesInStudy = ""
+    return ds
+
+def iter_c_find(pacs_config: dict, query_params, timeout: float = None, call: FindCall = None, client: str = None):
+    """
+    Realiza una única operación C-FIND a un PACS específico y entrega cada
+    identificador en cuanto llega. La asociación se toma del pool compartido;
+    si el consumidor abandona la iteración a medias, la asociación se descarta.
+    'timeout' acota el establecimiento y la espera de cada respuesta; si no hay
+    asociación, se agota el tiempo o el PACS responde con un estado de fallo
+    se lanza FindError. Con 'call', otro hilo puede cancelar el C-FIND en curso: el
+    PACS responde con estado Cancel y la asociación vuelve al pool. La operación
+    espera antes su turno en 'dimse_scheduler' (Overloaded si la cola está llena).
+    """
+    aet = pacs_config['aetitle']
+    ip = pacs_config['ip_address']
+    port = pacs_config['port']
+    description = pacs_config['description']
+    
+    logger.info(f"Iniciando C-FIND en '{description}' ({aet}@{ip}:{port})")
+
+    ds = build_find_identifier(query_params)
+
+    count = 0
+    label, result = metrics.pacs_label(pacs_config), "error"
+    with tracing.span("C-FIND", tracing.KIND_CLIENT, **{"dicom.pacs": description, "dicom.aet": aet}) as find_span, \
+            dimse_scheduler.slot(pacs_config, client, cancelled=(lambda: call.cancelled) if call is not None else None):
+        in_flight = metrics.cfind_in_flight.labels(label)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            with association_pool.acquire(pacs_config, timeout=timeout) as assoc:
+                if assoc is None:
+                    logger.error(f"Fallo al establecer asociación con '{description}'")
+                    raise FindError(f"Sin asociación con '{description}'")
+                logger.success(f"Asociación disponible con '{description}'")
+                msg_id = next(_find_msg_ids) % 0xFFFF + 1
+                if call is not None and not call._bind(assoc, msg_id):
+                    result = "cancelled"
+                    return
+                try:
+                    responses = assoc.send_c_find(ds, StudyRootQueryRetrieveInformationModelFind, msg_id=msg_id)
+                    for status, identifier in responses:
+                        if not status:
+                            # Sin respuesta dentro del timeout DIMSE: pynetdicom aborta la asociación
+                            result = "timeout"
+                            raise FindError(f"'{description}' no respondió al C-FIND a tiempo")
+                        if status.Status in (0xFF00, 0xFF01):
+                            if identifier:
+                                if not count:
+                                    find_span.event("first_response")
+                                count += 1
+                                yield identifier
+                        elif status.Status == 0xFE00:
+                            result = "cancelled"
+                            logger.info(f"C-FIND en '{description}' cancelado.")
+                        elif status.Status != 0x0000:
+                            raise FindError(f"'{description}' respondió al C-FIND con estado 0x{status.Status:04X}")
+                        else:
+                            result = "success"
+                    find_span.event("last_response")
+                finally:
+                    if call is not None:
+                        call._unbind()
+        except GeneratorExit:
+            result = "abandoned"
+            raise
+        finally:
+            in_flight.dec()
+            metrics.cfind_duration_seconds.labels(label, result).observe(time.perf_counter() - started)
+            metrics.cfind_results.labels(label).observe(count)
+            find_span.set("dicom.result", result)
+            find_span.set("dicom.results", count)
+
+    logger.info(f"Búsqueda en '{description}' finalizada. Se encontraron {count} resultados.")
+
+def perform_c_find(pacs_config: dict, query_params, call: FindCall = None, client: str = None):
+    """
+    Realiza una única operación C-FIND a un PACS específico.
+    Esta función está diseñada para ser ejecutada en un hilo separado.
+    """
+    return list(iter_c_find(pacs_config, query_params, timeout=health_prober.timeout_for(pacs_config), call=call, client=client))
 
-    results = []
-    assoc = ae.associate(ip, port, ae_title=aet)
+def get_active_pacs():
+    """Devuelve los PACS marcados como activos (de la configuración en memoria, sin leer la BD)."""
+    return crud.get_active_pacs()
 
-    if assoc.is_established:
-        logger.success(f"Asociación exitosa con '{description}'")
-        responses = assoc.send_c_find(ds, StudyRootQueryRetrieveInformationModelFind, query_model='S')
-        for status, identifier in responses:
-            if status and status.Status in (0xFF00, 0xFF01) and identifier:
-                results.append(identifier)
-        assoc.release()
+def is_queryable(pacs_config) -> bool:
+    return health_prober.is_available(pacs_config) and circuit_breakers.available(pacs_config)
+
+def partition_pacs():
+    """
+    Separa los PACS activos en (consultables, omitidos). Se omiten los caídos según
+    el sondeo C-ECHO y los que tienen el circuito abierto.
+    """
+    queryable, skipped = [], []
+    for pacs in get_active_pacs():
+        if is_queryable(pacs):
+            queryable.append(pacs)
+        else:
+            skipped.append(pacs)
+    if skipped:
+        logger.warning(f"Se omiten PACS caídos o con el circuito abierto: {', '.join(pacs['description'] for pacs in skipped)}")
+    return queryable, skipped
+
+def get_queryable_pacs():
+    """PACS activos que no están caídos ni tienen el circuito abierto."""
+    return partition_pacs()[0]
+
+def build_move_identifier(study_uid: str, series_uid: str = None, instance_uids=None) -> Dataset:
+    """Identificador C-MOVE/C-GET al nivel más bajo indicado (STUDY, SERIES o IMAGE)."""
+    ds = Dataset()
+    ds.StudyInstanceUID = study_uid
+    if instance_uids:
+        ds.QueryRetrieveLevel = "IMAGE"
+        ds.SeriesInstanceUID = series_uid or ""
+        ds.SOPInstanceUID = list(instance_uids) if len(instance_uids) > 1 else list(instance_uids)[0]
+    elif series_uid:
+        ds.QueryRetrieveLevel = "SERIES"
+        ds.SeriesInstanceUID = series_uid
     else:
-        logger.error(f"Fallo al establecer asociación con '{description}'")
+        ds.QueryRetrieveLevel = "STUDY"
+    return ds
+
+def move_instances(pacs_config: dict, study_uid: str, series_uid: str = None, instance_uids=None,
+                   move_destination_aet: str = None, msg_id: int = 1, client: str = None):
+    """
+    Envía un C-MOVE al PACS indicado para que mande las instancias al Storage SCP
+    persistente. 'msg_id' es el Message ID que el PACS devolverá como Move Originator
+    Message ID en cada C-STORE. Devuelve el estado final del C-MOVE (o None si no
+    hubo asociación). Se ejecuta en un hilo: bloquea hasta la respuesta final.
+    """
+    description = pacs_config['description']
+    ds = build_move_identifier(study_uid, series_uid, instance_uids)
+    logger.info(f"Iniciando C-MOVE ({ds.QueryRetrieveLevel}) en '{description}' hacia '{move_destination_aet}' (Message ID {msg_id})")
 
-    logger.info(f"Búsqueda en '{description}' finalizada. Se encontraron {len(results)} resultados.")
-    return results
+    final_status = None
+    with tracing.span("C-MOVE", tracing.KIND_CLIENT, **{"dicom.pacs": description, "dicom.message_id": msg_id}) as move_span, \
+            dimse_scheduler.slot(pacs_config, client), association_pool.acquire(pacs_config) as assoc:
+        if assoc is None:
+            logger.error(f"Fallo al establecer asociación con '{description}'")
+            return None
+        responses = assoc.send_c_move(ds, move_destination_aet, StudyRootQueryRetrieveInformationModelMove, msg_id=msg_id)
+        for status, _ in responses:
+            if status:
+                final_status = status
+        move_span.set("dicom.status", f"0x{final_status.Status:04X}" if final_status is not None else None)
+    if final_status is not None:
+        completed = final_status.get("NumberOfCompletedSuboperations", "?")
+        failed = final_status.get("NumberOfFailedSuboperations", 0)
+        logger.info(f"C-MOVE en '{description}' finalizado con estado 0x{final_status.Status:04X}: {completed} completadas, {failed} fallidas.")
+    return final_status
 
-def find_studies(query_params: dict):
+def get_instances(pacs_config: dict, request, study_uid: str, series_uid: str = None, instance_uids=None, client: str = None):
     """
-    Realiza una búsqueda C-FIND federada en todos los PACS activos en paralelo.
+    Envía un C-GET al PACS indicado; las instancias llegan como sub-operaciones C-STORE
+    por la misma asociación y el Storage SCP las entrega a 'request' (RetrieveRequest).
+    Devuelve el estado final del C-GET (o None si no hubo asociación). Bloquea el hilo.
     """
-    logger.info("Iniciando búsqueda C-FIND federada...")
-    
-    # 1. Obtener todos los PACS de la base de datos y filtrar los activos
-    all_pacs = crud.get_all_pacs()
-    active_pacs = [pacs for pacs in all_pacs if pacs['is_active']]
-
-    if not active_pacs:
-        logger.warning("No hay ningún PACS configurado como 'Activo'. No se realizará la búsqueda.")
-        return []
-
-    all_results = []
-    # 2. Usar un ThreadPoolExecutor para lanzar las búsquedas en paralelo
-    with ThreadPoolExecutor(max_workers=len(active_pacs)) as executor:
-        # Creamos un futuro para cada búsqueda en un PACS activo
-        future_to_pacs = {executor.submit(perform_c_find, pacs, query_params): pacs for pacs in active_pacs}
-        
-        # 3. Recopilar los resultados a medida que se completan
-        for future in as_completed(future_to_pacs):
-            pacs_description = future_to_pacs[future]['description']
-            try:
-                pacs_results = future.result()
-                if pacs_results:
-                    all_results.extend(pacs_results)
-            except Exception as exc:
-                logger.error(f"La búsqueda en '{pacs_description}' generó una excepción: {exc}")
-
-    logger.success(f"Búsqueda federada completada. Total de resultados combinados: {len(all_results)}")
-    return all_results
-
-# La función move_instances no cambia, ya que se dirige a un PACS específico
-# (Asumiremos que la imagen a mover ya fue encontrada y sabemos en qué PACS está,
-# aunque esto es una simplificación que podríamos refinar más adelante).
-
-def move_instances(study_uid, series_uid, instance_uid, move_destination_aet):
-    # ... (código existente de C-MOVE)
-    pass
+    description = pacs_config['description']
+    ds = build_move_identifier(study_uid, series_uid, instance_uids)
+    logger.info(f"Iniciando C-GET ({ds.QueryRetrieveLevel}) en '{description}'")
+
+    final_status = None
+    with tracing.span("C-GET", tracing.KIND_CLIENT, **{"dicom.pacs": description, "dicom.message_id": request.message_id}) as get_span, \
+            dimse_scheduler.slot(pacs_config, client), get_association_pool.acquire(pacs_config) as assoc:
+        if assoc is None:
+            logger.error(f"Fallo al establecer asociación C-GET con '{description}'")
+            return None
+        storage_scp.bind_association(assoc, request)
+        try:
+            responses = assoc.send_c_get(ds, StudyRootQueryRetrieveInformationModelGet, msg_id=request.message_id)
+            for status, _ in responses:
+                if status:
+                    final_status = status
+            get_span.set("dicom.status", f"0x{final_status.Status:04X}" if final_status is not None else None)
+        finally:
+            storage_scp.unbind_association(assoc)
+    if final_status is not None:
+        completed = final_status.get("NumberOfCompletedSuboperations", "?")
+        failed = final_status.get("NumberOfFailedSuboperations", 0)
+        logger.info(f"C-GET en '{description}' finalizado con estado 0x{final_status.Status:04X}: {completed} completadas, {failed} fallidas.")
+    return final_status
@@ -0,0 +1,242 @@
+import io
+import mmap
+import struct
+from contextlib import contextmanager
+import pydicom
+from pydicom.uid import UID
+from loguru import logger
+
+from implementation.dicom_services.spool import SpooledInstance
+
+# Los elementos mayores que esto no se leen al abrir el archivo (solo se anota su posición)
+DEFER_SIZE = 1024
+
+PIXEL_DATA_TAG = 0x7FE00010
+ITEM_TAG = 0xFFFEE000
+SEQUENCE_DELIMITER_TAG = 0xFFFEE0DD
+
+# Tipo de medio de cada fotograma según la sintaxis de transferencia (PS3.18, 8.7.3)
+ENCAPSULATED_MEDIA_TYPES = {
+    "1.2.840.10008.1.2.4.50": "image/jpeg",
+    "1.2.840.10008.1.2.4.51": "image/jpeg",
+    "1.2.840.10008.1.2.4.57": "image/jpeg",
+    "1.2.840.10008.1.2.4.70": "image/jpeg",
+    "1.2.840.10008.1.2.4.80": "image/jls",
+    "1.2.840.10008.1.2.4.81": "image/jls",
+    "1.2.840.10008.1.2.4.90": "image/jp2",
+    "1.2.840.10008.1.2.4.91": "image/jp2",
+    "1.2.840.10008.1.2.4.201": "image/jphc",
+    "1.2.840.10008.1.2.4.202": "image/jphc",
+    "1.2.840.10008.1.2.4.203": "image/jphc",
+    "1.2.840.10008.1.2.5": "image/dicom-rle",
+}
+NATIVE_MEDIA_TYPE = "application/octet-stream"
+
+
+class FrameError(ValueError):
+    """La lista de fotogramas no es válida o el objeto no permite extraerlos."""
+
+
+class FrameNotFound(LookupError):
+    """Se ha pedido un fotograma que el objeto no tiene."""
+
+
+def parse_frame_list(frame_list: str) -> list:
+    """Convierte '1,3,5' en [1, 3, 5] (los fotogramas se numeran desde 1)."""
+    try:
+        numbers = [int(part) for part in frame_list.split(",")]
+    except ValueError:
+        raise FrameError(f"Lista de fotogramas no válida: '{frame_list}'")
+    if not numbers or any(number < 1 for number in numbers):
+        raise FrameError(f"Los fotogramas se numeran desde 1: '{frame_list}'")
+    return numbers
+
+
+@contextmanager
+def _mapped(instance: SpooledInstance):
+    """Buffer de solo lectura con el archivo completo: mmap si está en disco, los bytes si está en memoria."""
+    if instance.in_memory:
+        yield instance.data
+        return
+    with open(instance.path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+class MappedFile:
+    """
+    Interfaz de archivo (read/seek/tell) sobre un mmap o una vista de memoria
+    compartida, para que pydicom lea la cabecera sin copiar el archivo entero.
+    """
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+        self._position = 0
+        self.name = None
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._mapped) if size is None or size < 0 else min(self._position + size, len(self._mapped))
+        data = bytes(self._mapped[self._position:end])
+        self._position = end
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self._position, 2: len(self._mapped)}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+class _PixelDataLayout:
+    """Cabecera de la instancia y posición del valor de Pixel Data dentro del archivo."""
+
+    def __init__(self, buffer):
+        fp = io.BytesIO(buffer) if isinstance(buffer, bytes) else MappedFile(buffer)
+        ds = pydicom.dcmread(fp, stop_before_pixels=True, defer_size=DEFER_SIZE)
+        self.dataset = ds
+        self.transfer_syntax = UID(ds.file_meta.TransferSyntaxUID)
+        if self.transfer_syntax.is_deflated:
+            raise FrameError("No se pueden extraer fotogramas de un objeto con sintaxis Deflated.")
+        self.little_endian = self.transfer_syntax.is_little_endian
+        self.endian = "<" if self.little_endian else ">"
+        self.number_of_frames = int(ds.get("NumberOfFrames") or 1)
+
+        # dcmread se detiene justo antes de la etiqueta (7FE0,0010)
+        position = fp.tell()
+        group, element = struct.unpack_from(f"{self.endian}HH", buffer, position)
+        if (group << 16 | element) != PIXEL_DATA_TAG:
+            raise FrameError("El objeto no contiene Pixel Data.")
+        if self.transfer_syntax.is_implicit_VR:
+            self.length = struct.unpack_from(f"{self.endian}L", buffer, position + 4)[0]
+            self.value_offset = position + 8
+        else:
+            self.length = struct.unpack_from(f"{self.endian}L", buffer, position + 8)[0]
+            self.value_offset = position + 12
+
+    @property
+    def media_type(self) -> str:
+        if self.transfer_syntax.is_encapsulated:
+            return ENCAPSULATED_MEDIA_TYPES.get(self.transfer_syntax, NATIVE_MEDIA_TYPE)
+        return NATIVE_MEDIA_TYPE
+
+
+def _native_frames(buffer, layout: _PixelDataLayout, numbers) -> list:
+    ds = layout.dataset
+    frame_bits = int(ds.Rows) * int(ds.Columns) * int(ds.get("SamplesPerPixel", 1)) * int(ds.BitsAllocated)
+    if frame_bits % 8:
+        raise FrameError("Los fotogramas de 1 bit no alineados a byte no se pueden extraer por separado.")
+    frame_size = frame_bits // 8
+    frames = []
+    for number in numbers:
+        start = layout.value_offset + (number - 1) * frame_size
+        frames.append(bytes(buffer[start:start + frame_size]))
+    return frames
+
+
+def _fragments(buffer, layout: _PixelDataLayout):
+    """
+    Recorre solo las cabeceras de los ítems del Pixel Data encapsulado. Devuelve la
+    Basic Offset Table y la lista (posición, longitud) de los fragmentos.
+    """
+    endian = layout.endian
+    position = layout.value_offset
+    tag = struct.unpack_from(f"{endian}HH", buffer, position)
+    length = struct.unpack_from(f"{endian}L", buffer, position + 4)[0]
+    if (tag[0] << 16 | tag[1]) != ITEM_TAG:
+        raise FrameError("Pixel Data encapsulado sin Basic Offset Table.")
+    offsets = list(struct.unpack_from(f"{endian}{length // 4}L", buffer, position + 8)) if length else []
+    position += 8 + length
+    first_fragment = position
+    fragments = []
+    while position + 8 <= len(buffer):
+        group, element = struct.unpack_from(f"{endian}HH", buffer, position)
+        length = struct.unpack_from(f"{endian}L", buffer, position + 4)[0]
+        if (group << 16 | element) == SEQUENCE_DELIMITER_TAG:
+            break
+        if (group << 16 | element) != ITEM_TAG:
+            raise FrameError(f"Etiqueta inesperada en el Pixel Data encapsulado (posición {position}).")
+        fragments.append((position, length))
+        position += 8 + length
+    return offsets, first_fragment, fragments
+
+
+def _raw_value(buffer, ds, tag: int):
+    """Bytes de un elemento de la cabecera; si se difirió al leerla, se toman directamente del buffer."""
+    if tag not in ds:
+        return None
+    element = ds.get_item(tag)
+    if getattr(element, "value", None) is None and hasattr(element, "value_tell"):
+        return bytes(buffer[element.value_tell:element.value_tell + element.length])
+    return element.value
+
+
+def _encapsulated_frames(buffer, layout: _PixelDataLayout, numbers) -> list:
+    ds = layout.dataset
+    frame_count = layout.number_of_frames
+    extended = _raw_value(buffer, ds, 0x7FE00001)
+    lengths_table = _raw_value(buffer, ds, 0x7FE00002)
+    if extended and lengths_table:
+        # Tabla extendida: posición y longitud de cada fotograma, sin recorrer fragmentos
+        offsets = struct.unpack(f"{layout.endian}{len(extended) // 8}Q", extended)
+        lengths = struct.unpack(f"{layout.endian}{len(lengths_table) // 8}Q", lengths_table)
+        base = layout.value_offset + 8 + struct.unpack_from(f"{layout.endian}L", buffer, layout.value_offset + 4)[0]
+        frames = []
+        for number in numbers:
+            start = base + offsets[number - 1] + 8
+            frames.append(bytes(buffer[start:start + lengths[number - 1]]))
+        return frames
+
+    offsets, first_fragment, fragments = _fragments(buffer, layout)
+    if offsets:
+        # Basic Offset Table: cada fotograma son los fragmentos entre su posición y la del siguiente
+        starts = [first_fragment + offset for offset in offsets]
+        grouped = []
+        for index, start in enumerate(starts):
+            end = starts[index + 1] if index + 1 < len(starts) else float("inf")
+            grouped.append([fragment for fragment in fragments if start <= fragment[0] < end])
+    elif len(fragments) == frame_count:
+        grouped = [[fragment] for fragment in fragments]
+    elif frame_count == 1:
+        grouped = [fragments]
+    else:
+        raise FrameError("Sin Basic Offset Table no se pueden delimitar los fotogramas (varios fragmentos por fotograma).")
+
+    frames = []
+    for number in numbers:
+        frames.append(b"".join(bytes(buffer[position + 8:position + 8 + length]) for position, length in grouped[number - 1]))
+    return frames
+
+
+def read_bulkdata(instance: SpooledInstance, tag: int):
+    """
+    Bytes del valor de un elemento de primer nivel (destino de los BulkDataURI de
+    QIDO-RS), tal como están en el archivo. Los demás valores grandes no se leen.
+    None si la instancia no tiene el elemento o es una secuencia.
+    """
+    with _mapped(instance) as buffer:
+        fp = io.BytesIO(buffer) if isinstance(buffer, bytes) else MappedFile(buffer)
+        ds = pydicom.dcmread(fp, defer_size=DEFER_SIZE, specific_tags=[tag])
+        value = _raw_value(buffer, ds, tag)
+    return bytes(value) if isinstance(value, (bytes, bytearray, memoryview)) else None
+
+
+def read_frames(instance: SpooledInstance, numbers) -> tuple:
+    """
+    Extrae los fotogramas pedidos (numerados desde 1) sin leer ni decodificar el
+    Pixel Data completo: la cabecera se lee con elementos diferidos, el archivo se
+    proyecta en memoria (mmap) y solo se copian los bytes de cada fotograma.
+    Devuelve (tipo de medio, sintaxis de transferencia, lista de bytes por fotograma).
+    """
+    with _mapped(instance) as buffer:
+        layout = _PixelDataLayout(buffer)
+        missing = [number for number in numbers if number > layout.number_of_frames]
+        if missing:
+            raise FrameNotFound(f"La instancia {instance.sop_instance_uid} solo tiene {layout.number_of_frames} fotogramas (pedidos: {missing}).")
+        if layout.transfer_syntax.is_encapsulated:
+            frames = _encapsulated_frames(buffer, layout, numbers)
+        else:
+            frames = _native_frames(buffer, layout, numbers)
+    logger.debug(f"Fotogramas {numbers} extraídos de {instance.sop_instance_uid} ({layout.transfer_syntax.name}).")
+    return layout.media_type, str(layout.transfer_syntax), frames
@@ -0,0 +1,324 @@
+"""
+Gateway DIMSE: un único proceso posee todo lo que no se puede repartir entre varios
+workers HTTP (el Storage SCP y su puerto, los pools de asociaciones salientes, el
+planificador DIMSE, la caché de consultas, el sondeo C-ECHO, el indexador de logs y
+el archivo de log). Los workers (uvicorn --workers N) le piden las operaciones por un
+socket Unix con 'gateway_client.dimse_gateway'.
+
+Sin DIMSE_GATEWAY_SOCKET todo sigue en el proceso web, como siempre (un solo worker).
+Arranque con gateway (desde el directorio 'dicomproxy'):
+    DIMSE_GATEWAY_SOCKET=/run/dicomproxy/gateway.sock python -m implementation.dicom_services.gateway
+    DIMSE_GATEWAY_SOCKET=/run/dicomproxy/gateway.sock uvicorn implementation.main:app --workers 4
+"""
+import asyncio
+import os
+import signal
+import sys
+from pathlib import Path
+from loguru import logger
+
+from implementation import crud, database, metrics, tracing
+from implementation.config.logging_config import setup_logging, rotate_log_file
+from implementation.config.settings import settings
+from implementation.dicom_services import dimse_scu, ipc, retrieval
+from implementation.dicom_services.association_pool import association_pool
+from implementation.dicom_services.dimse_scp import storage_scp
+from implementation.dicom_services.gateway_client import dimse_gateway
+from implementation.dicom_services.health import health_prober
+from implementation.dicom_services.instance_store import instance_store
+from implementation.dicom_services.query_cache import query_cache
+from implementation.dicom_services.query_engine import query_engine, QueryOutcome
+from implementation.dicom_services.scheduler import dimse_scheduler, Overloaded, current_client
+from implementation.logviewer.indexer import log_indexer
+
+
+# --- Métricas del estado DIMSE (calculadas al exportar) ---
+def _pool_gauge(): return {(name, pacs, state): counts[state] for name, pool in (("c_find", association_pool), ("c_get", dimse_scu.get_association_pool)) for pacs, counts in pool.stats()["pacs"].items() for state in ("open", "idle")}
+_gauges = (
+    metrics.registry.callback_gauge("dimse_pool_associations", "Asociaciones DIMSE abiertas y ociosas en los pools.", _pool_gauge, ("pool", "pacs", "state")),
+    metrics.registry.callback_gauge("dimse_active", "Operaciones DIMSE en curso (huecos ocupados del planificador).", lambda: dimse_scheduler.stats()["active"]),
+    metrics.registry.callback_gauge("dimse_waiting", "Operaciones DIMSE en cola, por cliente.", lambda: dimse_scheduler.stats()["waiting_by_client"], ("client",)),
+    metrics.registry.callback_gauge("retrievals_in_flight", "Recuperaciones C-MOVE/C-GET esperando instancias.", lambda: storage_scp.stats()["pending_retrievals"]),
+)
+# Métricas que con gateway solo tienen valores en su proceso: los workers las piden al exportar
+DIMSE_METRICS = frozenset(metric.name for metric in (
+    metrics.association_setup_seconds, metrics.cfind_duration_seconds, metrics.cfind_results, metrics.cfind_in_flight,
+    metrics.query_results, metrics.query_duration_seconds, metrics.cstore_instances_total, metrics.cstore_bytes_total, *_gauges,
+))
+
+
+# --- Operaciones puntuales ---
+def _unavailable_pacs() -> list:
+    """AE Title de los PACS activos que no se van a consultar (caídos o con el circuito abierto)."""
+    return [pacs['aetitle'] for pacs in dimse_scu.get_active_pacs() if not dimse_scu.is_queryable(pacs)]
+
+
+def _echo(pacs_id: int):
+    pacs = crud.get_pacs(pacs_id)
+    return health_prober.echo(pacs).to_dict() if pacs is not None else None
+
+
+def _config_changed(reason: str = None):
+    """Otro proceso cambió la configuración: se recarga ya (sin esperar al vigilante) y, si afecta a las búsquedas, se vacía la caché."""
+    crud.reload_config()
+    if reason:
+        query_cache.invalidate(reason)
+
+
+# nombre -> (función, si bloquea y se ejecuta en un hilo)
+CALLS = {
+    "admit": (dimse_scheduler.admit, False),
+    "unavailable_pacs": (_unavailable_pacs, False),
+    "config_changed": (_config_changed, False),
+    "health": (health_prober.snapshot, False),
+    "echo": (_echo, True),
+    "pool_stats": (lambda: {**association_pool.stats(), "c_get": dimse_scu.get_association_pool.stats()}, False),
+    "scp_stats": (storage_scp.stats, False),
+    "scheduler_stats": (dimse_scheduler.stats, False),
+    "query_stats": (lambda: {**query_engine.stats(), "cache": query_cache.stats()}, False),
+    "instance_stats": (instance_store.stats, True),
+    "gateway_stats": (lambda: gateway_server.stats(), False),
+    "rotate_logs": (rotate_log_file, True),
+    "log_index_stats": (log_indexer.stats, True),
+    "metrics": (lambda: metrics.registry.render(only=DIMSE_METRICS), False),
+}
+
+
+async def _call_local(name: str, *args):
+    function, blocking = CALLS[name]
+    return await asyncio.to_thread(function, *args) if blocking else function(*args)
+
+
+async def call(name: str, *args):
+    """Ejecuta una operación de CALLS: en el gateway si este proceso es un worker HTTP, o aquí mismo si no lo hay."""
+    if dimse_gateway.enabled:
+        return await dimse_gateway.call(name, *args)
+    return await _call_local(name, *args)
+
+
+async def render_metrics() -> str:
+    """Exportación de Prometheus del proceso; con gateway, las métricas DIMSE son las suyas."""
+    if not dimse_gateway.enabled:
+        return metrics.registry.render()
+    local = metrics.registry.render(exclude=DIMSE_METRICS)
+    try:
+        return local + await dimse_gateway.call("metrics")
+    except Exception as e:
+        return local + f"# gateway DIMSE no disponible: {e}\n"
+
+
+# --- Servicios de un único proceso ---
+def start_services():
+    """Arranca lo que solo puede tener un proceso: Storage SCP, indexador de logs y sondeo C-ECHO."""
+    proxy_config = crud.get_config_snapshot().proxy
+    try: storage_scp.start(proxy_config.get("proxy_aet", settings.PROXY_AET), int(proxy_config.get("proxy_port", 11112)))
+    except Exception as e: logger.error(f"No se pudo iniciar el Storage SCP persistente: {e}")
+    try: instance_store.reset_pins()
+    except Exception as e: logger.error(f"No se pudieron reiniciar los contadores de la caché de instancias: {e}")
+    try: log_indexer.start()
+    except Exception as e: logger.error(f"No se pudo iniciar el indexador de logs: {e}")
+    health_prober.start()
+
+
+def stop_services():
+    storage_scp.stop()
+    log_indexer.stop()
+    health_prober.stop()
+    association_pool.close_all()
+    dimse_scu.get_association_pool.close_all()
+
+
+# --- Servidor ---
+def _instance_frame(instance) -> tuple:
+    header = {"type": "instance", "sop_instance_uid": instance.sop_instance_uid, "sop_class_uid": instance.sop_class_uid,
+              "study_uid": instance.study_uid, "series_uid": instance.series_uid,
+              "transfer_syntax": instance.transfer_syntax, "size": instance.size}
+    if instance.in_memory:
+        return header, instance.data
+    # El worker lee el mismo archivo; si es de spool, pasa a ser él quien lo borra
+    owned = instance.owns_file
+    header["path"] = str(instance.detach_file() if owned else instance.path)
+    header["owned"] = owned
+    # Los archivos del almacén siguen fijados hasta que el worker libere su manejador
+    header["pinned"] = instance.detach_release_hook()
+    return header, b""
+
+
+async def _query_frames(payload: bytes):
+    outcome = QueryOutcome()
+    results = query_cache.stream_query(ipc.decode_dataset(payload), outcome=outcome)
+    try:
+        async for pacs, identifier in results:
+            yield {"type": "result", "pacs": pacs}, ipc.encode_dataset(identifier)
+    finally:
+        await results.aclose()
+    yield {"type": "end", "outcome": outcome.to_dict()}, b""
+
+
+async def _retrieve_frames(header: dict):
+    # Configuración del PACS según el gateway (límite de asociaciones, modo de recuperación)
+    pacs_config = crud.get_pacs(header["pacs"]["id"]) or header["pacs"]
+    instances = retrieval._remote_instances(pacs_config, header["study_uid"], header.get("series_uid"), header.get("instance_uids"))
+    try:
+        async for instance in instances:
+            yield _instance_frame(instance)
+    except retrieval.RetrieveError as e:
+        yield {"type": "error", "error": "RetrieveError", "message": str(e)}, b""
+        return
+    finally:
+        await instances.aclose()
+    yield {"type": "end"}, b""
+
+
+class GatewayServer:
+    """
+    Servidor del socket Unix del gateway. Cada conexión lleva una petición: una
+    operación puntual ('call'), una búsqueda o una recuperación (respuestas por partes,
+    que se cancelan si el worker cierra la conexión), o el envío de líneas de log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server = None
+        self.active = 0
+        self.requests = {}
+        self.cancelled = 0
+
+    async def start(self):
+        socket_path = Path(self.path)
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if socket_path.exists():
+            socket_path.unlink()  # restos de una ejecución anterior
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o660)
+        logger.success(f"Gateway DIMSE escuchando en '{self.path}'")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _handle(self, reader, writer):
+        self.active += 1
+        try:
+            header, payload = await ipc.read_frame(reader)
+            if header is None:
+                return
+            op = header.get("op")
+            self.requests[op] = self.requests.get(op, 0) + 1
+            if op == "log":
+                await self._receive_logs(reader)
+                return
+            current_client.set(header.get("client") or "desconocido")
+            trace_id, parent_id = header.get("trace") or (None, None)
+            with tracing.span(f"Gateway {op}", tracing.KIND_SERVER, root=trace_id is not None, trace_id=trace_id, parent_id=parent_id):
+                if op == "call":
+                    await self._call(writer, header)
+                elif op == "query":
+                    await self._stream(reader, writer, _query_frames(payload))
+                elif op == "retrieve":
+                    await self._stream(reader, writer, _retrieve_frames(header))
+                else:
+                    await ipc.write_frame(writer, {"type": "error", "message": f"Operación desconocida: {op}"})
+        except (ConnectionError, ipc.IPCError) as e:
+            logger.debug(f"Conexión con un worker cortada: {e}")
+        except Exception as e:
+            logger.error(f"Error en el gateway DIMSE: {e}")
+        finally:
+            self.active -= 1
+            writer.close()
+
+    async def _call(self, writer, header: dict):
+        name = header.get("name")
+        if name not in CALLS:
+            await ipc.write_frame(writer, {"type": "error", "message": f"Operación desconocida: {name}"})
+            return
+        try:
+            result = await _call_local(name, *header.get("args", ()))
+        except Overloaded as e:
+            await ipc.write_frame(writer, {"type": "error", "error": "Overloaded", "message": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"La operación '{name}' del gateway DIMSE falló: {e}")
+            await ipc.write_frame(writer, {"type": "error", "message": str(e) or type(e).__name__})
+        else:
+            await ipc.write_frame(writer, {"type": "end", "result": result})
+
+    async def _stream(self, reader, writer, frames):
+        """Envía las tramas de 'frames' hasta el final; si el worker cierra la conexión antes, se cancela."""
+        async def pump():
+            async for header, payload in frames:
+                await ipc.write_frame(writer, header, payload)
+
+        sending = asyncio.ensure_future(pump())
+        closed = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait({sending, closed}, return_when=asyncio.FIRST_COMPLETED)
+            if not sending.done():
+                # El worker se fue (cliente HTTP desconectado o 'limit' alcanzado)
+                self.cancelled += 1
+                sending.cancel()
+            error = (await asyncio.gather(sending, return_exceptions=True))[0]
+            if isinstance(error, Exception) and not isinstance(error, (ConnectionError, ipc.IPCError)):
+                logger.error(f"Error al enviar la respuesta del gateway DIMSE: {error}")
+        finally:
+            closed.cancel()
+            await frames.aclose()
+
+    async def _receive_logs(self, reader):
+        """Líneas ya formateadas de un worker: se escriben tal cual con los manejadores de este proceso."""
+        while True:
+            header, _ = await ipc.read_frame(reader)
+            if header is None:
+                return
+            try:
+                logger.opt(raw=True).log(header.get("level", "INFO"), header.get("line", ""))
+            except ValueError:  # nivel desconocido en este proceso
+                logger.opt(raw=True).info(header.get("line", ""))
+
+    def stats(self) -> dict:
+        return {"socket": self.path, "active_connections": self.active, "requests": dict(self.requests), "cancelled_streams": self.cancelled}
+
+
+gateway_server = GatewayServer(settings.DIMSE_GATEWAY_SOCKET)
+
+
+async def serve():
+    database.initialize_database()
+    crud.reload_config()
+    start_services()
+    tracing.span_exporter.start()
+    loop = asyncio.get_running_loop()
+    # Cambios hechos desde el panel de cualquier worker
+    crud.config_watcher.start(settings.CONFIG_RELOAD_INTERVAL,
+                              lambda: loop.call_soon_threadsafe(query_cache.invalidate, "configuración cambiada en otro proceso"))
+    await gateway_server.start()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        logger.info("Apagando el gateway DIMSE...")
+        await gateway_server.stop()
+        crud.config_watcher.stop()
+        stop_services()
+        tracing.span_exporter.stop()
+        database.get_pool().close_all()
+
+
+def main():
+    if not settings.DIMSE_GATEWAY_SOCKET:
+        sys.exit("Falta DIMSE_GATEWAY_SOCKET: ruta del socket Unix en el que escuchará el gateway DIMSE.")
+    # Este proceso es el que ejecuta las operaciones DIMSE
+    dimse_gateway.enabled = False
+    setup_logging()
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import asyncio
+import functools
+from pathlib import Path
+
+from implementation import tracing
+from implementation.config.settings import settings
+from implementation.dicom_services import ipc
+from implementation.dicom_services.instance_store import instance_store
+from implementation.dicom_services.scheduler import Overloaded, current_client
+from implementation.dicom_services.spool import SpooledInstance
+
+
+class GatewayError(RuntimeError):
+    """El gateway DIMSE no responde o no pudo completar la operación."""
+
+
+def _instance(header: dict, payload: bytes) -> SpooledInstance:
+    """Manejador de una instancia recibida del gateway: su archivo (sin copiar) o sus bytes."""
+    path = header.get("path")
+    return SpooledInstance(
+        sop_instance_uid=header["sop_instance_uid"], sop_class_uid=header["sop_class_uid"],
+        study_uid=header["study_uid"], series_uid=header["series_uid"],
+        transfer_syntax=header["transfer_syntax"], size=header["size"],
+        path=Path(path) if path else None, data=None if path else payload,
+        owned=header.get("owned", False),
+        on_release=functools.partial(instance_store.unpin, header["sop_instance_uid"]) if header.get("pinned") else None,
+    )
+
+
+class GatewayClient:
+    """
+    Cliente del gateway DIMSE para los workers HTTP (uvicorn --workers N). Cada
+    operación abre su propia conexión al socket Unix; en las respuestas por partes
+    (búsquedas y recuperaciones) cerrar la conexión equivale a cancelar: el gateway
+    envía C-CANCEL o abandona la recuperación.
+    Sin DIMSE_GATEWAY_SOCKET está desactivado y todo se hace en el propio proceso.
+    """
+
+    def __init__(self, path: str, timeout: float):
+        self.path = path
+        self.timeout = timeout
+        self.enabled = bool(path)
+        self.requests = 0
+        self.errors = 0
+
+    async def _connect(self, op: str, payload: bytes, params: dict):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            raise GatewayError(f"No se pudo conectar con el gateway DIMSE en '{self.path}': {e or 'timeout'}")
+        header = {"op": op, "client": current_client.get(), **params}
+        span = tracing.current_span()
+        if span is not None:
+            header["trace"] = [span.trace_id, span.span_id]
+        self.requests += 1
+        await ipc.write_frame(writer, header, payload)
+        return reader, writer
+
+    def _raise(self, header: dict):
+        self.errors += 1
+        if header.get("error") == "Overloaded":
+            raise Overloaded(header.get("message", ""), header.get("retry_after", 1))
+        raise GatewayError(header.get("message") or "Error en el gateway DIMSE.")
+
+    async def _frames(self, op: str, payload: bytes = b"", **params):
+        """Tramas de la respuesta hasta la final ('end'). Al cerrar el generador se cierra la conexión."""
+        with tracing.span(f"Gateway {op}", tracing.KIND_CLIENT, **{"gateway.op": params.get("name", op)}):
+            reader, writer = await self._connect(op, payload, params)
+            try:
+                while True:
+                    try:
+                        header, body = await ipc.read_frame(reader)
+                    except (OSError, ipc.IPCError) as e:
+                        self.errors += 1
+                        raise GatewayError(f"Conexión con el gateway DIMSE perdida: {e}")
+                    if header is None:
+                        self.errors += 1
+                        raise GatewayError("El gateway DIMSE cerró la conexión antes de terminar la respuesta.")
+                    if header.get("type") == "error":
+                        self._raise(header)
+                    yield header, body
+                    if header.get("type") == "end":
+                        return
+            finally:
+                writer.close()
+
+    async def call(self, name: str, *args):
+        """Operación puntual del gateway (estadísticas, admisión, C-ECHO...). Devuelve su resultado."""
+        frames = self._frames("call", name=name, args=list(args))
+        try:
+            async for header, _ in frames:
+                return header.get("result")
+        finally:
+            await frames.aclose()
+
+    async def stream_query(self, identifier, outcome=None):
+        """
+        Igual que 'query_cache.stream_query', pero servida por el gateway (su caché de
+        consultas es común a todos los workers). Los identificadores llegan sin decodificar.
+        """
+        frames = self._frames("query", ipc.encode_dataset(identifier))
+        try:
+            async for header, body in frames:
+                if header["type"] == "result":
+                    yield header["pacs"], ipc.decode_dataset(body)
+                elif outcome is not None:
+                    outcome.update(header["outcome"])
+        finally:
+            await frames.aclose()
+
+    async def retrieve(self, pacs_config: dict, study_uid: str, series_uid: str = None, instance_uids=None):
+        """
+        Igual que 'retrieval._remote_instances', ejecutada por el gateway. De cada
+        instancia solo viaja la ruta del archivo (caché local o spool, cuya propiedad
+        pasa al worker); las que no llegaron a disco viajan con sus bytes.
+        """
+        frames = self._frames("retrieve", pacs=pacs_config, study_uid=study_uid, series_uid=series_uid,
+                              instance_uids=list(instance_uids) if instance_uids else None)
+        try:
+            async for header, body in frames:
+                if header["type"] == "instance":
+                    yield _instance(header, body)
+        finally:
+            await frames.aclose()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "socket": self.path or None, "requests": self.requests, "errors": self.errors}
+
+
+dimse_gateway = GatewayClient(settings.DIMSE_GATEWAY_SOCKET, settings.DIMSE_GATEWAY_TIMEOUT)
@@ -0,0 +1,257 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pynetdicom import AE
+from pynetdicom.sop_class import Verification
+from loguru import logger
+
+from implementation import crud
+from implementation.config.settings import settings
+from implementation.dicom_services.association_pool import pacs_key
+from implementation.dicom_services.circuit_breaker import circuit_breakers
+
+# Suavizado de RTT de RFC 6298 (alfa = 1/8, beta = 1/4)
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+
+class PacsHealth:
+    """Estado de un PACS según los C-ECHO periódicos y las búsquedas reales."""
+
+    def __init__(self, description: str):
+        self.description = description
+        self.state = "unknown"  # 'up', 'down' o 'unknown' (aún sin sondear)
+        self.srtt = None  # RTT suavizado del C-ECHO (s)
+        self.rttvar = None
+        self.last_rtt = None
+        self.first_response = None  # media móvil del tiempo hasta la primera respuesta C-FIND (s)
+        self.consecutive_failures = 0
+        self.probes = 0
+        self.failures = 0
+        self.last_checked = None
+        self.last_change = None
+        self.last_error = None
+
+    def record_echo(self, ok: bool, rtt: float = None, error: str = None, failure_threshold: int = 1):
+        self.probes += 1
+        self.last_checked = time.time()
+        previous = self.state
+        if ok:
+            self.consecutive_failures = 0
+            self.last_error = None
+            self.last_rtt = rtt
+            if self.srtt is None:
+                self.srtt, self.rttvar = rtt, rtt / 2
+            else:
+                self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+            self.state = "up"
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = error
+            if self.consecutive_failures >= failure_threshold:
+                self.state = "down"
+        if self.state != previous:
+            self.last_change = self.last_checked
+        return previous
+
+    def record_first_response(self, seconds: float):
+        if self.first_response is None:
+            self.first_response = seconds
+        else:
+            self.first_response = (1 - RTT_ALPHA) * self.first_response + RTT_ALPHA * seconds
+
+    def expected_latency(self) -> float:
+        """Latencia esperada hasta la primera respuesta (para ordenar espejos)."""
+        if self.first_response is not None:
+            return self.first_response
+        if self.srtt is not None:
+            return self.srtt
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "description": self.description, "state": self.state,
+            "rtt_ms": round(self.srtt * 1000, 2) if self.srtt is not None else None,
+            "rttvar_ms": round(self.rttvar * 1000, 2) if self.rttvar is not None else None,
+            "last_rtt_ms": round(self.last_rtt * 1000, 2) if self.last_rtt is not None else None,
+            "first_response_ms": round(self.first_response * 1000, 2) if self.first_response is not None else None,
+            "consecutive_failures": self.consecutive_failures, "probes": self.probes, "failures": self.failures,
+            "last_checked": self.last_checked, "last_change": self.last_change, "last_error": self.last_error,
+        }
+
+
+class HealthProber:
+    """
+    Sondeo en segundo plano de todos los PACS configurados con C-ECHO.
+    Por cada PACS mantiene disponibilidad y RTT suavizado; con eso las búsquedas
+    federadas saltan los PACS caídos, ajustan el timeout de cada asociación a la
+    latencia observada y eligen el espejo más rápido de cada grupo.
+    """
+
+    def __init__(self, ae_title: str, interval: float, probe_timeout: float, failure_threshold: int):
+        self.ae_title = ae_title
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self._health: dict[tuple, PacsHealth] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=settings.HEALTH_PROBE_MAX_WORKERS, thread_name_prefix="pacs-echo")
+
+    def _entry(self, pacs_config) -> PacsHealth:
+        key = pacs_key(pacs_config)
+        with self._lock:
+            health = self._health.get(key)
+            if health is None:
+                health = self._health[key] = PacsHealth(pacs_config['description'])
+            return health
+
+    # --- Sondeo ---
+    def echo(self, pacs_config) -> PacsHealth:
+        """Asociación nueva + C-ECHO. Registra el resultado y lo devuelve."""
+        aet, ip, port = pacs_key(pacs_config)
+        ae = AE(ae_title=self.ae_title)
+        ae.add_requested_context(Verification)
+        ae.connection_timeout = ae.acse_timeout = ae.dimse_timeout = ae.network_timeout = self.probe_timeout
+        ok, rtt, error = False, None, None
+        try:
+            assoc = ae.associate(ip, port, ae_title=aet)
+            if not assoc.is_established:
+                error = "Asociación rechazada o sin respuesta"
+            else:
+                try:
+                    started = time.perf_counter()
+                    status = assoc.send_c_echo()
+                    rtt = time.perf_counter() - started
+                    if status and status.Status == 0x0000:
+                        ok = True
+                    else:
+                        error = f"C-ECHO con estado {f'0x{status.Status:04X}' if status else 'vacío (timeout)'}"
+                finally:
+                    if assoc.is_established:
+                        assoc.release()
+        except Exception as e:
+            error = str(e)
+        health = self._entry(pacs_config)
+        with self._lock:
+            previous = health.record_echo(ok, rtt, error, self.failure_threshold)
+            state = health.state
+        if state != previous and previous != "unknown":
+            if state == "down":
+                logger.warning(f"PACS '{pacs_config['description']}' ({aet}@{ip}:{port}) no responde al C-ECHO: {error}")
+            else:
+                logger.success(f"PACS '{pacs_config['description']}' ({aet}@{ip}:{port}) vuelve a responder ({rtt * 1000:.1f} ms).")
+        return health
+
+    def probe_all(self):
+        pacs_list = crud.get_all_pacs()
+        futures = [self._executor.submit(self.echo, pacs) for pacs in pacs_list]
+        wait(futures, timeout=self.probe_timeout * 3)
+        # Se olvidan los PACS que ya no están configurados
+        keys = {pacs_key(pacs) for pacs in pacs_list}
+        with self._lock:
+            for key in [key for key in self._health if key not in keys]:
+                del self._health[key]
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pacs-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.probe_timeout * 3)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Error en el sondeo C-ECHO de los PACS: {e}")
+            self._stop.wait(self.interval)
+
+    # --- Consultas del motor de búsqueda ---
+    def is_available(self, pacs_config) -> bool:
+        """Falso solo si el PACS está caído según los últimos sondeos (un PACS sin sondear se considera disponible)."""
+        with self._lock:
+            health = self._health.get(pacs_key(pacs_config))
+            return health is None or health.state != "down"
+
+    def timeout_for(self, pacs_config):
+        """
+        Timeout de asociación/DIMSE para el PACS: varias veces la latencia observada
+        (RTT suavizado más cuatro desviaciones, o la primera respuesta C-FIND si es
+        mayor), acotado entre HEALTH_TIMEOUT_MIN y HEALTH_TIMEOUT_MAX.
+        """
+        with self._lock:
+            health = self._health.get(pacs_key(pacs_config))
+            if health is None or health.srtt is None:
+                return settings.HEALTH_TIMEOUT_MAX
+            expected = max(health.srtt + 4 * health.rttvar, health.first_response or 0.0)
+        return min(settings.HEALTH_TIMEOUT_MAX, max(settings.HEALTH_TIMEOUT_MIN, expected * settings.HEALTH_TIMEOUT_FACTOR))
+
+    def hedge_delay(self, pacs_config) -> float:
+        """Espera antes de repetir la búsqueda en otro espejo si este PACS aún no ha respondido."""
+        with self._lock:
+            health = self._health.get(pacs_key(pacs_config))
+            expected = health.expected_latency() if health is not None else float("inf")
+        if expected == float("inf"):
+            return settings.QUERY_HEDGE_MIN_DELAY
+        return max(settings.QUERY_HEDGE_MIN_DELAY, expected * settings.QUERY_HEDGE_FACTOR)
+
+    def observe_first_response(self, pacs_config, seconds: float):
+        health = self._entry(pacs_config)
+        with self._lock:
+            health.record_first_response(seconds)
+
+    def plan(self, pacs_list) -> list:
+        """
+        Agrupa los PACS por 'mirror_group': cada destino es una lista de candidatos
+        ordenados del más rápido al más lento. Un PACS sin grupo es un destino propio.
+        """
+        targets, groups = [], {}
+        for pacs in pacs_list:
+            group = (pacs.get('mirror_group') or "").strip()
+            if not group:
+                targets.append([pacs])
+                continue
+            if group not in groups:
+                groups[group] = []
+                targets.append(groups[group])
+            groups[group].append(pacs)
+        with self._lock:
+            def latency(pacs):
+                # Primero los medidos con búsquedas reales; el RTT del C-ECHO solo desempata el resto
+                health = self._health.get(pacs_key(pacs))
+                if health is None:
+                    return (True, float("inf"))
+                return (health.first_response is None, health.expected_latency())
+            for candidates in targets:
+                candidates.sort(key=latency)
+        return targets
+
+    def snapshot(self) -> dict:
+        """Estado de cada PACS configurado (sondeo, timeout y circuito), por id."""
+        result = {}
+        for pacs in crud.get_all_pacs():
+            with self._lock:
+                health = self._health.get(pacs_key(pacs))
+                result[pacs['id']] = health.to_dict() if health is not None else PacsHealth(pacs['description']).to_dict()
+            result[pacs['id']]["timeout_s"] = round(self.timeout_for(pacs), 2)
+            result[pacs['id']]["circuit"] = circuit_breakers.state_of(pacs)
+        return result
+
+
+health_prober = HealthProber(
+    ae_title=settings.PROXY_AET,
+    interval=settings.HEALTH_PROBE_INTERVAL,
+    probe_timeout=settings.HEALTH_PROBE_TIMEOUT,
+    failure_threshold=settings.HEALTH_FAILURE_THRESHOLD,
+)
@@ -0,0 +1,226 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from loguru import logger
+
+from implementation import database
+from implementation.config.settings import settings
+from implementation.dicom_services.spool import SpooledInstance
+
+
+class InstanceStore:
+    """
+    Caché local en disco de las instancias recibidas por el Storage SCP.
+    Los archivos se direccionan por SOPInstanceUID y se indexan en la tabla
+    'instance_cache' de dicomproxy.db. La expulsión (LRU o LFU) mantiene el
+    almacén por debajo del presupuesto de bytes configurado.
+    Un estudio o serie recuperado completo se marca en 'instance_cache_complete'
+    para poder servirlo sin ninguna petición DIMSE; la marca se borra en cuanto
+    se expulsa cualquiera de sus instancias.
+    Cada manejador entregado fija su fila ('pins') hasta que se libera, para que la
+    expulsión no borre archivos que una respuesta WADO todavía no ha leído. Los
+    contadores viven en la base de datos porque el gateway DIMSE y los workers HTTP
+    comparten el almacén.
+    """
+
+    def __init__(self, root, max_bytes: int, policy: str = "lru"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.policy = policy.lower()
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- Utilidades ---
+    def path_for(self, sop_instance_uid: str) -> Path:
+        digest = hashlib.sha1(sop_instance_uid.encode("ascii")).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / f"{sop_instance_uid}.dcm"
+
+    def _total(self, conn) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM instance_cache").fetchone()[0]
+        return self._total_bytes
+
+    def _handle(self, row) -> SpooledInstance:
+        """Manejador de una fila ya fijada; al liberarlo se desfija."""
+        return SpooledInstance(
+            sop_instance_uid=row['sop_instance_uid'], sop_class_uid=row['sop_class_uid'],
+            study_uid=row['study_uid'], series_uid=row['series_uid'],
+            transfer_syntax=row['transfer_syntax'], size=row['size'],
+            path=Path(row['path']), owned=False, on_release=functools.partial(self.unpin, row['sop_instance_uid']),
+        )
+
+    def unpin(self, sop_instance_uid: str):
+        """Un manejador de la instancia se ha liberado: cuando no quede ninguno se podrá expulsar."""
+        try:
+            with database.connection() as conn:
+                conn.execute("UPDATE instance_cache SET pins = pins - 1 WHERE sop_instance_uid = ? AND pins > 0",
+                             (sop_instance_uid,))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"No se pudo liberar la instancia {sop_instance_uid} de la caché local: {e}")
+
+    def reset_pins(self):
+        """Al arrancar nadie tiene manejadores: se descartan los que dejó una ejecución interrumpida."""
+        with database.connection() as conn:
+            conn.execute("UPDATE instance_cache SET pins = 0 WHERE pins > 0")
+            conn.commit()
+
+    # --- Escritura ---
+    def put(self, instance: SpooledInstance) -> SpooledInstance:
+        """
+        Guarda la instancia en el almacén. Si venía de un archivo de spool, el archivo
+        se mueve (sin copiar); si estaba en memoria, se escribe y se suelta la copia.
+        En ambos casos se devuelve un manejador del almacén, fijado hasta que se libere.
+        """
+        target = self.path_for(instance.sop_instance_uid)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if instance.in_memory:
+            tmp = target.with_name(f".{uuid.uuid4().hex}.tmp")
+            tmp.write_bytes(instance.data)
+            os.replace(tmp, target)
+        else:
+            os.replace(instance.detach_file(), target)
+            instance.path = target
+
+        now = time.time()
+        with self._lock:
+            with database.connection() as conn:
+                total = self._total(conn)
+                previous = conn.execute("SELECT size FROM instance_cache WHERE sop_instance_uid = ?",
+                                        (instance.sop_instance_uid,)).fetchone()
+                # Si ya estaba, conserva los manejadores que otras respuestas tengan abiertos
+                conn.execute(
+                    """INSERT INTO instance_cache
+                       (sop_instance_uid, study_uid, series_uid, sop_class_uid, transfer_syntax, size, path,
+                        created_at, last_access, access_count, pins)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+                       ON CONFLICT (sop_instance_uid) DO UPDATE SET
+                        study_uid = excluded.study_uid, series_uid = excluded.series_uid,
+                        sop_class_uid = excluded.sop_class_uid, transfer_syntax = excluded.transfer_syntax,
+                        size = excluded.size, path = excluded.path, created_at = excluded.created_at,
+                        last_access = excluded.last_access, access_count = 1, pins = pins + excluded.pins""",
+                    (instance.sop_instance_uid, instance.study_uid, instance.series_uid, instance.sop_class_uid,
+                     instance.transfer_syntax, instance.size, str(target), now, now, 1),
+                )
+                self._total_bytes = total - (previous['size'] if previous else 0) + instance.size
+                self._evict(conn, keep=instance.sop_instance_uid)
+                conn.commit()
+        # Los bytes ya están en el almacén: el manejador recibido deja de hacer falta
+        instance.release()
+        return SpooledInstance(
+            sop_instance_uid=instance.sop_instance_uid, sop_class_uid=instance.sop_class_uid,
+            study_uid=instance.study_uid, series_uid=instance.series_uid,
+            transfer_syntax=instance.transfer_syntax, size=instance.size,
+            path=target, owned=False, on_release=functools.partial(self.unpin, instance.sop_instance_uid),
+        )
+
+    def _evict(self, conn, keep: str = None):
+        """
+        Expulsa hasta volver al presupuesto, saltando las instancias fijadas: si todas lo
+        están, el almacén lo supera hasta el siguiente 'put' posterior a su liberación.
+        """
+        if self._total_bytes <= self.max_bytes:
+            return
+        order = "access_count ASC, last_access ASC" if self.policy == "lfu" else "last_access ASC"
+        rows = conn.execute(f"SELECT sop_instance_uid, study_uid, series_uid, size, path FROM instance_cache "
+                            f"WHERE pins = 0 ORDER BY {order}")
+        victims = []
+        for row in rows:
+            if self._total_bytes <= self.max_bytes:
+                break
+            if row['sop_instance_uid'] == keep:
+                continue
+            victims.append(row)
+            self._total_bytes -= row['size']
+        rows.close()
+        for row in victims:
+            try:
+                os.unlink(row['path'])
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM instance_cache WHERE sop_instance_uid = ?", (row['sop_instance_uid'],))
+            conn.execute("DELETE FROM instance_cache_complete WHERE uid IN (?, ?)", (row['study_uid'], row['series_uid']))
+        self.evictions += len(victims)
+        if victims:
+            logger.info(f"Caché de instancias: {len(victims)} instancias expulsadas ({self.policy.upper()}); ocupación {self._total_bytes} bytes.")
+
+    def mark_complete(self, study_uid: str, series_uid: str = None):
+        """Registra que el estudio (o la serie) está entero en el almacén."""
+        level, uid = ("SERIES", series_uid) if series_uid else ("STUDY", study_uid)
+        with database.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO instance_cache_complete (uid, level, completed_at) VALUES (?, ?, ?)",
+                         (uid, level, time.time()))
+            conn.commit()
+
+    # --- Lectura ---
+    def _touch(self, conn, uids):
+        """Registra el acceso y fija cada fila: el llamador recibe un manejador por cada una."""
+        conn.executemany(
+            "UPDATE instance_cache SET last_access = ?, access_count = access_count + 1, pins = pins + 1 "
+            "WHERE sop_instance_uid = ?",
+            [(time.time(), uid) for uid in uids],
+        )
+        conn.commit()
+
+    def get(self, sop_instance_uid: str):
+        """Manejador de la instancia si está en el almacén, o None."""
+        found = self.get_many([sop_instance_uid])
+        return found[0] if found else None
+
+    def get_many(self, sop_instance_uids) -> list:
+        uids = list(sop_instance_uids)
+        if not uids:
+            return []
+        with database.connection() as conn:
+            placeholders = ",".join("?" * len(uids))
+            rows = conn.execute(f"SELECT * FROM instance_cache WHERE sop_instance_uid IN ({placeholders})", uids).fetchall()
+            rows = [row for row in rows if os.path.exists(row['path'])]
+            self._touch(conn, [row['sop_instance_uid'] for row in rows])
+        self.hits += len(rows)
+        self.misses += len(uids) - len(rows)
+        return [self._handle(row) for row in rows]
+
+    def get_complete(self, study_uid: str, series_uid: str = None):
+        """
+        Todas las instancias del estudio/serie si está marcado como completo en el
+        almacén; None si hay que recuperarlo del PACS.
+        """
+        with database.connection() as conn:
+            uid = series_uid or study_uid
+            # Una serie también está completa si lo está su estudio
+            if conn.execute("SELECT 1 FROM instance_cache_complete WHERE uid IN (?, ?)", (uid, study_uid)).fetchone() is None:
+                self.misses += 1
+                return None
+            if series_uid:
+                rows = conn.execute("SELECT * FROM instance_cache WHERE series_uid = ?", (series_uid,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM instance_cache WHERE study_uid = ?", (study_uid,)).fetchall()
+            if not rows or not all(os.path.exists(row['path']) for row in rows):
+                conn.execute("DELETE FROM instance_cache_complete WHERE uid = ?", (uid,))
+                conn.commit()
+                self.misses += 1
+                return None
+            self._touch(conn, [row['sop_instance_uid'] for row in rows])
+        self.hits += 1
+        return [self._handle(row) for row in rows]
+
+    def stats(self) -> dict:
+        with database.connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM instance_cache").fetchone()[0]
+            total = self._total(conn)
+        return {"instances": count, "bytes": total, "max_bytes": self.max_bytes, "policy": self.policy,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+instance_store = InstanceStore(
+    root=settings.INSTANCE_STORE_DIR,
+    max_bytes=settings.INSTANCE_STORE_MAX_BYTES,
+    policy=settings.INSTANCE_STORE_EVICTION,
+)
@@ -0,0 +1,82 @@
+import asyncio
+import io
+import json
+import struct
+from pydicom.dataelem import RawDataElement
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import write_data_element
+from pynetdicom.dsutils import decode
+
+# Cada trama: longitudes (big endian) de la cabecera JSON y de la carga binaria, y después ambas
+_PREFIX = struct.Struct(">II")
+MAX_HEADER_BYTES = 16 * 1024 * 1024
+# Cabecera de un elemento en Implicit VR Little Endian: grupo, elemento y longitud
+_ELEMENT_HEADER = struct.Struct("<HHI")
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+
+class IPCError(ConnectionError):
+    """La otra parte cortó la conexión a mitad de una trama o envió una trama no válida."""
+
+
+def pack_frame(header: dict, payload: bytes = b"") -> bytes:
+    data = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _PREFIX.pack(len(data), len(payload)) + data + payload
+
+
+async def write_frame(writer: asyncio.StreamWriter, header: dict, payload: bytes = b""):
+    data = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    writer.write(_PREFIX.pack(len(data), len(payload)) + data)
+    if payload:
+        writer.write(payload)
+    await writer.drain()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    """(cabecera, carga) de la siguiente trama, o (None, b"") si la otra parte cerró la conexión."""
+    try:
+        prefix = await reader.readexactly(_PREFIX.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None, b""
+        raise IPCError("Conexión cerrada a mitad de una trama.")
+    header_size, payload_size = _PREFIX.unpack(prefix)
+    if header_size > MAX_HEADER_BYTES:
+        raise IPCError(f"Cabecera de trama demasiado grande ({header_size} bytes).")
+    try:
+        data = await reader.readexactly(header_size + payload_size)
+    except asyncio.IncompleteReadError:
+        raise IPCError("Conexión cerrada a mitad de una trama.")
+    return json.loads(data[:header_size]), data[header_size:]
+
+
+# Los identificadores C-FIND viajan en Implicit VR Little Endian, igual que por la red DIMSE
+def encode_dataset(ds) -> bytes:
+    """
+    Los elementos que siguen sin decodificar (tal como llegaron del PACS, en esta misma
+    sintaxis) se copian byte a byte; solo los ya convertidos pasan por el codificador de
+    pydicom, mucho más lento.
+    """
+    parts = []
+    encodings = None
+    for tag in sorted(ds.keys()):
+        if tag.element == 0 and tag.group > 6:
+            continue
+        element = ds.get_item(tag)
+        if (isinstance(element, RawDataElement) and element.is_implicit_VR and element.is_little_endian
+                and element.length != UNDEFINED_LENGTH):
+            value = element.value or b""
+            parts.append(_ELEMENT_HEADER.pack(tag.group, tag.element, len(value)))
+            parts.append(value)
+            continue
+        if encodings is None:
+            encodings = ds.get("SpecificCharacterSet", "iso8859")
+        fp = DicomBytesIO()
+        fp.is_implicit_VR, fp.is_little_endian = True, True
+        write_data_element(fp, element, encodings)
+        parts.append(fp.getvalue())
+    return b"".join(parts)
+
+
+def decode_dataset(data: bytes):
+    return decode(io.BytesIO(data), True, True)
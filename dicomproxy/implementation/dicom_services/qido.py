@@ -0,0 +1,118 @@
+from pydicom.dataset import Dataset
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+
+# Parámetros QIDO-RS que no son atributos DICOM
+RESERVED_PARAMS = {"limit", "offset", "fuzzymatching", "includefield"}
+
+# Atributos que se devuelven siempre en cada nivel (PS3.18, tabla 6.7.1-2)
+DEFAULT_RETURN_KEYS = {
+    "STUDY": [
+        "StudyDate", "StudyTime", "AccessionNumber", "ModalitiesInStudy", "ReferringPhysicianName",
+        "PatientName", "PatientID", "PatientBirthDate", "PatientSex", "StudyInstanceUID", "StudyID",
+        "StudyDescription", "NumberOfStudyRelatedSeries", "NumberOfStudyRelatedInstances",
+    ],
+    "SERIES": [
+        "StudyInstanceUID", "Modality", "SeriesDescription", "SeriesNumber", "SeriesInstanceUID",
+        "NumberOfSeriesRelatedInstances", "PerformedProcedureStepStartDate", "PerformedProcedureStepStartTime",
+    ],
+    "IMAGE": [
+        "StudyInstanceUID", "SeriesInstanceUID", "SOPClassUID", "SOPInstanceUID", "InstanceNumber",
+        "Rows", "Columns", "BitsAllocated", "NumberOfFrames",
+    ],
+}
+
+# Clave única de cada nivel, usada para eliminar duplicados entre PACS
+UNIQUE_KEYS = {"STUDY": "StudyInstanceUID", "SERIES": "SeriesInstanceUID", "IMAGE": "SOPInstanceUID"}
+
+_NUMERIC_VRS = {"US", "UL", "SS", "SL", "UV", "SV"}
+
+
+class QidoQueryError(ValueError):
+    """Parámetro de búsqueda QIDO-RS no válido."""
+
+
+def resolve_tag(name: str) -> int:
+    """Convierte un keyword DICOM ('PatientID') o un tag hexadecimal ('00100020') en un tag."""
+    tag = tag_for_keyword(name)
+    if tag is not None:
+        return tag
+    if len(name) == 8:
+        try:
+            return int(name, 16)
+        except ValueError:
+            pass
+    raise QidoQueryError(f"Atributo desconocido: '{name}'")
+
+
+def _set_attribute(ds: Dataset, tag: int, value: str):
+    try:
+        vr = dictionary_VR(tag)
+    except KeyError:
+        raise QidoQueryError(f"Tag sin definición en el diccionario DICOM: {tag:08X}")
+    if vr == "SQ":
+        raise QidoQueryError(f"No se admiten búsquedas por secuencias: {tag:08X}")
+    if vr in _NUMERIC_VRS:
+        # Un atributo numérico vacío se solicita como clave de retorno sin valor
+        try:
+            value = int(value) if value != "" else None
+        except ValueError:
+            raise QidoQueryError(f"Valor numérico no válido para {tag:08X}: '{value}'")
+    ds.add_new(tag, vr, value)
+
+
+def build_qido_identifier(level: str, params, study_uid: str = None, series_uid: str = None) -> Dataset:
+    """
+    Traduce los parámetros de una petición QIDO-RS en un identificador C-FIND
+    del nivel indicado (STUDY, SERIES o IMAGE).
+    'params' es una lista de pares (nombre, valor) como la de request.query_params.multi_items().
+    """
+    ds = Dataset()
+    ds.QueryRetrieveLevel = level
+    for keyword in DEFAULT_RETURN_KEYS[level]:
+        _set_attribute(ds, tag_for_keyword(keyword), "")
+
+    for name, value in params:
+        if name == "includefield":
+            for field in value.split(","):
+                field = field.strip()
+                if field and field != "all":
+                    tag = resolve_tag(field)
+                    if tag not in ds:
+                        _set_attribute(ds, tag, "")
+            continue
+        if name in RESERVED_PARAMS:
+            continue
+        _set_attribute(ds, resolve_tag(name), value)
+
+    # Los UID de la ruta siempre prevalecen sobre los parámetros
+    if study_uid:
+        ds.StudyInstanceUID = study_uid
+    if series_uid:
+        ds.SeriesInstanceUID = series_uid
+    return ds
+
+
+def response_tags(identifier: Dataset, params):
+    """
+    Tags que se devuelven en cada resultado: los del identificador (claves por
+    defecto, includefield y claves de búsqueda). None si se pidió includefield=all.
+    """
+    for name, value in params:
+        if name == "includefield" and "all" in (field.strip() for field in value.split(",")):
+            return None
+    return frozenset(int(tag) for tag in identifier.keys() if tag != 0x00080052)
+
+
+def unique_key(level: str, identifier: Dataset):
+    """
+    UID que identifica el resultado en su nivel (o None si el PACS no lo devolvió).
+    Se lee sin decodificar el elemento, que así se puede reenviar tal cual llegó.
+    """
+    tag = tag_for_keyword(UNIQUE_KEYS[level])
+    if tag not in identifier:
+        return None
+    value = identifier.get_item(tag).value
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    return value.rstrip("\0 ") if value else None
+
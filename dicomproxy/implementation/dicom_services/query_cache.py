@@ -0,0 +1,199 @@
+import asyncio
+import time
+from collections import OrderedDict
+from pydicom.dataset import Dataset
+from loguru import logger
+
+from implementation.config.settings import settings
+from implementation.dicom_services import dimse_scu
+from implementation.dicom_services.query_engine import query_engine, QueryOutcome
+
+_END = object()
+
+
+def normalize_query(query_params) -> tuple:
+    """Forma canónica de un identificador C-FIND (o dict de parámetros) para usarla como clave."""
+    if isinstance(query_params, Dataset):
+        items = ((f"{elem.tag:08X}", "" if elem.value is None else str(elem.value).strip()) for elem in query_params)
+    else:
+        items = ((str(k), str(v).strip()) for k, v in query_params.items())
+    return tuple(sorted(items))
+
+
+def pacs_set_key(active_pacs) -> frozenset:
+    return frozenset((p['id'], p['aetitle'], p['ip_address'], int(p['port'])) for p in active_pacs)
+
+
+class _Flight:
+    """Fan-out C-FIND en curso, compartido por todas las peticiones idénticas."""
+
+    def __init__(self, key, generation: int):
+        self.key = key
+        self.generation = generation
+        self.results = []      # None cuando supera el tamaño máximo cacheable
+        self.subscribers = set()
+        self.task = None
+        self.outcome = QueryOutcome()
+
+
+class QueryCache:
+    """
+    Caché TTL/LRU de respuestas C-FIND federadas.
+    La clave es el identificador normalizado más el conjunto de PACS activos.
+    Las consultas idénticas concurrentes se agrupan sobre un único fan-out en curso.
+    """
+
+    def __init__(self, ttl: float, max_results: int, max_entry_results: int):
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_entry_results = min(max_entry_results, max_results)
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, results)
+        self._inflight: dict = {}
+        self._size = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    # --- Almacenamiento LRU ---
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def _drop(self, key):
+        _, results = self._entries.pop(key)
+        self._size -= len(results)
+
+    def _store(self, key, results: list):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        self._size += len(results)
+        while self._size > self.max_results and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, reason: str = ""):
+        """Vacía la caché y evita que los fan-outs en curso guarden su resultado."""
+        self._entries.clear()
+        self._size = 0
+        self._generation += 1
+        self._inflight.clear()
+        logger.info(f"Caché de consultas C-FIND invalidada{f' ({reason})' if reason else ''}.")
+
+    # --- Consulta ---
+    async def stream_query(self, query_params, outcome: QueryOutcome = None):
+        """
+        Igual que 'query_engine.stream_query', pero sirviendo desde caché cuando es posible.
+        Los resultados parciales (plazo vencido o PACS con error) no se guardan.
+        """
+        outcome = outcome if outcome is not None else QueryOutcome()
+        active_pacs, skipped = dimse_scu.partition_pacs()
+        outcome.skipped = [pacs['description'] for pacs in skipped]
+        key = (normalize_query(query_params), pacs_set_key(active_pacs))
+
+        cached = self._get(key)
+        if cached is not None:
+            self.hits += 1
+            outcome.cached = True
+            outcome.completed = [pacs['description'] for pacs in active_pacs]
+            logger.debug(f"Caché C-FIND: acierto ({len(cached)} resultados).")
+            for item in cached:
+                yield item
+            return
+
+        flight = self._inflight.get(key)
+        if flight is not None and flight.results is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            flight = _Flight(key, self._generation)
+            flight.outcome.skipped = outcome.skipped
+            self._inflight[key] = flight
+            flight.task = asyncio.create_task(self._fill(flight, query_params, active_pacs))
+
+        # Lo que el fan-out ya había recibido se entrega desde su lista; lo que llegue
+        # después, por una cola acotada: un suscriptor lento frena el fan-out (y este a los
+        # PACS) en vez de acumular la respuesta en memoria
+        backlog = list(flight.results)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.QUERY_STREAM_BUFFER)
+        flight.subscribers.add(queue)
+        try:
+            for item in backlog:
+                yield item
+            while (item := await queue.get()) is not _END:
+                yield item
+            outcome.merge(flight.outcome)
+        finally:
+            flight.subscribers.discard(queue)
+            while not queue.empty():
+                # Libera al fan-out si estaba esperando hueco en esta cola
+                queue.get_nowait()
+            if not flight.subscribers and not flight.task.done():
+                # Nadie espera ya este fan-out: se cancela y no se guarda. Se retira ya de
+                # '_inflight' para que nadie se una a él antes de que termine de cancelarse.
+                self._forget(flight)
+                flight.task.cancel()
+
+    async def _fill(self, flight: _Flight, query_params, active_pacs):
+        completed = False
+        try:
+            async for item in query_engine.stream_query(query_params, active_pacs=active_pacs, outcome=flight.outcome):
+                if flight.results is not None:
+                    flight.results.append(item)
+                    if len(flight.results) > self.max_entry_results:
+                        # Resultado demasiado grande para cachear: se sigue enviando pero no se guarda
+                        flight.results = None
+                        self._forget(flight)
+                for queue in list(flight.subscribers):
+                    await queue.put(item)
+            completed = True
+        except Exception as e:
+            # Lo recibido hasta el error se entrega, pero la búsqueda queda como parcial
+            logger.error(f"Error en la búsqueda federada: {e}")
+            outcome = flight.outcome
+            answered = set(outcome.completed) | set(outcome.failed) | set(outcome.timed_out)
+            outcome.failed.extend([pacs['description'] for pacs in active_pacs if pacs['description'] not in answered]
+                                  or ["búsqueda federada"])
+        finally:
+            self._forget(flight)
+            partial = flight.outcome.failed or flight.outcome.timed_out
+            if completed and not partial and flight.results is not None and flight.generation == self._generation:
+                self._store(flight.key, flight.results)
+            for queue in list(flight.subscribers):
+                await queue.put(_END)
+
+    def _forget(self, flight: _Flight):
+        if self._inflight.get(flight.key) is flight:
+            del self._inflight[flight.key]
+
+    async def find(self, query_params) -> list:
+        return [identifier async for _, identifier in self.stream_query(query_params)]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "cached_results": self._size,
+            "max_results": self.max_results,
+            "inflight": len(self._inflight),
+            "ttl_seconds": self.ttl,
+        }
+
+
+query_cache = QueryCache(
+    ttl=settings.QUERY_CACHE_TTL,
+    max_results=settings.QUERY_CACHE_MAX_RESULTS,
+    max_entry_results=settings.QUERY_CACHE_MAX_ENTRY_RESULTS,
+)
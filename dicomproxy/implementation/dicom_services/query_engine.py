@@ -0,0 +1,343 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import closing
+from loguru import logger
+
+from implementation import metrics, tracing
+from implementation.config.settings import settings
+from implementation.dicom_services import dimse_scu
+from implementation.dicom_services.health import health_prober
+from implementation.dicom_services.circuit_breaker import circuit_breakers
+from implementation.dicom_services.scheduler import Overloaded, current_client
+
+_DONE = object()
+_DEADLINE = object()
+# Cada cuánto comprueba un hilo que espera hueco en el búfer si la búsqueda se abandonó
+_BUFFER_POLL_SECONDS = 0.2
+
+
+class _LatencyWindow:
+    """Ventana deslizante de las últimas mediciones (en segundos)."""
+
+    def __init__(self, size: int = 500):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        with self._lock:
+            self._samples.append(value)
+
+    def summary(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"count": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "count": len(samples),
+            "avg_ms": round(sum(samples) / len(samples) * 1000, 2),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(samples[-1] * 1000, 2),
+        }
+
+
+class QueryOutcome:
+    """Resumen de una búsqueda federada: qué PACS respondieron y cuáles no."""
+
+    def __init__(self):
+        self.completed = []   # descripciones de los PACS que terminaron
+        self.failed = []      # error, circuito abierto en el momento de lanzar, etc.
+        self.timed_out = []   # sin terminar al vencer el plazo (se les envió C-CANCEL)
+        self.skipped = []     # caídos o con el circuito abierto antes de empezar
+        self.cached = False
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.failed or self.timed_out or self.skipped)
+
+    def merge(self, other: "QueryOutcome"):
+        self.completed, self.failed, self.timed_out = list(other.completed), list(other.failed), list(other.timed_out)
+        self.skipped = list(other.skipped)
+
+    def update(self, values: dict):
+        """Carga el resumen recibido de otro proceso (el gateway DIMSE)."""
+        for key in ("completed", "failed", "timed_out", "skipped"):
+            setattr(self, key, list(values.get(key, ())))
+        self.cached = bool(values.get("cached"))
+
+    def to_dict(self) -> dict:
+        return {"completed": self.completed, "failed": self.failed, "timed_out": self.timed_out,
+                "skipped": self.skipped, "cached": self.cached, "partial": self.partial}
+
+
+class _Target:
+    """
+    Un destino de la búsqueda federada: un PACS, o un grupo de PACS espejo del que
+    basta la respuesta de uno. Los candidatos se prueban del más rápido al más lento;
+    el primero que responde se queda el destino y a los demás se les cancela el C-FIND.
+    """
+
+    def __init__(self, candidates, query_params, post, cancelled: threading.Event, client: str):
+        self.candidates = candidates
+        self.query_params = query_params
+        self.client = client
+        self.post = post
+        self.cancelled = cancelled
+        self.winner = None
+        self.winner_failed = False  # el ganador falló tras enviar parte de sus resultados
+        self.launched = 0
+        self.failed = 0
+        self.finished = False
+        self.expired = False
+        self.calls = {}  # id del PACS -> (pacs, FindCall) en curso
+        self._lock = threading.Lock()
+
+    @property
+    def description(self) -> str:
+        return " / ".join(pacs['description'] for pacs in self.candidates)
+
+    def launch_next(self) -> bool:
+        """Lanza el siguiente candidato (petición de respaldo o tras un fallo)."""
+        with self._lock:
+            if self.winner is not None or self.finished or self.launched >= len(self.candidates) or self.cancelled.is_set():
+                return False
+            pacs = self.candidates[self.launched]
+            self.launched += 1
+            hedged = self.launched > 1
+        if not circuit_breakers.acquire(pacs):
+            logger.info(f"Circuito abierto: se omite '{pacs['description']}'")
+            self._finish(pacs, False)
+            return True
+        if hedged:
+            logger.info(f"Búsqueda duplicada en el espejo '{pacs['description']}'")
+        call = dimse_scu.FindCall()
+        with self._lock:
+            self.calls[pacs['id']] = (pacs, call)
+        dimse_scu.find_executor.submit(tracing.bind(self._worker), pacs, call)
+        return True
+
+    def _claim(self, pacs) -> bool:
+        with self._lock:
+            if self.winner is None:
+                self.winner = pacs
+            return self.winner is pacs
+
+    def _worker(self, pacs, call):
+        started = time.perf_counter()
+        first = True
+        ok = False
+        error = None
+        overloaded = False
+        try:
+            # Tras un C-CANCEL se sigue leyendo hasta la respuesta final para devolver la asociación al pool
+            with closing(dimse_scu.iter_c_find(pacs, self.query_params, timeout=health_prober.timeout_for(pacs), call=call, client=self.client)) as identifiers:
+                for identifier in identifiers:
+                    if first:
+                        health_prober.observe_first_response(pacs, time.perf_counter() - started)
+                        first = False
+                    if call.cancelled:
+                        continue
+                    if self.cancelled.is_set() or not self._claim(pacs):
+                        call.cancel()
+                        continue
+                    self.post((self, identifier), result=True)
+            ok = True
+            if first:
+                # Sin coincidencias: la respuesta final es la primera respuesta
+                health_prober.observe_first_response(pacs, time.perf_counter() - started)
+        except Overloaded as exc:
+            overloaded = True
+            logger.warning(f"Búsqueda en '{pacs['description']}' no admitida: {exc}")
+        except Exception as exc:
+            error = str(exc)
+            logger.error(f"La búsqueda en '{pacs['description']}' generó una excepción: {exc}")
+        finally:
+            with self._lock:
+                self.calls.pop(pacs['id'], None)
+                expired = self.expired
+            if expired:
+                pass  # el timeout ya se anotó en el circuito al vencer el plazo
+            elif call.cancelled or overloaded:
+                circuit_breakers.release(pacs)  # sin veredicto sobre el PACS
+            elif ok:
+                circuit_breakers.record_success(pacs)
+            else:
+                circuit_breakers.record_failure(pacs, error)
+            self._finish(pacs, ok and not call.cancelled)
+
+    def _finish(self, pacs, ok: bool):
+        with self._lock:
+            if ok and self.winner is None:
+                self.winner = pacs  # respuesta vacía pero válida
+            if not ok:
+                self.failed += 1
+                if self.winner is pacs:
+                    self.winner_failed = True
+            failover = not ok and self.winner is None and self.launched < len(self.candidates)
+            done = not self.finished and (self.winner is pacs or (self.winner is None and self.failed == len(self.candidates)))
+            if done:
+                self.finished = True
+        if failover:
+            self.launch_next()
+        elif done and not self.cancelled.is_set():
+            self.post((self, _DONE))
+
+    def expire(self) -> list:
+        """Vence el plazo: cancela los C-FIND en curso y anota el timeout en sus circuitos."""
+        with self._lock:
+            if self.finished:
+                return []
+            self.finished = self.expired = True
+            in_flight = list(self.calls.values())
+        for pacs, call in in_flight:
+            call.cancel()
+            circuit_breakers.record_failure(pacs, "plazo de la búsqueda agotado")
+        return [pacs['description'] for pacs, _ in in_flight] or [self.description]
+
+    def cancel(self):
+        """El consumidor abandonó la búsqueda: C-CANCEL a los C-FIND que siguen en curso."""
+        with self._lock:
+            in_flight = list(self.calls.values())
+        for _, call in in_flight:
+            call.cancel()
+
+
+class QueryEngine:
+    """
+    Motor de consultas C-FIND federadas para el event loop de FastAPI.
+    Lanza un C-FIND por PACS activo sobre el pool de hilos compartido de 'dimse_scu'
+    y entrega cada identificador en cuanto llega, sin esperar a los PACS más lentos.
+    Los PACS caídos o con el circuito abierto se omiten; de cada grupo de espejos se
+    consulta el más rápido y, si tarda más de lo habitual, también el siguiente.
+    Cada búsqueda tiene un plazo: al vencer termina con lo recibido y cancela el resto.
+    """
+
+    def __init__(self):
+        self.time_to_first_result = _LatencyWindow()
+        self.total_time = _LatencyWindow()
+        self.queries = 0
+        self.empty_queries = 0
+        self.partial_queries = 0
+        self.deadline_expirations = 0
+        self.recent_partial = deque(maxlen=20)
+
+    async def stream_query(self, query_params, active_pacs=None, deadline: float = None, outcome: QueryOutcome = None):
+        """
+        Generador asíncrono de pares (pacs_config, identificador) a medida que
+        cada PACS responde. Termina al responder todos o al vencer 'deadline'
+        segundos (QUERY_DEADLINE por defecto); 'outcome' recoge qué PACS no
+        llegaron a tiempo. Si el consumidor deja de iterar, o vence el plazo,
+        se envía C-CANCEL a los C-FIND pendientes.
+        """
+        outcome = outcome if outcome is not None else QueryOutcome()
+        if active_pacs is None:
+            active_pacs, skipped = dimse_scu.partition_pacs()
+            outcome.skipped = [pacs['description'] for pacs in skipped]
+        if not active_pacs:
+            logger.warning("No hay ningún PACS activo disponible. No se realizará la búsqueda.")
+            return
+
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        started = time.perf_counter()
+        self.queries += 1
+        # Búfer acotado entre los hilos C-FIND y el consumidor: cada resultado ocupa un hueco
+        # hasta que se entrega; con el búfer lleno el hilo espera y deja de leer del PACS
+        # (contrapresión TCP), en vez de acumular en memoria la respuesta entera
+        slots = threading.Semaphore(settings.QUERY_STREAM_BUFFER)
+        plan = health_prober.plan(active_pacs)
+        # Además de los resultados caben los avisos de fin de cada destino y el del plazo
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.QUERY_STREAM_BUFFER + len(plan) + 1)
+
+        def post(item, result: bool = False):
+            if result:
+                while not slots.acquire(timeout=_BUFFER_POLL_SECONDS):
+                    if cancelled.is_set():
+                        return
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # El event loop ya se cerró: nadie espera estos resultados
+                cancelled.set()
+
+        client = current_client.get()  # los hilos del pool no heredan el contexto
+        targets = [_Target(candidates, query_params, post, cancelled, client) for candidates in plan]
+        timers = [loop.call_later(settings.QUERY_DEADLINE if deadline is None else deadline, queue.put_nowait, (None, _DEADLINE))]
+        logger.info(f"Iniciando búsqueda C-FIND federada asíncrona en {len(active_pacs)} PACS ({len(targets)} destinos)...")
+        for target in targets:
+            target.launch_next()
+            if settings.QUERY_HEDGING:
+                delay = 0.0
+                for pacs in target.candidates[:-1]:
+                    delay += health_prober.hedge_delay(pacs)
+                    timers.append(loop.call_later(delay, target.launch_next))
+
+        pending = len(targets)
+        count = 0
+        try:
+            while pending:
+                target, item = await queue.get()
+                if item is _DONE:
+                    pending -= 1
+                    if target.winner is not None and not target.winner_failed:
+                        outcome.completed.append(target.winner['description'])
+                    elif target.winner is not None:
+                        # Lo ya entregado es solo una parte: la búsqueda no es completa ni se guarda en caché
+                        outcome.failed.append(target.winner['description'])
+                        logger.warning(f"'{target.winner['description']}' falló a mitad de la respuesta; resultados incompletos.")
+                    else:
+                        outcome.failed.append(target.description)
+                    continue
+                if item is _DEADLINE:
+                    for target in targets:
+                        outcome.timed_out.extend(target.expire())
+                    self.deadline_expirations += 1
+                    logger.warning(f"Plazo de la búsqueda federada agotado; resultados parciales, sin respuesta de: {', '.join(outcome.timed_out)}")
+                    break
+                slots.release()
+                if count == 0:
+                    self.time_to_first_result.add(time.perf_counter() - started)
+                count += 1
+                yield target.winner, item
+        finally:
+            cancelled.set()
+            for timer in timers:
+                timer.cancel()
+            for target in targets:
+                target.cancel()
+            elapsed = time.perf_counter() - started
+            if pending == 0 or outcome.timed_out:
+                self.total_time.add(elapsed)
+            if count == 0:
+                self.empty_queries += 1
+            if outcome.partial:
+                self.partial_queries += 1
+                self.recent_partial.append({"time": time.time(), **outcome.to_dict()})
+            metrics.query_results.observe(count)
+            metrics.query_duration_seconds.labels("partial" if outcome.partial else "complete" if pending == 0 else "abandoned").observe(elapsed)
+            logger.success(f"Búsqueda federada asíncrona: {count} resultados en {elapsed * 1000:.0f} ms")
+
+    async def find(self, query_params) -> list:
+        """Versión 'await' que reúne todos los identificadores en una lista."""
+        return [identifier async for _, identifier in self.stream_query(query_params)]
+
+    def stats(self) -> dict:
+        return {
+            "queries": self.queries,
+            "empty_queries": self.empty_queries,
+            "partial_queries": self.partial_queries,
+            "deadline_expirations": self.deadline_expirations,
+            "time_to_first_result": self.time_to_first_result.summary(),
+            "total_time": self.total_time.summary(),
+            "max_workers": dimse_scu.find_executor._max_workers,
+            "recent_partial": list(self.recent_partial),
+        }
+
+
+query_engine = QueryEngine()
@@ -0,0 +1,299 @@
+import asyncio
+import io
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from pydicom import dcmread
+from pydicom.dataset import Dataset
+from pydicom.multival import MultiValue
+from pydicom.pixels import pixel_array
+from loguru import logger
+
+from implementation.config.settings import settings
+from implementation.dicom_services.spool import SpooledInstance
+from implementation.dicom_services.cpu_pool import cpu_pool
+from implementation.dicom_services.frames import FrameNotFound, MappedFile
+
+# El renderizado es CPU (NumPy y Pillow liberan el GIL en las operaciones pesadas);
+# la decodificación de instancias grandes (RLE, JPEG...) no, y va al pool de procesos
+render_executor = ThreadPoolExecutor(max_workers=settings.RENDER_MAX_WORKERS, thread_name_prefix="render")
+
+MEDIA_TYPES = {"image/jpeg": "JPEG", "image/png": "PNG"}
+DEFAULT_MEDIA_TYPE = "image/jpeg"
+DEFAULT_QUALITY = 90
+
+
+class RenderError(ValueError):
+    """Parámetros de renderizado no válidos o imagen que no se puede renderizar."""
+
+
+class RenderNotAcceptable(RenderError):
+    """El cliente pide un tipo de medio que no se puede generar."""
+
+
+class RenderParams:
+    """
+    Parámetros de /rendered y /thumbnail (PS3.18, 8.3.5): ventana, tamaño de salida,
+    calidad y tipo de medio. Son inmutables y sirven de clave en la caché.
+    """
+
+    def __init__(self, media_type: str = DEFAULT_MEDIA_TYPE, window=None, viewport=None, quality: int = DEFAULT_QUALITY):
+        self.media_type = media_type
+        self.window = window
+        self.viewport = viewport
+        self.quality = quality
+
+    @classmethod
+    def from_query(cls, query_params, accept: str = None, default_viewport=None) -> "RenderParams":
+        media_type = _negotiate(query_params.get("accept") or accept)
+        window = None
+        if "window" in query_params:
+            parts = query_params["window"].split(",")
+            try:
+                center, width = float(parts[0]), float(parts[1])
+            except (ValueError, IndexError):
+                raise RenderError("'window' debe ser 'centro,anchura[,función]'")
+            function = parts[2].strip().lower() if len(parts) > 2 else "linear"
+            if function not in ("linear", "linear_exact", "sigmoid"):
+                raise RenderError(f"Función VOI no soportada: '{function}'")
+            if width <= 0:
+                raise RenderError("La anchura de ventana debe ser positiva")
+            window = (center, width, function)
+        viewport = default_viewport
+        if "viewport" in query_params:
+            parts = query_params["viewport"].split(",")
+            try:
+                viewport = (int(parts[0]), int(parts[1]))
+            except (ValueError, IndexError):
+                raise RenderError("'viewport' debe ser 'anchura,altura'")
+            if viewport[0] <= 0 or viewport[1] <= 0:
+                raise RenderError("'viewport' debe ser positivo")
+        quality = DEFAULT_QUALITY
+        if "quality" in query_params:
+            try:
+                quality = int(query_params["quality"])
+            except ValueError:
+                raise RenderError("'quality' debe ser un entero entre 1 y 100")
+            if not 1 <= quality <= 100:
+                raise RenderError("'quality' debe ser un entero entre 1 y 100")
+        return cls(media_type, window, viewport, quality)
+
+    def key(self) -> tuple:
+        return (self.media_type, self.window, self.viewport, self.quality if self.media_type == "image/jpeg" else None)
+
+
+def _negotiate(accept: str = None) -> str:
+    """Elige image/jpeg o image/png a partir de la cabecera Accept (o del parámetro 'accept')."""
+    if not accept:
+        return DEFAULT_MEDIA_TYPE
+    for candidate in accept.split(","):
+        media_type = candidate.split(";")[0].strip().lower()
+        if media_type in MEDIA_TYPES:
+            return media_type
+        if media_type in ("*/*", "image/*"):
+            return DEFAULT_MEDIA_TYPE
+    raise RenderNotAcceptable(f"Tipo de medio no soportado para imágenes renderizadas: '{accept}'")
+
+
+# --- Cálculo de píxeles (NumPy vectorizado) ---
+def _first(value, default):
+    """Primer valor numérico de un atributo multivalor (p. ej. varias ventanas), o el valor por defecto."""
+    if isinstance(value, MultiValue):
+        value = value[0] if len(value) else None
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+def _downsample(pixels: np.ndarray, viewport) -> np.ndarray:
+    """Reduce por bloques (media de cada bloque k×k) hasta caber en el viewport."""
+    if viewport is None:
+        return pixels
+    rows, columns = pixels.shape[:2]
+    factor = int(max(rows / viewport[1], columns / viewport[0]))
+    if factor <= 1:
+        return pixels
+    rows, columns = rows - rows % factor, columns - columns % factor
+    blocks = pixels[:rows, :columns].reshape(rows // factor, factor, columns // factor, factor, *pixels.shape[2:])
+    return blocks.mean(axis=(1, 3))
+
+
+def _apply_voi(values: np.ndarray, ds: Dataset, window) -> np.ndarray:
+    """Ventana (centro/anchura) sobre valores de modalidad; devuelve 0..255 en float32."""
+    if window is None:
+        center = _first(ds.get("WindowCenter"), None)
+        width = _first(ds.get("WindowWidth"), None)
+        function = str(ds.get("VOILUTFunction", "LINEAR")).lower()
+        if center is None or not width or width <= 0:
+            low, high = float(values.min()), float(values.max())
+            center, width, function = (low + high) / 2, max(high - low, 1.0), "linear_exact"
+    else:
+        center, width, function = window
+    if function == "sigmoid":
+        return 255.0 / (1.0 + np.exp(-4.0 * (values - center) / width))
+    if function == "linear_exact":
+        scaled = (values - center) / width + 0.5
+    else:
+        scaled = (values - (center - 0.5)) / max(width - 1.0, 1.0) + 0.5
+    return np.clip(scaled, 0.0, 1.0) * 255.0
+
+
+def render_pixels(pixels: np.ndarray, ds: Dataset, params: RenderParams) -> np.ndarray:
+    """
+    Convierte los píxeles almacenados en una imagen de 8 bits: Modality LUT
+    (pendiente/ordenada), reducción al viewport y ventana VOI, todo vectorizado.
+    La reducción se hace antes de la ventana para operar sobre menos píxeles.
+    """
+    photometric = str(ds.get("PhotometricInterpretation", "MONOCHROME2")).upper()
+    values = _downsample(pixels.astype(np.float32, copy=False), params.viewport)
+    if photometric.startswith("MONOCHROME"):
+        slope = _first(ds.get("RescaleSlope"), 1.0)
+        intercept = _first(ds.get("RescaleIntercept"), 0.0)
+        if slope != 1.0 or intercept != 0.0:
+            values = values * slope + intercept
+        values = _apply_voi(values, ds, params.window)
+        if photometric == "MONOCHROME1":
+            values = 255.0 - values
+    elif params.window is not None:
+        values = _apply_voi(values, ds, params.window)
+    elif pixels.dtype != np.uint8:
+        bits = int(ds.get("BitsStored", 8))
+        values = values * (255.0 / ((1 << bits) - 1))
+    return np.rint(values).astype(np.uint8)
+
+
+def _encode(image: np.ndarray, params: RenderParams) -> bytes:
+    picture = Image.fromarray(image)
+    if params.viewport is not None:
+        # Ajuste final (la reducción por bloques solo usa factores enteros)
+        picture.thumbnail(params.viewport, Image.Resampling.BILINEAR)
+    out = io.BytesIO()
+    if MEDIA_TYPES[params.media_type] == "JPEG":
+        picture.save(out, format="JPEG", quality=params.quality)
+    else:
+        picture.save(out, format="PNG", compress_level=3)
+    return out.getvalue()
+
+
+def render_instance(instance: SpooledInstance, frame: int, params: RenderParams) -> bytes:
+    """
+    Renderiza un fotograma (numerado desde 1) de la instancia. Solo se decodifica
+    ese fotograma; el resto del Pixel Data no se lee.
+    """
+    ds = Dataset()
+    with instance.open() as f:
+        header = dcmread(f, stop_before_pixels=True, specific_tags=["NumberOfFrames"])
+        frame_count = int(header.get("NumberOfFrames") or 1)
+        if frame > frame_count:
+            raise FrameNotFound(f"La instancia {instance.sop_instance_uid} solo tiene {frame_count} fotogramas (pedido: {frame}).")
+        f.seek(0)
+        try:
+            pixels = pixel_array(f, ds_out=ds, index=frame - 1)
+        except (AttributeError, KeyError, ValueError, NotImplementedError, RuntimeError) as e:
+            raise RenderError(f"No se puede renderizar la instancia {instance.sop_instance_uid}: {e}")
+    if pixels.ndim == 3 and pixels.shape[-1] not in (3, 4):
+        pixels = pixels[0]
+    data = _encode(render_pixels(pixels, ds, params), params)
+    logger.debug(f"Renderizado {instance.sop_instance_uid} fotograma {frame} ({params.media_type}, viewport={params.viewport}): {len(data)} bytes.")
+    return data
+
+
+class _PooledInstance:
+    """La instancia vista desde un proceso del pool: su archivo o sus bytes en memoria compartida."""
+
+    def __init__(self, sop_instance_uid: str, path: str = None, buffer=None):
+        self.sop_instance_uid = sop_instance_uid
+        self.path = path
+        self.buffer = buffer
+
+    @contextmanager
+    def open(self):
+        if self.buffer is not None:
+            yield MappedFile(self.buffer)
+            return
+        with open(self.path, "rb") as f:
+            yield f
+
+
+def _render_file(path: str, sop_instance_uid: str, frame: int, params: RenderParams) -> bytes:
+    return render_instance(_PooledInstance(sop_instance_uid, path=path), frame, params)
+
+
+def _render_shared(parts, sop_instance_uid: str, frame: int, params: RenderParams) -> bytes:
+    return render_instance(_PooledInstance(sop_instance_uid, buffer=parts[0]), frame, params)
+
+
+async def render(instance: SpooledInstance, frame: int, params: RenderParams) -> bytes:
+    """
+    Renderiza un fotograma fuera del event loop: las instancias grandes en el pool de
+    procesos (el archivo lo abre el propio proceso; si está en memoria, sus bytes van
+    en memoria compartida) y el resto en los hilos de renderizado.
+    """
+    loop = asyncio.get_running_loop()
+
+    def inline():
+        return loop.run_in_executor(render_executor, render_instance, instance, frame, params)
+    if instance.in_memory:
+        return await cpu_pool.run("render", instance.size, _render_shared, instance.sop_instance_uid, frame, params,
+                                  shared=[instance.data], inline=inline)
+    return await cpu_pool.run("render", instance.size, _render_file, str(instance.path), instance.sop_instance_uid, frame, params,
+                              inline=inline)
+
+
+class BytesCache:
+    """
+    Caché LRU en memoria de resultados ya calculados (imágenes renderizadas,
+    instancias transcodificadas), con presupuesto en bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / total, 4) if total else None}
+
+
+# Clave: (SOPInstanceUID, fotograma, parámetros de renderizado)
+render_cache = BytesCache(settings.RENDER_CACHE_MAX_BYTES)
+
+
+def cache_key(sop_instance_uid: str, frame: int, params: RenderParams) -> tuple:
+    return (sop_instance_uid, frame) + params.key()
+
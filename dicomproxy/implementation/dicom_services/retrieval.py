@@ -0,0 +1,143 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pydicom.dataset import Dataset
+from loguru import logger
+
+from implementation import tracing
+from implementation.config.settings import settings
+from implementation.dicom_services import dimse_scu
+from implementation.dicom_services.dimse_scp import storage_scp
+from implementation.dicom_services.gateway_client import dimse_gateway, GatewayError
+from implementation.dicom_services.instance_store import instance_store
+from implementation.dicom_services.query_cache import query_cache
+from implementation.dicom_services.scheduler import Overloaded, current_client
+
+# Los C-MOVE/C-GET bloquean su hilo hasta la respuesta final; se ejecutan en su propio pool
+retrieve_executor = ThreadPoolExecutor(max_workers=settings.RETRIEVE_MAX_WORKERS, thread_name_prefix="dimse-move")
+
+
+class RetrieveError(RuntimeError):
+    """La recuperación no pudo iniciarse o el PACS la rechazó."""
+
+
+class InstanceNotFound(LookupError):
+    """Ni la caché local ni ningún PACS activo tiene lo solicitado."""
+
+
+async def locate_source(study_uid: str, series_uid: str = None, instance_uid: str = None):
+    """
+    Busca (C-FIND, a través de la caché de consultas) el primer PACS activo que tenga
+    el estudio, serie o instancia. Las demás búsquedas se cancelan al encontrarlo.
+    """
+    identifier = Dataset()
+    identifier.StudyInstanceUID = study_uid
+    if instance_uid:
+        identifier.QueryRetrieveLevel = "IMAGE"
+        identifier.SeriesInstanceUID = series_uid or ""
+        identifier.SOPInstanceUID = instance_uid
+    elif series_uid:
+        identifier.QueryRetrieveLevel = "SERIES"
+        identifier.SeriesInstanceUID = series_uid
+    else:
+        identifier.QueryRetrieveLevel = "STUDY"
+    results = (dimse_gateway if dimse_gateway.enabled else query_cache).stream_query(identifier)
+    try:
+        async for pacs, _ in results:
+            return pacs
+    finally:
+        await results.aclose()
+    return None
+
+
+async def _from_cache(study_uid: str, series_uid: str = None, instance_uids=None):
+    """Devuelve (instancias en caché, UIDs que faltan, si hace falta ir al PACS)."""
+    if instance_uids:
+        cached = await asyncio.to_thread(instance_store.get_many, instance_uids)
+        missing = sorted(set(instance_uids) - {instance.sop_instance_uid for instance in cached})
+        return cached, missing, bool(missing)
+    cached = await asyncio.to_thread(instance_store.get_complete, study_uid, series_uid)
+    if cached is not None:
+        logger.info(f"Recuperación servida desde la caché local: {len(cached)} instancias.")
+        return cached, None, False
+    return [], None, True
+
+
+async def _chain(cached, pacs_config, study_uid, series_uid, missing):
+    for instance in cached:
+        yield instance
+    if pacs_config is not None:
+        async for instance in _remote_instances(pacs_config, study_uid, series_uid, missing):
+            yield instance
+
+
+async def open_retrieval(study_uid: str, series_uid: str = None, instance_uids=None):
+    """
+    Prepara una recuperación sin saber en qué PACS está el objeto: resuelve la caché
+    local y, si hace falta, el PACS de origen antes de empezar a responder, de modo
+    que el llamador pueda contestar 404. Devuelve el generador asíncrono de instancias.
+    """
+    cached, missing, remote = await _from_cache(study_uid, series_uid, instance_uids)
+    pacs_config = None
+    if remote:
+        single = missing[0] if missing and len(missing) == 1 else None
+        pacs_config = await locate_source(study_uid, series_uid, single)
+        if pacs_config is None and not cached:
+            raise InstanceNotFound(f"Ningún PACS activo tiene el objeto solicitado (estudio {study_uid}).")
+    return _chain(cached, pacs_config, study_uid, series_uid, missing)
+
+
+async def _remote_instances(pacs_config: dict, study_uid: str, series_uid: str = None, instance_uids=None):
+    """
+    Recupera del PACS con el modo configurado en 'pacs_configs': C-MOVE hacia el
+    Storage SCP persistente o C-GET por la misma asociación. En ambos casos las
+    instancias pasan por el mismo manejador C-STORE y la misma cola.
+    Con gateway DIMSE la recuperación la hace el gateway (dueño del Storage SCP).
+    """
+    if dimse_gateway.enabled:
+        instances = dimse_gateway.retrieve(pacs_config, study_uid, series_uid, instance_uids)
+        try:
+            async for instance in instances:
+                yield instance
+        except GatewayError as e:
+            raise RetrieveError(str(e))
+        finally:
+            await instances.aclose()
+        return
+
+    strategy = dimse_scu.retrieval_strategy(pacs_config)
+    if strategy == "C-MOVE" and not storage_scp.is_running:
+        raise RetrieveError("El Storage SCP no está en marcha; no se puede recibir el C-MOVE.")
+
+    request = storage_scp.register(study_uid, series_uid, instance_uids)
+    loop = asyncio.get_running_loop()
+    client = current_client.get()  # 'run_in_executor' no propaga el contexto
+
+    def run_retrieve():
+        try:
+            if strategy == "C-GET":
+                return dimse_scu.get_instances(pacs_config, request, study_uid, series_uid, instance_uids, client=client)
+            return dimse_scu.move_instances(pacs_config, study_uid, series_uid, instance_uids,
+                                            move_destination_aet=storage_scp.ae_title, msg_id=request.message_id, client=client)
+        finally:
+            # Las sub-operaciones C-STORE terminan antes de la respuesta final,
+            # así que la marca de fin queda detrás de todas las instancias en la cola.
+            request.finish()
+
+    retrieve_future = loop.run_in_executor(retrieve_executor, tracing.bind(run_retrieve))
+    try:
+        while (item := await request.get()) is not None:
+            yield item
+        try:
+            final_status = await retrieve_future
+        except Overloaded as e:
+            raise RetrieveError(f"Recuperación no admitida: {e}")
+        if final_status is None:
+            raise RetrieveError(f"No se pudo establecer la asociación con '{pacs_config['description']}'.")
+        if final_status.Status not in (0x0000, 0xB000):
+            raise RetrieveError(f"El PACS '{pacs_config['description']}' respondió al {strategy} con estado 0x{final_status.Status:04X}.")
+        if final_status.Status == 0x0000 and not instance_uids and request.received:
+            await asyncio.to_thread(instance_store.mark_complete, study_uid, series_uid)
+        logger.success(f"Recuperación {strategy} (Message ID {request.message_id}) completada: {request.received} instancias.")
+    finally:
+        storage_scp.unregister(request)
+        request.close()
@@ -0,0 +1,190 @@
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from loguru import logger
+
+from implementation import tracing
+from implementation.config.settings import settings
+from implementation.dicom_services.association_pool import pacs_key
+
+# Cliente HTTP que origina la operación DIMSE (lo fija la admisión de la capa web)
+current_client: contextvars.ContextVar[str] = contextvars.ContextVar("dimse_client", default="local")
+
+
+class Overloaded(Exception):
+    """Demasiadas operaciones DIMSE en cola: reintentar pasados 'retry_after' segundos."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def pacs_limit(pacs_config) -> int:
+    """Asociaciones simultáneas permitidas con el PACS ('max_associations' o el valor por defecto)."""
+    limit = pacs_config.get('max_associations')
+    return max(1, int(limit)) if limit else settings.POOL_MAX_ASSOCIATIONS_PER_PACS
+
+
+class _Waiter:
+    __slots__ = ("key", "limit", "client", "granted")
+
+    def __init__(self, key: tuple, limit: int, client: str):
+        self.key = key
+        self.limit = limit
+        self.client = client
+        self.granted = False
+
+
+class DimseScheduler:
+    """
+    Control de admisión de las operaciones DIMSE salientes (C-FIND, C-MOVE, C-GET).
+    Cada operación ocupa un hueco global (DIMSE_MAX_CONCURRENT) y uno de su PACS
+    ('max_associations' en 'pacs_configs'). Las que no caben esperan en una cola por
+    cliente y los huecos que se liberan se reparten por turnos entre clientes, así
+    que una ráfaga de un cliente no deja sin servicio a los demás. Si las colas
+    superan su límite se rechaza enseguida con Overloaded en lugar de acumular.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_queue_per_client: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_pacs: dict[tuple, int] = {}
+        self._queues: OrderedDict[str, deque] = OrderedDict()  # orden = turno de los clientes
+        self._waiting = 0
+        self._hold_time = None  # media móvil del tiempo que se ocupa un hueco (s)
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    # --- Admisión ---
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se vacíe la cola actual."""
+        hold = self._hold_time or 1.0
+        return min(60, max(1, math.ceil(self._waiting / self.max_concurrent * hold)))
+
+    def _check(self, client: str):
+        queue = self._queues.get(client)
+        if self._waiting >= self.max_queue:
+            reason = f"Cola DIMSE llena ({self._waiting} operaciones en espera)"
+        elif queue is not None and len(queue) >= self.max_queue_per_client:
+            reason = f"Demasiadas operaciones DIMSE en espera para '{client}'"
+        else:
+            return
+        self.rejected += 1
+        logger.warning(f"{reason}: se rechaza la operación.")
+        raise Overloaded(reason, self.retry_after())
+
+    def admit(self, client: str):
+        """Comprobación a la entrada de la petición HTTP: lanza Overloaded si no hay sitio en la cola."""
+        with self._cond:
+            self._check(client)
+
+    # --- Huecos ---
+    def _has_capacity(self, key: tuple, limit: int) -> bool:
+        return self._active < self.max_concurrent and self._active_by_pacs.get(key, 0) < limit
+
+    def _grant(self, key: tuple):
+        self._active += 1
+        self._active_by_pacs[key] = self._active_by_pacs.get(key, 0) + 1
+        self.granted += 1
+
+    def _dispatch(self):
+        """Reparte los huecos libres por turnos entre clientes (dentro de cada cliente, en orden de llegada)."""
+        while self._active < self.max_concurrent and self._queues:
+            for client, queue in self._queues.items():
+                waiter = next((w for w in queue if self._active_by_pacs.get(w.key, 0) < w.limit), None)
+                if waiter is not None:
+                    break
+            else:
+                break  # todos los que esperan van a PACS sin huecos libres
+            queue.remove(waiter)
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            waiter.granted = True
+            self._grant(waiter.key)
+        self._cond.notify_all()
+
+    def _abandon(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[waiter.client]
+
+    @contextmanager
+    def slot(self, pacs_config, client: str = None, timeout: float = None, cancelled=None):
+        """
+        Ocupa un hueco para una operación con el PACS mientras dura el bloque.
+        'cancelled' (callable) permite abandonar la espera si la operación se cancela;
+        se puede despertar a los que esperan con 'interrupt()'.
+        """
+        key = pacs_key(pacs_config)
+        limit = pacs_limit(pacs_config)
+        client = client or current_client.get()
+        with self._cond:
+            if not self._waiting and self._has_capacity(key, limit):
+                self._grant(key)
+            else:
+                self._check(client)
+                waiter = _Waiter(key, limit, client)
+                self._queues.setdefault(client, deque()).append(waiter)
+                self._waiting += 1
+                self.queued += 1
+                self._dispatch()
+                deadline = time.monotonic() + (settings.DIMSE_QUEUE_TIMEOUT if timeout is None else timeout)
+                with tracing.span("DIMSE queue wait", client=client, waiting=self._waiting):
+                    while not waiter.granted:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or (cancelled is not None and cancelled()):
+                            self._abandon(waiter)
+                            if remaining <= 0:
+                                self.timeouts += 1
+                                raise Overloaded(f"Tiempo agotado esperando un hueco DIMSE para {key[0]}@{key[1]}:{key[2]}", self.retry_after())
+                            raise Overloaded("Operación DIMSE cancelada mientras esperaba en cola", self.retry_after())
+                        self._cond.wait(remaining)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            with self._cond:
+                self._hold_time = held if self._hold_time is None else 0.9 * self._hold_time + 0.1 * held
+                self._active -= 1
+                self._active_by_pacs[key] -= 1
+                if not self._active_by_pacs[key]:
+                    del self._active_by_pacs[key]
+                self._dispatch()
+
+    def interrupt(self):
+        """Despierta a los que esperan para que comprueben si su operación se canceló."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active, "max_concurrent": self.max_concurrent,
+                "waiting": self._waiting, "max_queue": self.max_queue, "max_queue_per_client": self.max_queue_per_client,
+                "active_by_pacs": {f"{aet}@{ip}:{port}": count for (aet, ip, port), count in self._active_by_pacs.items()},
+                "waiting_by_client": {client: len(queue) for client, queue in self._queues.items()},
+                "avg_hold_ms": round(self._hold_time * 1000, 2) if self._hold_time is not None else None,
+                "granted": self.granted, "queued": self.queued, "rejected": self.rejected, "timeouts": self.timeouts,
+            }
+
+
+dimse_scheduler = DimseScheduler(
+    max_concurrent=settings.DIMSE_MAX_CONCURRENT,
+    max_queue=settings.DIMSE_MAX_QUEUE,
+    max_queue_per_client=settings.DIMSE_MAX_QUEUE_PER_CLIENT,
+)
@@ -0,0 +1,143 @@
+import io
+import os
+import shutil
+import uuid
+import weakref
+from pathlib import Path
+from loguru import logger
+import pydicom
+
+from implementation.config.settings import settings
+
+SPOOL_DIR = Path(settings.SPOOL_DIR)
+CHUNK_SIZE = 1024 * 1024
+
+_HEADER_TAGS = ["StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "SOPClassUID"]
+
+
+def _unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"No se pudo borrar el archivo de spool '{path}': {e}")
+
+
+def prepare_spool_dir():
+    """Crea el directorio de spool y borra restos de ejecuciones anteriores."""
+    SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    for leftover in SPOOL_DIR.glob("*.dcm"):
+        _unlink_quietly(str(leftover))
+
+
+def read_header(path) -> dict:
+    """Lee solo los UID de cabecera necesarios para enrutar la instancia, sin tocar el Pixel Data."""
+    ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=_HEADER_TAGS)
+    return {
+        "study_uid": ds.get("StudyInstanceUID"),
+        "series_uid": ds.get("SeriesInstanceUID"),
+        "transfer_syntax": str(ds.file_meta.TransferSyntaxUID),
+    }
+
+
+class SpooledInstance:
+    """
+    Manejador de una instancia recibida, en formato de archivo DICOM tal cual llegó
+    por la red (sin decodificar ni recodificar). Las instancias pequeñas se guardan
+    en memoria; las que superan SPOOL_INLINE_MAX_BYTES quedan en un archivo de spool
+    y nunca se cargan enteras en RAM salvo que el consumidor lo pida con read_bytes().
+    """
+
+    def __init__(self, sop_instance_uid: str, sop_class_uid: str, study_uid: str, series_uid: str,
+                 transfer_syntax: str, size: int, path: Path = None, data: bytes = None, owned: bool = True,
+                 on_release=None):
+        self.sop_instance_uid = sop_instance_uid
+        self.sop_class_uid = sop_class_uid
+        self.study_uid = study_uid
+        self.series_uid = series_uid
+        self.transfer_syntax = transfer_syntax
+        self.size = size
+        self.path = path
+        self.data = data
+        # El archivo de spool se borra cuando nadie conserva ya el manejador
+        # (salvo que pertenezca a otro almacén, como la caché local de instancias)
+        self._finalizer = weakref.finalize(self, _unlink_quietly, str(path)) if path is not None and owned else None
+        # Aviso a quien entregó el manejador cuando se libera (o se pierde), p. ej. para
+        # que el almacén de instancias vuelva a poder expulsar el archivo
+        self._release_hook = weakref.finalize(self, on_release) if on_release is not None else None
+
+    @classmethod
+    def from_received_file(cls, received_path, sop_instance_uid: str, sop_class_uid: str) -> "SpooledInstance":
+        """
+        Crea el manejador a partir del archivo temporal que escribe pynetdicom al recibir
+        el C-STORE en bloques. El archivo se mueve al spool (o se lee si es pequeño).
+        """
+        received_path = Path(received_path)
+        header = read_header(received_path)
+        size = received_path.stat().st_size
+        common = dict(sop_instance_uid=sop_instance_uid, sop_class_uid=sop_class_uid, size=size, **header)
+        if size <= settings.SPOOL_INLINE_MAX_BYTES:
+            # pynetdicom borra su archivo temporal al volver del manejador
+            return cls(data=received_path.read_bytes(), **common)
+        target = SPOOL_DIR / f"{uuid.uuid4().hex}.dcm"
+        try:
+            os.replace(received_path, target)
+        except OSError:
+            # Distinto sistema de archivos: se copia en bloques
+            shutil.move(str(received_path), target)
+        return cls(path=target, **common)
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    @property
+    def owns_file(self) -> bool:
+        """Si el archivo es de spool y se borra al liberar el manejador (no pertenece a otro almacén)."""
+        return self._finalizer is not None
+
+    def open(self):
+        """Archivo binario de solo lectura con el objeto DICOM completo (cabecera Part 10 incluida)."""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        """Recorre el objeto en bloques, sin cargarlo entero en memoria."""
+        if self.data is not None:
+            view = memoryview(self.data)
+            for start in range(0, len(view), chunk_size):
+                yield view[start:start + chunk_size]
+            return
+        with open(self.path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def read_bytes(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        return self.path.read_bytes()
+
+    def detach_file(self) -> Path:
+        """Cede la propiedad del archivo de spool (p. ej. al moverlo a otro almacén)."""
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+        return self.path
+
+    def detach_release_hook(self) -> bool:
+        """Cede el aviso de liberación (p. ej. al pasar el manejador a otro proceso). Devuelve si lo había."""
+        if self._release_hook is None:
+            return False
+        self._release_hook.detach()
+        self._release_hook = None
+        return True
+
+    def release(self):
+        """Libera el archivo de spool en cuanto el consumidor termina con él."""
+        if self._finalizer is not None:
+            self._finalizer()
+        if self._release_hook is not None:
+            self._release_hook()
+        self.data = None
@@ -0,0 +1,183 @@
+import asyncio
+import io
+from pydicom import dcmread
+from pydicom.filewriter import dcmwrite
+from pydicom.pixels import get_decoder, get_encoder
+from pydicom.uid import (
+    UID, ImplicitVRLittleEndian, ExplicitVRLittleEndian, DeflatedExplicitVRLittleEndian,
+    RLELossless, JPEGLSLossless, JPEG2000Lossless,
+)
+from loguru import logger
+
+from implementation import metrics
+from implementation.config.settings import settings
+from implementation.dicom_services.cpu_pool import cpu_pool
+from implementation.dicom_services.frames import MappedFile
+from implementation.dicom_services.rendering import BytesCache
+from implementation.dicom_services.spool import SpooledInstance
+
+# Sintaxis a las que se puede transcodificar siempre (solo cambia la codificación del dataset)
+NATIVE_SYNTAXES = (ExplicitVRLittleEndian, ImplicitVRLittleEndian, DeflatedExplicitVRLittleEndian)
+# Sintaxis comprimidas (sin pérdida) de destino, si el codificador está instalado
+ENCAPSULATED_TARGETS = (RLELossless, JPEGLSLossless, JPEG2000Lossless)
+
+_PIXEL_KEYWORDS = ("PixelData", "FloatPixelData", "DoubleFloatPixelData")
+
+
+class TranscodeError(ValueError):
+    """La instancia no se puede convertir a la sintaxis pedida (p. ej. falta el decodificador)."""
+
+
+class TransferSyntaxNotAcceptable(TranscodeError):
+    """Ninguna de las sintaxis de transferencia de la cabecera Accept se puede generar."""
+
+
+def _available(factory, uid) -> bool:
+    try:
+        return factory(uid).is_available
+    except NotImplementedError:
+        return False
+
+
+def can_encode(uid: str) -> bool:
+    return uid in NATIVE_SYNTAXES or (uid in ENCAPSULATED_TARGETS and _available(get_encoder, UID(uid)))
+
+
+def negotiate(accept: str = None):
+    """
+    Sintaxis de transferencia pedida en la cabecera Accept de WADO-RS (parámetro
+    'transfer-syntax' de application/dicom, PS3.18 8.7.3.5), en orden de preferencia
+    (q). Sin el parámetro (o sin cabecera) es Explicit VR Little Endian, la sintaxis
+    por defecto de application/dicom. Devuelve None solo con 'transfer-syntax=*':
+    la instancia se envía tal como está almacenada.
+    """
+    candidates = []
+    for position, entry in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        values = {}
+        for param in params:
+            name, _, value = param.partition("=")
+            values[name.strip().lower()] = value.strip().strip('"')
+        if media_type.lower() == "multipart/related":
+            media_type = values.get("type", "application/dicom")
+        if media_type.lower() not in ("application/dicom", "*/*", "*", ""):
+            continue
+        try:
+            quality = float(values.get("q", 1))
+        except ValueError:
+            quality = 1.0
+        candidates.append((-quality, position, values.get("transfer-syntax")))
+    if not candidates:
+        return ExplicitVRLittleEndian
+    requested = []
+    for _, _, uid in sorted(candidates):
+        if uid == "*":
+            return None
+        uid = uid or ExplicitVRLittleEndian
+        if can_encode(uid):
+            return uid
+        requested.append(uid)
+    raise TransferSyntaxNotAcceptable(f"Sintaxis de transferencia no soportadas: {', '.join(requested)}")
+
+
+def _native_little_endian(ds):
+    """Píxeles nativos de una instancia Big Endian (retirada) reordenados a Little Endian."""
+    if ds.file_meta.TransferSyntaxUID.is_little_endian:
+        return
+    if "PixelData" in ds and int(ds.get("BitsAllocated", 8)) > 8:
+        pixels = ds.pixel_array
+        ds.PixelData = pixels.astype(pixels.dtype.newbyteorder("<"), copy=False).tobytes()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+
+def transcode_file(f, target: str) -> bytes:
+    """
+    Lee la instancia de 'f' y la escribe en la sintaxis 'target': descomprime los
+    píxeles encapsulados (si hay decodificador), los comprime con el codificador de
+    pydicom para las sintaxis encapsuladas y, para las nativas, solo recodifica el dataset.
+    """
+    ds = dcmread(f)
+    source = ds.file_meta.TransferSyntaxUID
+    target = UID(target)
+    has_pixels = any(keyword in ds for keyword in _PIXEL_KEYWORDS)
+    try:
+        if has_pixels and source.is_encapsulated:
+            if not _available(get_decoder, source):
+                raise TranscodeError(f"No hay decodificador instalado para {source.name}.")
+            ds.decompress()
+        elif has_pixels:
+            _native_little_endian(ds)
+        if target.is_encapsulated:
+            if not has_pixels:
+                raise TranscodeError(f"{target.name} solo se aplica a instancias con píxeles.")
+            ds.compress(target)
+        else:
+            ds.file_meta.TransferSyntaxUID = target
+    except TranscodeError:
+        raise
+    except (AttributeError, KeyError, ValueError, NotImplementedError, RuntimeError) as e:
+        raise TranscodeError(f"No se pudo convertir de {source.name} a {target.name}: {e}")
+    out = io.BytesIO()
+    dcmwrite(out, ds, enforce_file_format=True)
+    return out.getvalue()
+
+
+def _transcode_path(path: str, target: str) -> bytes:
+    with open(path, "rb") as f:
+        return transcode_file(f, target)
+
+
+def _transcode_shared(parts, target: str) -> bytes:
+    return transcode_file(MappedFile(parts[0]), target)
+
+
+def _transcode_instance(instance: SpooledInstance, target: str) -> bytes:
+    with instance.open() as f:
+        return transcode_file(f, target)
+
+
+# Clave: (SOPInstanceUID, sintaxis de destino)
+transcode_cache = BytesCache(settings.TRANSCODE_CACHE_MAX_BYTES)
+
+
+async def transcode(instance: SpooledInstance, target: str) -> SpooledInstance:
+    """
+    La instancia en la sintaxis 'target', desde la caché de transcodificación o
+    convertida ahora (las grandes en el pool de procesos). Si no se puede convertir se
+    devuelve la original: cada parte multipart indica su propia sintaxis.
+    """
+    if target is None or instance.transfer_syntax == target:
+        return instance
+    key = (instance.sop_instance_uid, target)
+    data = transcode_cache.get(key)
+    if data is not None:
+        metrics.transcode_total.labels(target, "cached").inc()
+    else:
+        def inline():
+            return asyncio.to_thread(_transcode_instance, instance, target)
+        try:
+            if instance.in_memory:
+                data = await cpu_pool.run("transcode", instance.size, _transcode_shared, target,
+                                          shared=[instance.data], inline=inline)
+            else:
+                data = await cpu_pool.run("transcode", instance.size, _transcode_path, str(instance.path), target,
+                                          inline=inline)
+        except TranscodeError as e:
+            metrics.transcode_total.labels(target, "unsupported").inc()
+            logger.warning(f"Instancia {instance.sop_instance_uid} enviada en {instance.transfer_syntax}: {e}")
+            return instance
+        except Exception as e:
+            metrics.transcode_total.labels(target, "failed").inc()
+            logger.error(f"Error al transcodificar la instancia {instance.sop_instance_uid} a {target}: {e}")
+            return instance
+        transcode_cache.put(key, data)
+        metrics.transcode_total.labels(target, "ok").inc()
+        logger.debug(f"Instancia {instance.sop_instance_uid} transcodificada de {instance.transfer_syntax} a {target}: "
+                     f"{instance.size} -> {len(data)} bytes.")
+    transcoded = SpooledInstance(
+        sop_instance_uid=instance.sop_instance_uid, sop_class_uid=instance.sop_class_uid,
+        study_uid=instance.study_uid, series_uid=instance.series_uid,
+        transfer_syntax=target, size=len(data), data=data,
+    )
+    instance.release()
+    return transcoded
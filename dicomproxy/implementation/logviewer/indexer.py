@@ -0,0 +1,340 @@
+import gzip
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from pathlib import Path
+from markupsafe import Markup, escape
+from loguru import logger
+
+from implementation.config.logging_config import LOGS_DIR, ACTIVE_LOG_FILE
+from implementation.config.settings import settings
+from implementation import metrics
+from implementation.logviewer.reader import LOG_FILE_SUFFIXES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+# Línea completa de loguru: fecha | nivel | módulo:función:línea - mensaje
+INDEX_LINE_RE = re.compile(rb"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}) \| (\w+)\s*\| (\S+:\S+:\d+) - (.*)")
+
+BATCH_SIZE = 5000
+FINGERPRINT_BYTES = 4096
+# Conexiones que miden el tiempo de cada sentencia (métrica sqlite_query_seconds)
+_TimedConnection = metrics.sqlite_factory("log_index")
+
+
+def _fingerprint(head: bytes):
+    """Huella del contenido (primeros 4 KB) para reconocer un log ya indexado aunque se renombre o comprima."""
+    if len(head) < FINGERPRINT_BYTES:
+        return None
+    return hashlib.sha1(head[:FINGERPRINT_BYTES]).hexdigest()
+
+
+def fts_query(text: str) -> str:
+    """Convierte el texto del usuario en una consulta FTS5 segura: todas las palabras, cada una entre comillas."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"' for term in terms)
+
+
+class LogIndexer:
+    """
+    Índice de texto completo (SQLite FTS5) del log activo y de los archivados.
+    Un hilo en segundo plano sigue 'DicomProxy_Actual.log' desde el último byte
+    indexado e ingiere una sola vez cada archivo rotado (.log, .zip o .gz); los
+    archivos se reconocen por inodo o por la huella de su contenido, así que un
+    log renombrado por la rotación no se vuelve a indexar.
+    Cada entrada guarda fecha, nivel, módulo:función:línea y la posición en bytes
+    de la línea dentro del archivo de origen.
+    """
+
+    def __init__(self, db_path, logs_dir: Path = LOGS_DIR, interval: float = 2.0):
+        self.db_path = Path(db_path)
+        self.logs_dir = Path(logs_dir)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.indexed_lines = 0
+
+    # --- Base de datos ---
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, factory=_TimedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def initialize(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS log_sources (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, device INTEGER, inode INTEGER,
+                fingerprint TEXT, indexed_offset INTEGER NOT NULL DEFAULT 0, complete INTEGER NOT NULL DEFAULT 0,
+                indexed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_log_sources_name ON log_sources (name);
+            CREATE INDEX IF NOT EXISTS idx_log_sources_inode ON log_sources (device, inode);
+            CREATE INDEX IF NOT EXISTS idx_log_sources_fingerprint ON log_sources (fingerprint);
+            CREATE TABLE IF NOT EXISTS log_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, source_id INTEGER NOT NULL, ts TEXT NOT NULL,
+                level TEXT NOT NULL, location TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_log_entries_ts ON log_entries (ts, id);
+            CREATE INDEX IF NOT EXISTS idx_log_entries_level_ts ON log_entries (level, ts, id);
+            CREATE INDEX IF NOT EXISTS idx_log_entries_source ON log_entries (source_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5(message, tokenize = 'unicode61 remove_diacritics 2');
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    # --- Ingestión ---
+    def _ingest(self, conn, source_id: int, stream, start_offset: int, require_newline: bool) -> int:
+        """Indexa las líneas de 'stream' (posicionado en start_offset). Devuelve el offset tras la última línea completa."""
+        offset = start_offset
+        entries, messages = [], []
+
+        def flush():
+            if not entries:
+                return
+            cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM log_entries")
+            first_id = cursor.fetchone()[0] + 1
+            conn.executemany(
+                "INSERT INTO log_entries (id, source_id, ts, level, location, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(first_id + index, *entry) for index, entry in enumerate(entries)],
+            )
+            conn.executemany("INSERT INTO log_fts (rowid, message) VALUES (?, ?)",
+                             [(first_id + index, message) for index, message in enumerate(messages)])
+            self.indexed_lines += len(entries)
+            entries.clear()
+            messages.clear()
+
+        for line in stream:
+            if require_newline and not line.endswith(b"\n"):
+                break  # línea a medio escribir: se indexará en la siguiente pasada
+            match = INDEX_LINE_RE.match(line)
+            if match is not None:
+                entries.append((source_id, match.group(1).decode("ascii"), match.group(2).decode("ascii").upper(),
+                                match.group(3).decode("utf-8", errors="ignore"), offset, len(line)))
+                messages.append(match.group(4).rstrip(b"\r\n").decode("utf-8", errors="ignore"))
+                if len(entries) >= BATCH_SIZE:
+                    flush()
+            offset += len(line)
+        flush()
+        return offset
+
+    def _source_for_plain(self, conn, path: Path, stat, head: bytes):
+        row = conn.execute("SELECT * FROM log_sources WHERE device = ? AND inode = ?", (stat.st_dev, stat.st_ino)).fetchone()
+        fingerprint = _fingerprint(head)
+        if row is None and fingerprint is not None:
+            row = conn.execute("SELECT * FROM log_sources WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is not None and stat.st_size < row['indexed_offset']:
+            # El archivo se truncó o el inodo se reutilizó: es otro log
+            row = None
+        if row is None:
+            cursor = conn.execute("INSERT INTO log_sources (name, device, inode, fingerprint) VALUES (?, ?, ?, ?)",
+                                  (path.name, stat.st_dev, stat.st_ino, fingerprint))
+            return cursor.lastrowid, 0, False
+        conn.execute("UPDATE log_sources SET name = ?, device = ?, inode = ?, fingerprint = COALESCE(fingerprint, ?) WHERE id = ?",
+                     (path.name, stat.st_dev, stat.st_ino, fingerprint, row['id']))
+        return row['id'], row['indexed_offset'], bool(row['complete'])
+
+    def _index_plain(self, conn, path: Path):
+        stat = path.stat()
+        with open(path, "rb") as f:
+            head = f.read(FINGERPRINT_BYTES)
+            source_id, offset, complete = self._source_for_plain(conn, path, stat, head)
+            active = path.name == ACTIVE_LOG_FILE.name
+            if not complete and offset < stat.st_size:
+                f.seek(offset)
+                offset = self._ingest(conn, source_id, f, offset, require_newline=True)
+        # Un .log que ya no es el activo (renombrado por la rotación) no vuelve a crecer
+        conn.execute("UPDATE log_sources SET indexed_offset = ?, complete = ?, indexed_at = ? WHERE id = ?",
+                     (offset, 0 if active else 1, time.time(), source_id))
+        conn.commit()
+
+    @staticmethod
+    def _open_archive(path: Path):
+        if path.name.endswith(".gz"):
+            return gzip.open(path, "rb")
+        archive = zipfile.ZipFile(path)
+        return archive.open(archive.namelist()[0])
+
+    def _index_archive(self, conn, path: Path):
+        if conn.execute("SELECT 1 FROM log_sources WHERE name = ? AND complete = 1", (path.name,)).fetchone():
+            return
+        with self._open_archive(path) as stream:
+            head = stream.read(FINGERPRINT_BYTES)
+            fingerprint = _fingerprint(head)
+            known = conn.execute("SELECT id, name FROM log_sources WHERE fingerprint = ?", (fingerprint,)).fetchone() if fingerprint else None
+            if known is not None:
+                # El mismo log ya se indexó antes de comprimirse: los offsets del contenido
+                # descomprimido son los mismos, así que sus entradas pasan al archivo comprimido
+                if not (self.logs_dir / known['name']).exists():
+                    conn.execute("UPDATE log_sources SET name = ?, device = NULL, inode = NULL, complete = 1 WHERE id = ?",
+                                 (path.name, known['id']))
+                else:
+                    conn.execute("INSERT INTO log_sources (name, complete, indexed_at) VALUES (?, 1, ?)", (path.name, time.time()))
+                conn.commit()
+                return
+            cursor = conn.execute("INSERT INTO log_sources (name, fingerprint) VALUES (?, ?)", (path.name, fingerprint))
+            source_id = cursor.lastrowid
+            offset = self._ingest(conn, source_id, _prepend(head, stream), 0, require_newline=False)
+        conn.execute("UPDATE log_sources SET indexed_offset = ?, complete = 1, indexed_at = ? WHERE id = ?",
+                     (offset, time.time(), source_id))
+        conn.commit()
+        logger.info(f"Log archivado '{path.name}' indexado.")
+
+    def _purge_missing(self, conn, present: set):
+        """Olvida las entradas de archivos que ya no existen (p. ej. borrados por la retención)."""
+        for row in conn.execute("SELECT id, name FROM log_sources").fetchall():
+            if row['name'] not in present:
+                conn.execute("DELETE FROM log_fts WHERE rowid IN (SELECT id FROM log_entries WHERE source_id = ?)", (row['id'],))
+                conn.execute("DELETE FROM log_entries WHERE source_id = ?", (row['id'],))
+                conn.execute("DELETE FROM log_sources WHERE id = ?", (row['id'],))
+        conn.commit()
+
+    def scan(self):
+        """Una pasada: el log activo, los archivos nuevos y los desaparecidos."""
+        with self._lock:
+            if not self.logs_dir.exists():
+                return
+            conn = self._connect()
+            try:
+                files = sorted((p for p in self.logs_dir.iterdir() if p.is_file() and p.name.endswith(LOG_FILE_SUFFIXES)),
+                               key=lambda p: p.stat().st_mtime)
+                # Los .log primero, para que un archivo renombrado por la rotación se
+                # reconozca por su inodo antes de ver su versión comprimida
+                for path in sorted(files, key=lambda p: not p.name.endswith(".log")):
+                    try:
+                        if path.name.endswith(".log"):
+                            self._index_plain(conn, path)
+                        else:
+                            self._index_archive(conn, path)
+                    except Exception as e:
+                        conn.rollback()
+                        logger.warning(f"No se pudo indexar el log '{path.name}': {e}")
+                self._purge_missing(conn, {path.name for path in files})
+            finally:
+                conn.close()
+
+    # --- Hilo en segundo plano ---
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.initialize()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="log-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error(f"Error en el indexador de logs: {e}")
+            self._stop.wait(self.interval)
+
+    # --- Consultas ---
+    def search(self, text: str = None, level: str = None, since: str = None, until: str = None,
+               before: int = None, after: int = None, limit: int = DEFAULT_PAGE_SIZE, trace: str = None) -> dict:
+        """
+        Una página de entradas de todos los logs indexados, de la más nueva a la más
+        antigua (por fecha). 'since'/'until' son prefijos de fecha ('2024-05-01',
+        '2024-05-01 10:00'); 'before'/'after' son el id de una entrada y paginan hacia
+        entradas más antiguas o más nuevas, igual que los cursores del visor por archivo.
+        'trace' limita la búsqueda a las líneas de esa traza ('[trace=...]').
+        """
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+        conditions, params = [], []
+        if level and level.upper() != "ALL":
+            conditions.append("e.level = ?")
+            params.append(level.upper())
+        if since:
+            conditions.append("e.ts >= ?")
+            params.append(since)
+        if until:
+            # Un prefijo incluye todo lo que empieza por él ('2024-05-01' incluye todo ese día)
+            conditions.append("e.ts < ?")
+            params.append(until + "\uffff")
+        cursor = after if after is not None else before
+        if cursor is not None:
+            conditions.append(f"(e.ts, e.id) {'>' if after is not None else '<'} (SELECT ts, id FROM log_entries WHERE id = ?)")
+            params.append(cursor)
+        query = fts_query(text) if text else ""
+        if trace:
+            # '[trace=<id>]' se indexa como los términos consecutivos 'trace' e '<id>'
+            query = f'{query} "trace {trace}"'.strip()
+        if query:
+            source = "log_fts JOIN log_entries e ON e.id = log_fts.rowid"
+            message = "highlight(log_fts, 0, char(1), char(2))"
+            conditions.insert(0, "log_fts MATCH ?")
+            params.insert(0, query)
+        else:
+            # CROSS JOIN fija el orden: recorrer log_entries por el índice de fecha, sin ordenar en memoria
+            source = "log_entries e CROSS JOIN log_fts ON log_fts.rowid = e.id"
+            message = "log_fts.message"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "ASC" if after is not None else "DESC"
+        sql = (f"SELECT e.id, e.ts, e.level, e.location, e.offset, e.length, {message} AS message, s.name AS file "
+               f"FROM {source} JOIN log_sources s ON s.id = e.source_id {where} "
+               f"ORDER BY e.ts {order}, e.id {order} LIMIT ?")
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+        finally:
+            conn.close()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if after is not None:
+            rows.reverse()
+        entries = [{"id": row['id'], "timestamp": row['ts'], "level": row['level'], "location": row['location'],
+                    "message": _marked(row['message']), "file": row['file'], "offset": row['offset'],
+                    "end": row['offset'] + row['length']} for row in rows]
+        if after is not None:
+            has_newer, has_older = more, True
+        else:
+            has_older, has_newer = more, before is not None
+        older = entries[-1]["id"] if entries else cursor
+        newer = entries[0]["id"] if entries else cursor
+        return {"entries": entries, "older_cursor": older if has_older and older is not None else None,
+                "newer_cursor": newer if has_newer and newer is not None else None}
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            sources = conn.execute("SELECT COUNT(*), COALESCE(SUM(complete), 0) FROM log_sources").fetchone()
+            entries = conn.execute("SELECT COUNT(*) FROM log_entries").fetchone()[0]
+        finally:
+            conn.close()
+        return {"sources": sources[0], "archived_sources": sources[1], "entries": entries,
+                "indexed_since_start": self.indexed_lines, "running": self._thread is not None and self._thread.is_alive()}
+
+
+def _marked(message: str) -> Markup:
+    """Escapa el mensaje y convierte las marcas de highlight() de FTS5 en <mark>."""
+    return Markup(str(escape(message)).replace("\x01", "<mark>").replace("\x02", "</mark>"))
+
+
+def _prepend(head: bytes, stream):
+    """Itera por líneas el contenido de 'stream' anteponiendo los bytes ya leídos."""
+    pending = head
+    for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+log_indexer = LogIndexer(settings.LOG_INDEX_DB, interval=settings.LOG_INDEX_INTERVAL)
@@ -0,0 +1,183 @@
+import gzip
+import re
+import shutil
+import zipfile
+from pathlib import Path
+from markupsafe import Markup, escape
+from loguru import logger
+
+from implementation.config.logging_config import LOGS_DIR
+
+BLOCK_SIZE = 64 * 1024
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+LOG_FILE_SUFFIXES = ('.log', '.zip', '.gz')
+
+# Formato de las líneas que escribe loguru (ver logging_config.setup_logging)
+LOG_LINE_RE = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}) \| (\w+)\s+\| (.*)")
+
+# Copias descomprimidas de los archivos .zip/.gz para poder paginarlos como un .log
+ARCHIVE_CACHE_DIR = LOGS_DIR / ".viewer_cache"
+
+
+class LogFilter:
+    """Nivel, texto a buscar y traza, con los patrones compilados una sola vez por petición."""
+
+    def __init__(self, level: str = None, search: str = None, trace: str = None):
+        self.level = level.upper() if level and level.upper() != "ALL" else None
+        self.search = search or None
+        self._trace_marker = f"[trace={trace}]" if trace else None
+        self._pattern = re.compile(re.escape(search), re.IGNORECASE) if search else None
+
+    def parse(self, raw_line: bytes, offset: int):
+        """Entrada de log si la línea cumple el filtro; None en caso contrario."""
+        match = LOG_LINE_RE.match(raw_line.decode("utf-8", errors="ignore"))
+        if match is None:
+            return None
+        level = match.group(2).upper()
+        if self.level and level != self.level:
+            return None
+        message = match.group(3).rstrip("\r")
+        if self._trace_marker is not None and self._trace_marker not in message:
+            return None
+        if self._pattern is not None:
+            if self._pattern.search(message) is None:
+                return None
+            message = self._highlight(message)
+        else:
+            message = escape(message)
+        return {"timestamp": match.group(1), "level": level, "message": message, "offset": offset}
+
+    def _highlight(self, message: str) -> Markup:
+        # Se escapa el mensaje y solo se marca el texto buscado
+        parts, last = [], 0
+        for found in self._pattern.finditer(message):
+            parts.append(escape(message[last:found.start()]))
+            parts.append(Markup("<mark>") + escape(found.group(0)) + Markup("</mark>"))
+            last = found.end()
+        parts.append(escape(message[last:]))
+        return Markup("").join(parts)
+
+
+def list_log_files() -> list:
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    return sorted((f.name for f in LOGS_DIR.iterdir() if f.is_file() and f.name.endswith(LOG_FILE_SUFFIXES)), reverse=True)
+
+
+def readable_path(name: str) -> Path:
+    """
+    Ruta de un archivo legible por bloques. Los .zip y .gz se descomprimen una sola
+    vez en la caché del visor (se invalida si cambia el archivo original).
+    """
+    source = LOGS_DIR / name
+    if not name.endswith(('.zip', '.gz')):
+        return source
+    stat = source.stat()
+    target = ARCHIVE_CACHE_DIR / f"{name}.{stat.st_mtime_ns}.{stat.st_size}.log"
+    if target.exists():
+        return target
+    ARCHIVE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for stale in ARCHIVE_CACHE_DIR.glob(f"{name}.*.log"):
+        stale.unlink(missing_ok=True)
+    tmp = target.with_suffix(".tmp")
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(source) as zf, zf.open(zf.namelist()[0]) as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, BLOCK_SIZE)
+    else:
+        with gzip.open(source, "rb") as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, BLOCK_SIZE)
+    tmp.replace(target)
+    logger.debug(f"Archivo de log '{name}' descomprimido para el visor.")
+    return target
+
+
+def _complete_end(f, size: int) -> int:
+    """Posición tras el último salto de línea: una línea a medio escribir no se muestra todavía."""
+    position = size
+    while position > 0:
+        start = max(0, position - BLOCK_SIZE)
+        f.seek(start)
+        block = f.read(position - start)
+        newline = block.rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        position = start
+    return 0
+
+
+def iter_lines_reverse(f, end: int):
+    """Recorre las líneas completas anteriores a 'end' de la más nueva a la más antigua, por bloques."""
+    position = end
+    remainder = b""
+    while position > 0:
+        start = max(0, position - BLOCK_SIZE)
+        f.seek(start)
+        block = f.read(position - start) + remainder
+        lines = block.split(b"\n")
+        # La primera línea del bloque puede estar incompleta: se completa con el bloque anterior
+        remainder = lines[0]
+        line_end = start + len(block)
+        for line in reversed(lines[1:]):
+            line_start = line_end - len(line)
+            if line:
+                yield line_start, line
+            line_end = line_start - 1
+        position = start
+    if remainder:
+        yield 0, remainder
+
+
+def iter_lines_forward(f, start: int, end: int):
+    """Recorre las líneas completas entre 'start' y 'end' en orden."""
+    f.seek(start)
+    offset = start
+    while offset < end:
+        line = f.readline(end - offset)
+        if not line.endswith(b"\n"):
+            break
+        if line.strip():
+            yield offset, line[:-1]
+        offset += len(line)
+
+
+def read_page(path: Path, log_filter: LogFilter, limit: int = DEFAULT_PAGE_SIZE, before: int = None, after: int = None) -> dict:
+    """
+    Una página de entradas (de la más nueva a la más antigua) filtradas mientras se
+    leen. Sin cursor se lee desde el final del archivo; 'before' pagina hacia entradas
+    más antiguas y 'after' hacia más nuevas. Solo se leen los bloques necesarios
+    para llenar la página, así que el coste no depende del tamaño del archivo.
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    entries = []
+    with open(path, "rb") as f:
+        end = _complete_end(f, path.stat().st_size)
+        if after is not None:
+            after = max(0, min(after, end))
+            exhausted = True
+            for offset, line in iter_lines_forward(f, after, end):
+                if (entry := log_filter.parse(line, offset)) is not None:
+                    entry["end"] = offset + len(line) + 1
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        exhausted = entry["end"] >= end
+                        break
+            entries.reverse()
+            has_newer, has_older = not exhausted, after > 0
+            newer = entries[0]["end"] if entries else after
+            older = entries[-1]["offset"] if entries else after
+        else:
+            start = end if before is None else max(0, min(before, end))
+            exhausted = True
+            for offset, line in iter_lines_reverse(f, start):
+                if (entry := log_filter.parse(line, offset)) is not None:
+                    entry["end"] = offset + len(line) + 1
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        exhausted = offset == 0
+                        break
+            has_older, has_newer = not exhausted, before is not None and start < end
+            older = entries[-1]["offset"] if entries else start
+            newer = entries[0]["end"] if entries else start
+    return {"entries": entries, "older_cursor": older if has_older else None,
+            "newer_cursor": newer if has_newer else None, "end": end}
@@ -0,0 +1,180 @@
+import asyncio
+from collections import deque
+from loguru import logger
+
+from implementation.config.logging_config import ACTIVE_LOG_FILE
+from implementation.config.settings import settings
+from implementation.logviewer.reader import LogFilter
+
+# Máximo de bytes leídos del log en cada pasada (el resto se lee en la siguiente)
+MAX_READ_BYTES = 4 * 1024 * 1024
+
+# Marca, entre las líneas leídas, del punto en que el log activo se rotó
+ROTATED = object()
+
+
+class TailSubscription:
+    """
+    Un cliente conectado al log en vivo: su filtro y un buffer acotado de entradas
+    pendientes. Si el cliente no consume a tiempo se descartan las entradas más
+    antiguas y se le avisa de cuántas perdió, sin frenar al resto.
+    """
+
+    def __init__(self, log_filter: LogFilter, max_buffer: int, batch_size: int):
+        self.filter = log_filter
+        self.batch_size = batch_size
+        self._buffer = deque()
+        self._max_buffer = max_buffer
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.delivered = 0
+
+    def push(self, entry: dict):
+        if len(self._buffer) >= self._max_buffer:
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(entry)
+        self._ready.set()
+
+    def notify(self, event: dict):
+        """Aviso fuera de banda (p. ej. rotación del log): no se descarta nunca."""
+        self._buffer.append(event)
+        self._ready.set()
+
+    async def next_batch(self, timeout: float):
+        """
+        Espera entradas nuevas (como mucho 'timeout' segundos) y devuelve
+        (lote, descartadas desde el lote anterior). Un lote vacío indica que no
+        hubo novedades, útil para enviar un latido.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return [], 0
+        batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        if not self._buffer:
+            self._ready.clear()
+        dropped, self.dropped = self.dropped, 0
+        self.delivered += len(batch)
+        return batch, dropped
+
+
+class LogTailer:
+    """
+    Sigue el log activo para todos los clientes conectados. Una única tarea lee
+    las líneas nuevas (solo las completas) y las reparte filtradas a cada
+    suscripción. Detecta la rotación (manual con rotate_log_file o por tamaño de
+    loguru) porque cambia el inodo del archivo: se termina de leer el antiguo y
+    se empieza el nuevo desde el principio. La tarea solo existe mientras haya
+    clientes.
+    """
+
+    def __init__(self, path=ACTIVE_LOG_FILE, interval: float = 0.5):
+        self.path = path
+        self.interval = interval
+        self._subscribers: set = set()
+        self._task = None
+        self._file = None
+        self._identity = None
+        self._position = 0
+        self._pending = b""
+        self.rotations = 0
+
+    def subscribe(self, level: str = None, search: str = None, trace: str = None) -> TailSubscription:
+        subscription = TailSubscription(LogFilter(level, search, trace), settings.LOG_TAIL_BUFFER, settings.LOG_TAIL_BATCH)
+        self._subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription: TailSubscription):
+        self._subscribers.discard(subscription)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        try:
+            while self._subscribers:
+                try:
+                    lines = await asyncio.to_thread(self._read_new)
+                except Exception as e:
+                    logger.warning(f"Error leyendo el log en vivo: {e}")
+                    lines = []
+                if lines:
+                    self._publish(lines)
+                await asyncio.sleep(self.interval)
+        finally:
+            self._close()
+
+    def _publish(self, lines):
+        for subscription in list(self._subscribers):
+            for item in lines:
+                if item is ROTATED:
+                    subscription.notify({"type": "rotated"})
+                    continue
+                offset, line = item
+                entry = subscription.filter.parse(line, offset)
+                if entry is not None:
+                    entry["message"] = str(entry["message"])
+                    subscription.push(entry)
+
+    # --- Lectura del archivo (en un hilo) ---
+    def _read_new(self):
+        """Líneas completas escritas desde la pasada anterior, como (offset, bytes), con ROTATED donde cambió el archivo."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            stat = None
+        lines = []
+        if self._file is not None:
+            lines += self._drain()
+            if stat is None or (stat.st_dev, stat.st_ino) != self._identity:
+                # Rotado: lo que quedaba del archivo antiguo ya se ha leído
+                self._close()
+                lines.append(ROTATED)
+                self.rotations += 1
+            elif stat.st_size < self._position:
+                # Truncado: se vuelve a empezar
+                self._position, self._pending = 0, b""
+        if self._file is None and stat is not None:
+            first_open = self._identity is None
+            self._file = open(self.path, "rb")
+            self._identity = (stat.st_dev, stat.st_ino)
+            # Al conectar solo interesan las líneas nuevas; tras una rotación, todo el archivo nuevo
+            self._position = stat.st_size if first_open else 0
+            self._pending = b""
+            lines += self._drain()
+        return lines
+
+    def _drain(self):
+        self._file.seek(self._position)
+        data = self._file.read(MAX_READ_BYTES)
+        if not data:
+            return []
+        start = self._position - len(self._pending)
+        self._position += len(data)
+        data = self._pending + data
+        cut = data.rfind(b"\n") + 1
+        self._pending = data[cut:]
+        lines, offset = [], start
+        for line in data[:cut].split(b"\n")[:-1]:
+            if line.strip():
+                lines.append((offset, line))
+            offset += len(line) + 1
+        return lines
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self._subscribers:
+            # Sin clientes se olvida la posición: el próximo empezará por el final
+            self._identity = None
+
+    def stats(self) -> dict:
+        return {"clients": len(self._subscribers), "running": self._task is not None and not self._task.done(),
+                "rotations": self.rotations}
+
+
+log_tailer = LogTailer(interval=settings.LOG_TAIL_INTERVAL)
@@ -1,9 +1,9 @@
 from implementation import crud
 from implementation import database
-import sys, os, re, socket, zipfile, asyncio
+import sys, socket, asyncio, json
 from pathlib import Path
-from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, Query
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from loguru import logger
@@ -11,27 +11,72 @@ from urllib.parse import urlencode
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
-# from implementation import crud, database
-from implementation.config.logging_config import setup_logging, rotate_log_file
+from implementation.config.logging_config import setup_logging
 from implementation.config.settings import settings
+from implementation import metrics, tracing
 from implementation.web import security, passwords
-setup_logging()
+from implementation.dicom_services import dimse_scu, gateway
+from implementation.dicom_services.gateway_client import dimse_gateway
+from implementation.dicom_services.rendering import render_cache
+from implementation.dicom_services.transcoding import transcode_cache
+from implementation.dicom_services.cpu_pool import cpu_pool
+from implementation.routers import dicomweb
+from implementation.logviewer import reader as log_reader
+from implementation.logviewer.indexer import log_indexer
+from implementation.logviewer.tail import log_tailer
+# Con gateway DIMSE el archivo de log lo escribe el gateway (un único proceso lo rota)
+setup_logging(forward_to=settings.DIMSE_GATEWAY_SOCKET or None)
 BASE_PATH = Path(__file__).resolve().parent
-LOGS_DIR = PROJECT_ROOT / "logs"
 app = FastAPI(title="DICOM Proxy Service", version="1.0.8-stable")
 app.mount("/static", StaticFiles(directory=BASE_PATH / "web/static"), name="static")
 templates = Jinja2Templates(directory=BASE_PATH / "web/templates")
+app.include_router(dicomweb.router)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 async def get_current_user(request: Request):
     token = request.cookies.get("access_token")
     if not token or (payload := security.decode_access_token(token)) is None:
         raise HTTPException(status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers={"Location": "/admin"})
     return payload.get("sub")
 @app.on_event("startup")
-async def startup_event(): database.initialize_database()
+async def startup_event():
+    database.initialize_database()
+    crud.reload_config()
+    if dimse_gateway.enabled:
+        # Los cambios de configuración de otros workers llegan por la versión guardada en la BD
+        crud.config_watcher.start(settings.CONFIG_RELOAD_INTERVAL)
+        logger.info(f"Operaciones DIMSE delegadas en el gateway '{settings.DIMSE_GATEWAY_SOCKET}'.")
+    else: gateway.start_services()
+    tracing.span_exporter.start()
+@app.on_event("shutdown")
+async def shutdown_event():
+    if dimse_gateway.enabled: crud.config_watcher.stop()
+    else: gateway.stop_services()
+    cpu_pool.shutdown()
+    tracing.span_exporter.stop()
+    database.get_pool().close_all()
 
 # --- Endpoints ---
 @app.get("/", tags=["Health Check"])
 async def root(): return JSONResponse(content={"status": "ok"})
+@app.get("/metrics", tags=["Health Check"])
+async def prometheus_metrics(): return Response(content=await gateway.render_metrics(), media_type=metrics.CONTENT_TYPE)
+@app.get("/admin/dimse/pool", tags=["Admin UI"])
+async def admin_dimse_pool_stats(user: str = Depends(get_current_user)): return JSONResponse(content=await gateway.call("pool_stats"))
+@app.get("/admin/dimse/scp", tags=["Admin UI"])
+async def admin_dimse_scp_stats(user: str = Depends(get_current_user)): return JSONResponse(content=await gateway.call("scp_stats"))
+@app.get("/admin/dimse/scheduler", tags=["Admin UI"])
+async def admin_dimse_scheduler_stats(user: str = Depends(get_current_user)): return JSONResponse(content=await gateway.call("scheduler_stats"))
+@app.get("/admin/dimse/query", tags=["Admin UI"])
+async def admin_dimse_query_stats(user: str = Depends(get_current_user)): return JSONResponse(content=await gateway.call("query_stats"))
+@app.get("/admin/dimse/gateway", tags=["Admin UI"])
+async def admin_dimse_gateway_stats(user: str = Depends(get_current_user)): return JSONResponse(content={"client": dimse_gateway.stats(), "server": await gateway.call("gateway_stats") if dimse_gateway.enabled else None})
+@app.get("/admin/cpu", tags=["Admin UI"])
+async def admin_cpu_pool_stats(user: str = Depends(get_current_user)): return JSONResponse(content=cpu_pool.stats())
+@app.get("/admin/traces", tags=["Admin UI"])
+async def admin_trace_stats(user: str = Depends(get_current_user)): return JSONResponse(content=tracing.span_exporter.stats())
+@app.get("/admin/cache", tags=["Admin UI"])
+async def admin_cache_stats(user: str = Depends(get_current_user)): return JSONResponse(content={"instances": await gateway.call("instance_stats"), "rendered": render_cache.stats(), "transcoded": transcode_cache.stats()})
 @app.get("/admin", response_class=HTMLResponse, tags=["Admin UI"])
 async def admin_login_page(request: Request): return templates.TemplateResponse("login.html", {"request": request, "error": None})
 @app.post("/admin/login", tags=["Admin UI"])
@@ -49,471 +94,193 @@ async def handle_admin_logout():
     return response
 @app.get("/admin/dashboard", response_class=HTMLResponse, tags=["Admin UI"])
 async def admin_dashboard(request: Request, user: str = Depends(get_current_user)): return templates.TemplateResponse("dashboard.html", {"request": request, "user": user})
+def get_local_ip():
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80)); return s.getsockname()[0]
+    except Exception: return None
 @app.get("/admin/dashboard/config", response_class=HTMLResponse, tags=["Admin UI"])
 async def admin_view_config(request: Request, user: str = Depends(get_current_user)):
     pacs_list = crud.get_all_pacs()
     proxy_config = crud.get_proxy_config()
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.connect(("8.8.8.8", 80)); local_ip = s.getsockname()[0]
-    except Exception: local_ip = "No se pudo determinar"
-    return templates.TemplateResponse("config.html", {"request": request, "user": user, "pacs_list": pacs_list, "proxy_config": proxy_config, "local_ip": local_ip})
+    local_ip = get_local_ip() or "No se pudo determinar"
+    pacs_health = await gateway.call("health")
+    return templates.TemplateResponse("config.html", {"request": request, "user": user, "pacs_list": pacs_list, "proxy_config": proxy_config, "local_ip": local_ip, "pacs_health": pacs_health, "default_max_associations": settings.POOL_MAX_ASSOCIATIONS_PER_PACS})
 @app.get("/admin/pacs/new", response_class=HTMLResponse, tags=["Admin UI"])
 async def admin_new_pacs_page(request: Request, user: str = Depends(get_current_user)):
-    return templates.TemplateResponse("pacs_add.html", {"request": request, "user": user})
+    return templates.TemplateResponse("pacs_add.html", {"request": request, "user": user, "default_max_associations": settings.POOL_MAX_ASSOCIATIONS_PER_PACS})
 @app.post("/admin/pacs/add", tags=["Admin UI"])
-async def admin_add_pacs(user: str = Depends(get_current_user), description: str = Form(...), aetitle: str = Form(...), ip_address: str = Form(...), port: int = Form(...)):
-    crud.add_pacs_config(description, aetitle, ip_address, port)
-    logger.info(f"Nuevo PACS añadido: {description} por '{user}'")
+async def admin_add_pacs(user: str = Depends(get_current_user), description: str = Form(...), aetitle: str = Form(...), ip_address: str = Form(...), port: int = Form(...), retrieval_strategy: str = Form("C-MOVE"), mirror_group: str = Form(""), max_associations: str = Form("")):
+    if retrieval_strategy not in dimse_scu.RETRIEVAL_STRATEGIES: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Modo de recuperación no válido")
+    if max_associations and (not max_associations.isdigit() or int(max_associations) < 1): raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Límite de asociaciones no válido")
+    crud.add_pacs_config(description, aetitle, ip_address, port, retrieval_strategy, mirror_group.strip() or None, int(max_associations) if max_associations else None)
+    await gateway.call("config_changed", "PACS añadido")
+    logger.info(f"Nuevo PACS añadido: {description} ({retrieval_strategy}) por '{user}'")
     return RedirectResponse(url="/admin/dashboard/config", status_code=status.HTTP_303_SEE_OTHER)
+@app.post("/admin/pacs/strategy", response_class=JSONResponse, tags=["Admin UI"])
+async def admin_set_pacs_strategy(request: Request, user: str = Depends(get_current_user)):
+    data = await request.json()
+    pacs_id, strategy = data.get("id"), data.get("strategy")
+    if strategy not in dimse_scu.RETRIEVAL_STRATEGIES: return {"success": False, "msg": "Modo de recuperación no válido"}
+    crud.update_pacs_retrieval_strategy(pacs_id, strategy)
+    await gateway.call("config_changed", "modo de recuperación cambiado")
+    logger.info(f"Modo de recuperación del PACS ID {pacs_id} cambiado a {strategy} por '{user}'")
+    return {"success": True, "msg": f"Modo de recuperación cambiado a {strategy}"}
+@app.post("/admin/pacs/mirror", response_class=JSONResponse, tags=["Admin UI"])
+async def admin_set_pacs_mirror(request: Request, user: str = Depends(get_current_user)):
+    data = await request.json()
+    pacs_id, mirror_group = data.get("id"), (data.get("mirror_group") or "").strip()
+    if crud.get_pacs(pacs_id) is None: return {"success": False, "msg": "PACS no encontrado"}
+    crud.update_pacs_mirror_group(pacs_id, mirror_group)
+    await gateway.call("config_changed", "grupo de espejos cambiado")
+    logger.info(f"Grupo de espejos del PACS ID {pacs_id} cambiado a '{mirror_group}' por '{user}'")
+    return {"success": True, "msg": f"Grupo de espejos: {mirror_group}" if mirror_group else "PACS sin grupo de espejos"}
+@app.post("/admin/pacs/limit", response_class=JSONResponse, tags=["Admin UI"])
+async def admin_set_pacs_limit(request: Request, user: str = Depends(get_current_user)):
+    data = await request.json()
+    pacs_id, limit = data.get("id"), str(data.get("max_associations") or "").strip()
+    if crud.get_pacs(pacs_id) is None: return {"success": False, "msg": "PACS no encontrado"}
+    if limit and (not limit.isdigit() or int(limit) < 1): return {"success": False, "msg": "Límite de asociaciones no válido"}
+    crud.update_pacs_max_associations(pacs_id, int(limit) if limit else None)
+    await gateway.call("config_changed")
+    logger.info(f"Límite de asociaciones del PACS ID {pacs_id} cambiado a {limit or 'por defecto'} por '{user}'")
+    return {"success": True, "msg": f"Máximo de asociaciones: {limit or f'{settings.POOL_MAX_ASSOCIATIONS_PER_PACS} (por defecto)'}"}
+@app.get("/admin/pacs/health", tags=["Admin UI"])
+async def admin_pacs_health(user: str = Depends(get_current_user)): return JSONResponse(content=await gateway.call("health"))
+@app.post("/admin/pacs/echo", response_class=JSONResponse, tags=["Admin UI"])
+async def admin_echo_pacs(request: Request, user: str = Depends(get_current_user)):
+    pacs = crud.get_pacs((await request.json()).get("id"))
+    if pacs is None: return {"success": False, "message": "PACS no encontrado"}
+    health = await gateway.call("echo", pacs["id"])
+    success = health["consecutive_failures"] == 0
+    logger.info(f"C-ECHO manual a '{pacs['description']}' por '{user}': {'correcto' if success else health['last_error']}")
+    return {"success": success, "message": health["last_error"] or "C-ECHO correcto", "rtt_ms": health["last_rtt_ms"], "health": health}
+@app.post("/admin/pacs/toggle", response_class=JSONResponse, tags=["Admin UI"])
+async def admin_toggle_pacs(request: Request, user: str = Depends(get_current_user)):
+    pacs_id = (await request.json()).get("id")
+    new_status = crud.toggle_pacs_active(pacs_id)
+    if new_status is None: return {"success": False, "msg": "PACS no encontrado"}
+    await gateway.call("config_changed", "PACS activado/desactivado")
+    logger.info(f"Estado del PACS ID {pacs_id} cambiado a {'Activo' if new_status else 'Inactivo'} por '{user}'")
+    return {"success": True, "msg": f"PACS {'activado' if new_status else 'desactivado'} correctamente"}
+@app.post("/admin/pacs/delete", response_class=JSONResponse, tags=["Admin UI"])
+async def admin_delete_pacs(request: Request, user: str = Depends(get_current_user)):
+    pacs_id = (await request.json()).get("id")
+    if not crud.delete_pacs_config(pacs_id): return {"success": False, "msg": "PACS no encontrado"}
+    await gateway.call("config_changed", "PACS eliminado")
+    logger.info(f"PACS eliminado (ID {pacs_id}) por '{user}'")
+    return {"success": True, "msg": "PACS eliminado correctamente"}
+
+# --- Configuración local del proxy (AE Title / IP / puerto) ---
+@app.get("/config/local", response_class=JSONResponse, tags=["Admin UI"])
+async def get_local_config(user: str = Depends(get_current_user)):
+    proxy_config = crud.get_proxy_config()
+    return {"aetitle": proxy_config.get("proxy_aet", settings.PROXY_AET), "ip": get_local_ip() or "127.0.0.1", "port": int(proxy_config.get("proxy_port", 11112))}
+@app.post("/config/local", response_class=JSONResponse, tags=["Admin UI"])
+async def update_local_config(user: str = Depends(get_current_user), aetitle: str = Form(...), port: int = Form(...)):
+    crud.update_proxy_config(aetitle, port)
+    logger.info(f"Configuración local actualizada por '{user}' — AE Title: {aetitle}, Puerto: {port} (se aplica al reiniciar el Storage SCP)")
+    return {"success": True, "config": await get_local_config(user)}
+
+@app.post("/admin/logs/add", response_class=JSONResponse, tags=["Admin UI"])
+async def add_admin_log(request: Request, user: str = Depends(get_current_user)):
+    """Registra en el log activo una acción hecha desde el panel (config/logs)."""
+    message = ((await request.json()).get("message") or "").strip()
+    if not message: return {"success": False, "msg": "Mensaje vacío"}
+    logger.info(f"[WEB ACTION] {message} — Usuario: {user}")
+    return {"success": True, "msg": "Log registrado correctamente"}
 
 # --- ENDPOINT MODIFICADO ---
 @app.post("/admin/logs/rotate", tags=["Admin UI"])
 async def admin_rotate_logs(user: str = Depends(get_current_user)):
-    success = rotate_log_file()
+    success = await gateway.call("rotate_logs")
     message = "Nuevo archivo de log creado con éxito." if success else "Error al crear el nuevo log."
     query_params = urlencode({"toast": message, "toast_type": "success" if success else "error"})
     return RedirectResponse(url=f"/admin/dashboard/logs?{query_params}", status_code=status.HTTP_303_SEE_OTHER)
 
-@app.get("/admin/dashboard/logs", response_class=HTMLResponse, tags=["Admin UI"])
-async def admin_view_logs(request: Request, user: str = Depends(get_current_user), file: str = Query(None), level: str = Query("ALL"), search: str = Query(None)):
-    try:
-        if not os.path.exists(LOGS_DIR): os.makedirs(LOGS_DIR)
-        log_files = sorted([f for f in os.listdir(LOGS_DIR) if f.endswith(('.log', '.zip', '.gz'))], reverse=True)
-        actual_log_name = "DicomProxy_Actual.log"
-        if file and file in log_files: selected_file = file
-        elif actual_log_name in log_files: selected_file = actual_log_name
-        elif log_files: selected_file = log_files[0]
-        else: selected_file = None
-        lines, final_logs = [], []
-        if selected_file:
-            filepath = LOGS_DIR / selected_file
-            try:
-                if selected_file.endswith('.zip'):
-                    with zipfile.ZipFile(filepath, 'r') as zf:
-                        log_filename_in_zip = zf.namelist()[0]
-                        with zf.open(log_filename_in_zip, 'r') as f: lines = [line.decode('utf-8', errors='ignore') for line in f.readlines()]
-                else:
-                    with open(filepath, "r", encoding="utf-8", errors='ignore') as f: lines = f.readlines()
-            except Exception as e: logger.error(f"Could not read log file {filepath}: {e}")
-        def parse_log(l):
-            m = re.match(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}) \| (\w+)\s+\| (.*)", l)
-            return {"timestamp": m.group(1), "level": m.group(2).upper(), "message": m.group(3)} if m else None
-        all_parsed_logs = [log for line in lines if (log := parse_log(line))]
-        if search:
-            filtered_logs = []
-            for log in all_parsed_logs:
-                if search.lower() in log['message'].lower():
-                    log['message'] = re.sub(f'({re.escape(search)})', r'<mark>\1</mark>', log['message'], flags=re.IGNORECASE)
-                    filtered_logs.append(log)
-            final_logs = filtered_logs
-        else: final_logs = all_parsed_logs
-        if level and level != "ALL": final_logs = [log for log in final_logs if log['level'] == level.upper()]
-        final_logs.reverse()
-        return templates.TemplateResponse("logs.html", {"request": request, "user": user, "log_files": log_files, "selected_file": selected_file, "selected_level": level, "search_query": search or "", "logs": final_logs[-1000:]})
-    except Exception as e:
-        logger.exception(f"CRITICAL ERROR in admin_view_logs: {e}")
-        return templates.TemplateResponse("logs.html", {"request": request, "user": user, "logs": [], "log_files": [], "error": "Error crítico."})
-
-async def get_local_config():
-    db = database.SessionLocal()
-    config = crud.get_local_config(db)
-    db.close()
-    return config
-
-async def update_local_config(
-    aetitle: str = Form(...),
-    port: int = Form(...)
-):
-    db = database.SessionLocal()
-    crud.update_local_config(db, aetitle=aetitle, port=port)
-    updated = crud.get_local_config(db)
-    db.close()
-    return {"success": True, "config": updated}
-
-# ==============================
-# CONFIGURACIÓN LOCAL (AE TITLE / IP / PUERTO)
-# ==============================
-
-import sqlite3
-import socket
-from fastapi.responses import JSONResponse
-from fastapi import Form
-
-DB_PATH = "/opt/dicomproxy/dicomproxy.db"
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-async def get_local_config():
-    """
-    Devuelve la configuración local (AE Title, IP, Puerto)
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    row = cur.fetchone()
-    conn.close()
-
-    if row:
-        return dict(row)
-    else:
-        return {"error": "No se encontró configuración local"}
-
-async def update_local_config(
-    aetitle: str = Form(...),
-    port: int = Form(...)
-):
-    """
-    Actualiza la configuración local (AE Title, IP, Puerto)
-    """
-    # Obtener IP real (no loopback)
+@app.get("/admin/logs/search", tags=["Admin UI"])
+async def admin_search_logs(user: str = Depends(get_current_user), q: str = Query(None), level: str = Query("ALL"), since: str = Query(None), until: str = Query(None), trace: str = Query(None),
+                            before: int = Query(None, ge=0), after: int = Query(None, ge=0), limit: int = Query(log_reader.DEFAULT_PAGE_SIZE, ge=1, le=log_reader.MAX_PAGE_SIZE)):
+    page = await asyncio.to_thread(log_indexer.search, q, level, since, until, before, after, limit, tracing.normalize_trace_id(trace))
+    for entry in page["entries"]: entry["message"] = str(entry["message"])
+    return JSONResponse(content=page)
+@app.get("/admin/logs/index", tags=["Admin UI"])
+async def admin_log_index_stats(user: str = Depends(get_current_user)): return JSONResponse(content=await gateway.call("log_index_stats"))
+
+# --- Log en vivo (SSE y WebSocket) ---
+# Sin novedades, cada cuántos segundos se envía un latido para mantener viva la conexión
+LOG_TAIL_HEARTBEAT = 15
+@app.get("/admin/logs/stream", tags=["Admin UI"])
+async def admin_stream_logs(request: Request, user: str = Depends(get_current_user), level: str = Query("ALL"), search: str = Query(None), trace: str = Query(None)):
+    subscription = log_tailer.subscribe(level, search, tracing.normalize_trace_id(trace))
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                batch, dropped = await subscription.next_batch(LOG_TAIL_HEARTBEAT)
+                if dropped: yield f"event: dropped\ndata: {json.dumps({'count': dropped})}\n\n"
+                entries = [entry for entry in batch if "type" not in entry]
+                for notice in (entry for entry in batch if "type" in entry): yield f"event: {notice['type']}\ndata: {{}}\n\n"
+                if entries: yield f"event: logs\ndata: {json.dumps(entries, ensure_ascii=False)}\n\n"
+                elif not batch and not dropped: yield ": ping\n\n"
+        finally:
+            log_tailer.unsubscribe(subscription)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+@app.websocket("/admin/logs/ws")
+async def admin_websocket_logs(websocket: WebSocket, level: str = Query("ALL"), search: str = Query(None), trace: str = Query(None)):
+    token = websocket.cookies.get("access_token")
+    if not token or security.decode_access_token(token) is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = log_tailer.subscribe(level, search, tracing.normalize_trace_id(trace))
     try:
-        ip_local = socket.gethostbyname(socket.gethostname())
-        if ip_local.startswith("127."):
-            import subprocess
-            ip_local = subprocess.getoutput("hostname -I | awk '{print $1}'").strip()
-    except Exception:
-        ip_local = "127.0.0.1"
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE local_config SET aetitle=?, ip=?, port=? WHERE id=1;", (aetitle, ip_local, port))
-    conn.commit()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    row = cur.fetchone()
-    conn.close()
-
-    return {"success": True, "config": dict(row)}
-
-
-# ==============================
-# CONFIGURACIÓN LOCAL (AE TITLE / IP / PUERTO)
-# ==============================
-
-import sqlite3
-import socket
-from fastapi.responses import JSONResponse
-from fastapi import Form
-
-DB_PATH = "/opt/dicomproxy/dicomproxy.db"
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-@app.get("/config/local", response_class=JSONResponse)
-async def get_local_config():
-    """
-    Devuelve la configuración local (AE Title, IP, Puerto)
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    row = cur.fetchone()
-    conn.close()
-
-    if row:
-        return dict(row)
-    else:
-        return {"error": "No se encontró configuración local"}
-
-@app.post("/config/local", response_class=JSONResponse)
-async def update_local_config(
-    aetitle: str = Form(...),
-    port: int = Form(...)
-):
-    """
-    Actualiza la configuración local (AE Title, IP, Puerto)
-    """
-    # Obtener IP real (no loopback)
-    try:
-        ip_local = socket.gethostbyname(socket.gethostname())
-        if ip_local.startswith("127."):
-            import subprocess
-            ip_local = subprocess.getoutput("hostname -I | awk '{print $1}'").strip()
-    except Exception:
-        ip_local = "127.0.0.1"
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE local_config SET aetitle=?, ip=?, port=? WHERE id=1;", (aetitle, ip_local, port))
-    conn.commit()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    row = cur.fetchone()
-    conn.close()
-
-    return {"success": True, "config": dict(row)}
-
-
-# ==============================
-# CONFIGURACIÓN LOCAL (AE TITLE / IP / PUERTO) — CON LOGGING DETALLADO
-# ==============================
-
-import sqlite3
-import socket
-import logging
-from fastapi.responses import JSONResponse
-from fastapi import Form
-
-# Logger del módulo (usa configuración global)
-logger = logging.getLogger(__name__)
-
-DB_PATH = "/opt/dicomproxy/dicomproxy.db"
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-@app.get("/config/local", response_class=JSONResponse)
-async def get_local_config():
-    """
-    Devuelve la configuración local (AE Title, IP, Puerto)
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    row = cur.fetchone()
-    conn.close()
-
-    if row:
-        return dict(row)
-    else:
-        return {"error": "No se encontró configuración local"}
-
-@app.post("/config/local", response_class=JSONResponse)
-async def update_local_config(
-    aetitle: str = Form(...),
-    port: int = Form(...)
-):
-    """
-    Actualiza la configuración local (AE Title, IP, Puerto)
-    y registra el evento en los logs.
-    """
-    try:
-        # Obtener IP real
-        ip_local = socket.gethostbyname(socket.gethostname())
-        if ip_local.startswith("127."):
-            import subprocess
-            ip_local = subprocess.getoutput("hostname -I | awk '{print $1}'").strip()
-    except Exception:
-        ip_local = "127.0.0.1"
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE local_config SET aetitle=?, ip=?, port=? WHERE id=1;", (aetitle, ip_local, port))
-    conn.commit()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1;")
-    row = cur.fetchone()
-    conn.close()
-
-    # Registrar log detallado
-    logger.info(f"Configuración local actualizada — AE Title: {aetitle}, Puerto: {port}, IP: {ip_local}")
-
-    return {
-        "success": True,
-        "config": dict(row),
-        "message": f"Configuración local actualizada — AE Title: {aetitle}, Puerto: {port}, IP: {ip_local}"
-    }
-
-
-# ======================================================
-# CONFIGURACIÓN LOCAL DICOM + GESTIÓN DE PACS (FUNCIONAL)
-# ======================================================
-
-import sqlite3
-import logging
-from fastapi import Form
-from fastapi.responses import JSONResponse, RedirectResponse
-
-DB_PATH = "/opt/dicomproxy/dicomproxy.db"
-logger = logging.getLogger(__name__)
-
-# --- CONFIGURACIÓN LOCAL DICOM --- #
-@app.get("/config/local", response_class=JSONResponse)
-async def get_local_config():
-    """Devuelve la configuración local del servidor DICOM"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, aetitle, ip, port FROM local_config LIMIT 1")
-    row = cur.fetchone()
-    conn.close()
-    if row:
-        return {"id": row[0], "aetitle": row[1], "ip": row[2], "port": row[3]}
-    return {"error": "No se encontró configuración local"}
-
-@app.post("/config/local", response_class=JSONResponse)
-async def update_local_config(aetitle: str = Form(...), ip: str = Form(...), port: int = Form(...)):
-    """Actualiza la configuración local del servidor DICOM"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM local_config LIMIT 1")
-    row = cur.fetchone()
-
-    if row:
-        cur.execute("UPDATE local_config SET aetitle=?, ip=?, port=? WHERE id=?", (aetitle, ip, port, row[0]))
-        logger.info(f"🔧 Configuración local actualizada — AE Title: {aetitle}, IP: {ip}, Puerto: {port}")
-    else:
-        cur.execute("INSERT INTO local_config (aetitle, ip, port) VALUES (?, ?, ?)", (aetitle, ip, port))
-        logger.info(f"🆕 Configuración local creada — AE Title: {aetitle}, IP: {ip}, Puerto: {port}")
-
-    conn.commit()
-    conn.close()
-
-    return {
-        "success": True,
-        "message": f"Configuración local actualizada — AE Title: {aetitle}, IP: {ip}, Puerto: {port}",
-        "config": {"aetitle": aetitle, "ip": ip, "port": port}
-    }
-
-
-# --- LISTAR CONFIGURACIÓN Y PACS --- #
-@app.get("/admin/dashboard/config", response_class=HTMLResponse)
-async def admin_view_config(request: Request, user: str = Depends(get_current_user)):
-    """Vista de configuración completa"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT id, descripcion, aetitle, ip, port, activo FROM pacs_configs")
-    pacs_list = cur.fetchall()
-    conn.close()
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT aetitle, ip, port FROM local_config LIMIT 1")
-    row = cur.fetchone()
-    conn.close()
-
-    local_data = {
-        "aetitle": row[0] if row else "DICOMWEBPROXY",
-        "ip": row[1] if row else "127.0.0.1",
-        "port": row[2] if row else 104
-    }
-
-    return templates.TemplateResponse(
-        "config.html",
-        {"request": request, "user": user, "pacs_list": pacs_list, "local_config": local_data}
-    )
-
-
-# --- NUEVO PACS --- #
-@app.get("/admin/pacs/new", response_class=HTMLResponse)
-async def admin_new_pacs_page(request: Request, user: str = Depends(get_current_user)):
-    """Página para añadir un nuevo PACS"""
-    return templates.TemplateResponse("pacs_add.html", {"request": request, "user": user})
-
-@app.post("/admin/pacs/add")
-async def admin_add_pacs(
-    user: str = Depends(get_current_user),
-    description: str = Form(...),
-    aetitle: str = Form(...),
-    ip_address: str = Form(...),
-    port: int = Form(...)
-):
-    """Agrega un nuevo PACS a la base de datos"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO pacs_configs (descripcion, aetitle, ip, port, activo) VALUES (?, ?, ?, ?, 0)",
-        (description, aetitle, ip_address, port)
-    )
-    conn.commit()
-    conn.close()
-
-    logger.info(f"🩻 Nuevo PACS añadido — Descripción: {description}, AE Title: {aetitle}, IP: {ip_address}, Puerto: {port}, Usuario: {user}")
-
-    return RedirectResponse(url="/admin/dashboard/config", status_code=303)
-
-
-# --- GESTIÓN DE PACS: Activar/Desactivar y Eliminar --- #
-from fastapi.responses import JSONResponse
-
-@app.post("/admin/pacs/toggle", response_class=JSONResponse)
-async def toggle_pacs_status(request: Request, user: str = Depends(get_current_user)):
-    """Activa o desactiva un PACS (AJAX)"""
-    import logging
-    data = await request.json()
-    pacs_id = data.get("id")
-    log = logging.getLogger("dicomproxy")
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT is_active FROM pacs_configs WHERE id=?", (pacs_id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return {"success": False, "msg": "PACS no encontrado"}
-
-    new_status = 0 if row[0] == 1 else 1
-    cur.execute("UPDATE pacs_configs SET is_active=? WHERE id=?", (new_status, pacs_id))
-    conn.commit()
-    conn.close()
-
-    log.info(f"🔁 Estado del PACS ID {pacs_id} cambiado a {'Activo' if new_status else 'Inactivo'} por '{user}'")
-    return {"success": True, "msg": f"PACS {'activado' if new_status else 'desactivado'} correctamente"}
-
-@app.post("/admin/pacs/delete", response_class=JSONResponse)
-async def delete_pacs(request: Request, user: str = Depends(get_current_user)):
-    """Elimina un PACS (AJAX)"""
-    import logging
-    data = await request.json()
-    pacs_id = data.get("id")
-    log = logging.getLogger("dicomproxy")
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM pacs_configs WHERE id=?", (pacs_id,))
-    conn.commit()
-    conn.close()
-
-    log.info(f"🗑️ PACS eliminado (ID {pacs_id}) por '{user}'")
-    return {"success": True, "msg": "PACS eliminado correctamente"}
-
-# ======================================================
-# ENDPOINT: /admin/logs/add  → utilizado por config.html
-# ======================================================
-from fastapi.responses import JSONResponse
-import logging
-
-# ======================================================
-# ENDPOINT DEFINITIVO: /admin/logs/add
-# ======================================================
-from fastapi.responses import JSONResponse
-import logging
-from implementation.config.logging_config import setup_logging
-
-# ======================================================
-# ENDPOINT FINAL: /admin/logs/add  (sin reinicializar logger)
-# ======================================================
-from fastapi.responses import JSONResponse
-import logging
-
-@app.post("/admin/logs/add", response_class=JSONResponse)
-async def add_admin_log(request: Request, user: str = Depends(get_current_user)):
-    """
-    Registra una acción del panel de administración (config/logs)
-    directamente en el archivo de log activo.
-    """
-    try:
-        data = await request.json()
-        message = data.get("message", "").strip()
-        if not message:
-            return {"success": False, "msg": "Mensaje vacío"}
-
-        # Usar el logger global configurado al iniciar el sistema
-        log = logging.getLogger("dicomproxy")
-        if not log.handlers:
-            # Seguridad: si no existen handlers, evita duplicar setup
-            from implementation.config.logging_config import setup_logging
-            setup_logging()
-
-        log.info(f"🧩 [WEB ACTION] {message} — Usuario: {user}")
-        return {"success": True, "msg": "Log registrado correctamente"}
-
-    except Exception as e:
-        logging.getLogger("dicomproxy").error(f"Error al registrar log desde interfaz: {e}")
-        return {"success": False, "msg": f"Error al registrar log: {e}"}
+        while True:
+            batch, dropped = await subscription.next_batch(LOG_TAIL_HEARTBEAT)
+            if dropped: await websocket.send_json({"type": "dropped", "count": dropped})
+            for notice in (entry for entry in batch if "type" in entry): await websocket.send_json(notice)
+            entries = [entry for entry in batch if "type" not in entry]
+            if entries: await websocket.send_json({"type": "logs", "entries": entries})
+            elif not batch and not dropped: await websocket.send_json({"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        log_tailer.unsubscribe(subscription)
+
+# Valor del selector de archivo que consulta el índice de todos los logs
+INDEX_VIEW = "__index__"
+@app.get("/admin/dashboard/logs", response_class=HTMLResponse, tags=["Admin UI"])
+async def admin_view_logs(request: Request, user: str = Depends(get_current_user), file: str = Query(None), level: str = Query("ALL"), search: str = Query(None), trace: str = Query(None),
+                          since: str = Query(None), until: str = Query(None),
+                          before: int = Query(None, ge=0), after: int = Query(None, ge=0), limit: int = Query(log_reader.DEFAULT_PAGE_SIZE, ge=1, le=log_reader.MAX_PAGE_SIZE)):
+    # Tiempo de lectura y renderizado de la página (la plantilla se renderiza al crear la respuesta)
+    trace = tracing.normalize_trace_id(trace)
+    with metrics.log_viewer_render_seconds.labels("index" if file == INDEX_VIEW else "file").time():
+        try:
+            log_files = await asyncio.to_thread(log_reader.list_log_files)
+            actual_log_name = "DicomProxy_Actual.log"
+            if file == INDEX_VIEW:
+                # Búsqueda en el índice de todos los archivos (con rango de fechas)
+                page = await asyncio.to_thread(log_indexer.search, search, level, since, until, before, after, limit, trace)
+                filters = {"file": INDEX_VIEW, "level": level or "ALL", "search": search or "", "trace": trace or "", "since": since or "", "until": until or "", "limit": limit}
+                older_url = f"/admin/dashboard/logs?{urlencode({**filters, 'before': page['older_cursor']})}" if page["older_cursor"] is not None else None
+                newer_url = f"/admin/dashboard/logs?{urlencode({**filters, 'after': page['newer_cursor']})}" if page["newer_cursor"] is not None else None
+                return templates.TemplateResponse("logs.html", {"request": request, "user": user, "log_files": log_files, "selected_file": INDEX_VIEW, "index_view": INDEX_VIEW, "selected_level": level, "search_query": search or "", "trace": trace or "", "since": since or "", "until": until or "", "logs": page["entries"], "older_url": older_url, "newer_url": newer_url})
+            if file and file in log_files: selected_file = file
+            elif actual_log_name in log_files: selected_file = actual_log_name
+            elif log_files: selected_file = log_files[0]
+            else: selected_file = None
+            page = {"entries": [], "older_cursor": None, "newer_cursor": None}
+            if selected_file:
+                try:
+                    path = await asyncio.to_thread(log_reader.readable_path, selected_file)
+                    page = await asyncio.to_thread(log_reader.read_page, path, log_reader.LogFilter(level, search, trace), limit, before, after)
+                except Exception as e: logger.error(f"Could not read log file {selected_file}: {e}")
+            filters = {"file": selected_file or "", "level": level or "ALL", "search": search or "", "trace": trace or "", "limit": limit}
+            older_url = f"/admin/dashboard/logs?{urlencode({**filters, 'before': page['older_cursor']})}" if page["older_cursor"] is not None else None
+            newer_url = f"/admin/dashboard/logs?{urlencode({**filters, 'after': page['newer_cursor']})}" if page["newer_cursor"] is not None else None
+            return templates.TemplateResponse("logs.html", {"request": request, "user": user, "log_files": log_files, "selected_file": selected_file, "index_view": INDEX_VIEW, "selected_level": level, "search_query": search or "", "trace": trace or "", "logs": page["entries"], "older_url": older_url, "newer_url": newer_url,
+                                                             "live_tail": selected_file == actual_log_name and before is None and after is None})
+        except Exception as e:
+            logger.exception(f"CRITICAL ERROR in admin_view_logs: {e}")
+            return templates.TemplateResponse("logs.html", {"request": request, "user": user, "logs": [], "log_files": [], "error": "Error crítico."})
@@ -0,0 +1,351 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+# Límites de los histogramas (segundos). Los de SQLite y el traductor son mucho más finos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _label_text(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Base común: nombre, ayuda, etiquetas e hijos (uno por combinación de valores)."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        """Hijo para esos valores de etiqueta (cadenas). Solo se bloquea al crear uno nuevo."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            yield from child.samples(self.name, self.labelnames, values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        yield f"{name}{_label_text(labelnames, values)} {_number(self.value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+
+class CallbackGauge(_Metric):
+    """Gauge que se calcula al exportar: 'callback' devuelve {valores de etiqueta: valor}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback, labelnames=()):
+        self.callback = callback
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def _samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {_number(float(value))}"
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        # Solo se incrementa el cubo que corresponde; los acumulados se calculan al exportar
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def samples(self, name, labelnames, values):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="' + _number(bound) + '"'
+            yield f"{name}_bucket{_label_text(labelnames, values, le)} {cumulative}"
+        yield f"{name}_sum{_label_text(labelnames, values)} {_number(total)}"
+        yield f"{name}_count{_label_text(labelnames, values)} {cumulative}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self) -> _Timer:
+        return _Timer(self._children[()])
+
+
+class Registry:
+    """Métricas del proceso, exportadas en el formato de texto de Prometheus."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def callback_gauge(self, name: str, documentation: str, callback, labelnames=()) -> CallbackGauge:
+        return self._register(CallbackGauge(f"{self.prefix}_{name}", documentation, callback, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets))
+
+    def render(self, only=None, exclude=()) -> str:
+        """Texto de exportación; 'only'/'exclude' limitan las métricas (nombres completos)."""
+        with self._lock:
+            metrics = [metric for metric in self._metrics if (only is None or metric.name in only) and metric.name not in exclude]
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Un gauge calculado que falla no debe impedir exportar el resto
+                lines.append(f"# {metric.name}: error al calcular ({_escape(e)})")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry("dicomproxy")
+
+# --- DIMSE ---
+association_setup_seconds = registry.histogram("association_setup_seconds", "Tiempo de establecimiento de asociaciones DIMSE salientes.", ("pacs", "result"))
+cfind_duration_seconds = registry.histogram("cfind_duration_seconds", "Duración de cada C-FIND por PACS (asociación incluida, sin la espera en cola).", ("pacs", "result"))
+cfind_results = registry.histogram("cfind_results", "Identificadores devueltos por cada C-FIND.", ("pacs",), COUNT_BUCKETS)
+cfind_in_flight = registry.gauge("cfind_in_flight", "C-FIND en curso por PACS.", ("pacs",))
+query_results = registry.histogram("query_results", "Resultados de cada búsqueda federada.", (), COUNT_BUCKETS)
+query_duration_seconds = registry.histogram("query_duration_seconds", "Duración de cada búsqueda federada.", ("result",))
+cstore_instances_total = registry.counter("cstore_instances_total", "Instancias recibidas por C-STORE.", ("status",))
+cstore_bytes_total = registry.counter("cstore_bytes_total", "Bytes de las instancias aceptadas por C-STORE.")
+
+# --- Traducción, logs y base de datos ---
+translator_seconds = registry.histogram("translator_seconds", "Tiempo de conversión de un dataset a DICOM JSON.", (), FAST_BUCKETS)
+log_viewer_render_seconds = registry.histogram("log_viewer_render_seconds", "Tiempo de lectura y renderizado del visor de logs.", ("view",))
+sqlite_query_seconds = registry.histogram("sqlite_query_seconds", "Tiempo de ejecución de sentencias SQLite.", ("db", "statement"), FAST_BUCKETS)
+
+# --- Pool de procesos (trabajo de CPU) ---
+cpu_tasks_total = registry.counter("cpu_tasks_total", "Tareas de CPU por etapa y por dónde se ejecutaron (inline, process, overflow, fallback).", ("stage", "route"))
+cpu_task_seconds = registry.histogram("cpu_task_seconds", "Duración de las tareas enviadas al pool de procesos (espera en cola incluida).", ("stage",))
+cpu_busy_seconds_total = registry.counter("cpu_busy_seconds_total", "Tiempo de trabajo de los procesos del pool.", ("stage",))
+transcode_total = registry.counter("transcode_total", "Instancias pedidas en otra sintaxis de transferencia, por sintaxis destino y resultado.", ("transfer_syntax", "result"))
+
+# --- HTTP ---
+http_requests_in_flight = registry.gauge("http_requests_in_flight", "Peticiones HTTP en curso.", ("area",))
+http_request_duration_seconds = registry.histogram("http_request_duration_seconds", "Duración de las peticiones HTTP (hasta enviar el último byte).", ("method", "route", "status"))
+
+
+def pacs_label(pacs_config) -> str:
+    return f"{pacs_config['aetitle']}@{pacs_config['ip_address']}:{pacs_config['port']}"
+
+
+# --- SQLite instrumentado ---
+def _statement(sql: str) -> str:
+    word = sql.lstrip().split(None, 1)
+    return word[0].upper() if word else "?"
+
+
+def sqlite_factory(db: str):
+    """
+    Clase de conexión (parámetro 'factory' de sqlite3.connect) que mide cada
+    execute/executemany/executescript hecho sobre la conexión.
+    """
+
+    class TimedConnection(sqlite3.Connection):
+        def execute(self, sql, *args):
+            started = time.perf_counter()
+            try:
+                return super().execute(sql, *args)
+            finally:
+                sqlite_query_seconds.labels(db, _statement(sql)).observe(time.perf_counter() - started)
+
+        def executemany(self, sql, *args):
+            started = time.perf_counter()
+            try:
+                return super().executemany(sql, *args)
+            finally:
+                sqlite_query_seconds.labels(db, _statement(sql)).observe(time.perf_counter() - started)
+
+        def executescript(self, sql):
+            started = time.perf_counter()
+            try:
+                return super().executescript(sql)
+            finally:
+                sqlite_query_seconds.labels(db, "SCRIPT").observe(time.perf_counter() - started)
+
+    return TimedConnection
+
+
+# --- Middleware HTTP ---
+def _area(path: str) -> str:
+    if path.startswith(("/admin", "/config")):
+        return "admin"
+    if path.startswith("/static"):
+        return "static"
+    if path.startswith("/studies"):
+        return "dicomweb"
+    return "other"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI (sin BaseHTTPMiddleware, para no añadir una tarea por petición):
+    cuenta las peticiones en curso y mide su duración por ruta (la plantilla de la
+    ruta, no la URL, para no multiplicar las series con cada UID).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        in_flight = http_requests_in_flight.labels(_area(scope["path"]))
+        in_flight.inc()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = scope.get("route")
+            http_request_duration_seconds.labels(scope["method"], getattr(route, "path", "unmatched"), str(status[0])).observe(time.perf_counter() - started)
@@ -0,0 +1,377 @@
+import asyncio
+import time
+import uuid
+from fastapi import APIRouter, Request, HTTPException, status, Depends
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from loguru import logger
+
+from implementation.dicom_services import qido
+from implementation.dicom_services.dicomweb_translator import result_to_json_bytes, datasets_to_json_bytes
+from implementation.dicom_services.query_cache import query_cache
+from implementation.dicom_services.query_engine import QueryOutcome
+from implementation.dicom_services import gateway
+from implementation.dicom_services.gateway_client import dimse_gateway, GatewayError
+from implementation.dicom_services.scheduler import Overloaded, current_client
+from implementation.dicom_services import retrieval
+from implementation.dicom_services import frames as frame_reader
+from implementation.dicom_services import rendering
+from implementation.dicom_services import transcoding
+from implementation.config.settings import settings
+from implementation import tracing
+
+
+async def dimse_admission(request: Request):
+    """
+    Admisión de cada petición DICOMweb: identifica al cliente para el reparto por
+    turnos de las operaciones DIMSE y, si las colas ya están llenas, responde 503
+    con Retry-After antes de lanzar ninguna.
+    """
+    client = request.client.host if request.client else "desconocido"
+    current_client.set(client)
+    try:
+        await gateway.call("admit", client)
+    except Overloaded as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except GatewayError as e:
+        logger.error(f"Petición DICOMweb rechazada: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Gateway DIMSE no disponible", headers={"Retry-After": "5"})
+
+
+router = APIRouter(tags=["DICOMweb"], dependencies=[Depends(dimse_admission)])
+
+DICOM_JSON_MEDIA_TYPE = "application/dicom+json"
+DICOM_MEDIA_TYPE = "application/dicom"
+
+
+def _int_param(request: Request, name: str):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{name}' debe ser un entero")
+    if number < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{name}' no puede ser negativo")
+    return number
+
+
+async def _stream_dicom_json(level: str, identifier, limit, offset, include=None):
+    """
+    Escribe el array application/dicom+json elemento a elemento a medida que los PACS
+    responden. Solo se conservan en memoria los UID ya enviados, para no duplicar
+    resultados que devuelvan varios PACS.
+    """
+    seen = set()
+    skipped = sent = 0
+    serialize_ns = 0
+    pending = []  # resultados de una búsqueda grande a la espera de traducirse por lotes
+    outcome = QueryOutcome()
+    yield b"["
+    with tracing.span("QIDO-RS stream", **{"qido.level": level}) as stream_span:
+        # Con gateway DIMSE la búsqueda (y su caché, común a todos los workers) la hace el gateway
+        results = (dimse_gateway if dimse_gateway.enabled else query_cache).stream_query(identifier, outcome=outcome)
+        try:
+            try:
+                async for _, result in results:
+                    key = qido.unique_key(level, result)
+                    if key is not None:
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    if offset and skipped < offset:
+                        skipped += 1
+                        continue
+                    if sent < settings.CPU_POOL_TRANSLATE_BATCH:
+                        # Los primeros resultados salen uno a uno, en cuanto llegan
+                        started = time.perf_counter_ns()
+                        chunk = result_to_json_bytes(result, include)
+                        serialize_ns += time.perf_counter_ns() - started
+                        yield (b"," if sent else b"") + chunk
+                        sent += 1
+                    else:
+                        # Búsqueda grande: el resto se traduce por lotes en el pool de procesos
+                        pending.append(result)
+                        if len(pending) >= settings.CPU_POOL_TRANSLATE_BATCH:
+                            started = time.perf_counter_ns()
+                            chunks = await datasets_to_json_bytes(pending, include)
+                            serialize_ns += time.perf_counter_ns() - started
+                            yield b"," + b",".join(chunks)
+                            sent, pending = sent + len(pending), []
+                    if limit and sent + len(pending) >= limit:
+                        break
+            except GatewayError as e:
+                # La respuesta ya empezó: se cierra el array con lo enviado y queda marcada como parcial
+                stream_span.fail(str(e))
+                outcome.failed.append("gateway DIMSE")
+                logger.error(f"QIDO-RS nivel {level}: búsqueda interrumpida: {e}")
+            finally:
+                # Al cortar por 'limit' (o si el cliente se desconecta) se cancelan los C-FIND pendientes
+                await results.aclose()
+            if pending:
+                started = time.perf_counter_ns()
+                chunks = await datasets_to_json_bytes(pending, include)
+                serialize_ns += time.perf_counter_ns() - started
+                yield (b"," if sent else b"") + b",".join(chunks)
+                sent += len(pending)
+        finally:
+            stream_span.set("qido.results", sent)
+            stream_span.set("dicomjson.serialize_ms", round(serialize_ns / 1e6, 3))
+            stream_span.set("qido.partial", outcome.partial)
+    yield b"]"
+    if outcome.timed_out or outcome.failed:
+        logger.warning(f"QIDO-RS nivel {level}: {sent} resultados enviados (parciales; sin respuesta de: {', '.join(outcome.timed_out + outcome.failed)}).")
+    else:
+        logger.info(f"QIDO-RS nivel {level}: {sent} resultados enviados.")
+
+
+async def _qido_response(request: Request, level: str, study_uid: str = None, series_uid: str = None):
+    try:
+        identifier = qido.build_qido_identifier(level, request.query_params.multi_items(), study_uid, series_uid)
+    except qido.QidoQueryError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    include = qido.response_tags(identifier, request.query_params.multi_items())
+    limit = _int_param(request, "limit")
+    offset = _int_param(request, "offset")
+    logger.info(f"Petición QIDO-RS nivel {level}: {dict(request.query_params)}")
+    # Los PACS que no se van a consultar se conocen antes de empezar: se avisan con 'Warning'
+    headers = {}
+    try:
+        unavailable = await gateway.call("unavailable_pacs")
+    except GatewayError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "5"})
+    if unavailable:
+        headers["Warning"] = f'299 {settings.PROXY_AET} "PACS no consultados (caidos o con el circuito abierto): {", ".join(unavailable)}"'
+    return StreamingResponse(_stream_dicom_json(level, identifier, limit, offset, include), media_type=DICOM_JSON_MEDIA_TYPE, headers=headers)
+
+
+@router.get("/studies")
+async def qido_search_studies(request: Request):
+    """QIDO-RS: búsqueda de estudios en todos los PACS activos."""
+    return await _qido_response(request, "STUDY")
+
+
+@router.get("/studies/{study_uid}/series")
+async def qido_search_series(request: Request, study_uid: str):
+    """QIDO-RS: búsqueda de series de un estudio."""
+    return await _qido_response(request, "SERIES", study_uid=study_uid)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances")
+async def qido_search_instances(request: Request, study_uid: str, series_uid: str):
+    """QIDO-RS: búsqueda de instancias de una serie."""
+    return await _qido_response(request, "IMAGE", study_uid=study_uid, series_uid=series_uid)
+
+
+# --- WADO-RS ---
+async def _stream_multipart(instances, boundary: str, transfer_syntax: str = None):
+    """
+    Escribe un cuerpo multipart/related con una parte application/dicom por instancia,
+    enviando cada una en cuanto llega del Storage SCP o de la caché local. Los bytes
+    se leen del archivo en bloques, sin cargar la instancia entera en memoria.
+    Con 'transfer_syntax' cada instancia se transcodifica antes de enviarla.
+    """
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+    sent = sent_bytes = 0
+    with tracing.span("WADO-RS stream") as stream_span:
+        try:
+            async for instance in instances:
+                try:
+                    instance = await transcoding.transcode(instance, transfer_syntax)
+                    yield delimiter + (
+                        f"Content-Type: {DICOM_MEDIA_TYPE}; transfer-syntax={instance.transfer_syntax}\r\n"
+                        f"Content-Length: {instance.size}\r\n"
+                        f"Content-Location: /studies/{instance.study_uid}/series/{instance.series_uid}/instances/{instance.sop_instance_uid}\r\n\r\n"
+                    ).encode("ascii")
+                    async for chunk in iterate_in_threadpool(instance.iter_chunks()):
+                        yield bytes(chunk)
+                    yield b"\r\n"
+                    sent += 1
+                    sent_bytes += instance.size
+                finally:
+                    instance.release()
+        except retrieval.RetrieveError as e:
+            # La respuesta ya está en curso: se cierra el multipart con lo recibido
+            stream_span.fail(str(e))
+            logger.error(f"WADO-RS interrumpido tras {sent} instancias: {e}")
+        finally:
+            await instances.aclose()
+            stream_span.set("wado.instances", sent)
+            stream_span.set("wado.bytes", sent_bytes)
+    yield f"--{boundary}--\r\n".encode("ascii")
+    logger.info(f"WADO-RS: {sent} instancias enviadas.")
+
+
+async def _wado_response(request: Request, study_uid: str, series_uid: str = None, instance_uid: str = None):
+    logger.info(f"Petición WADO-RS: estudio={study_uid} serie={series_uid or '-'} instancia={instance_uid or '-'}")
+    try:
+        transfer_syntax = transcoding.negotiate(request.headers.get("accept"))
+    except transcoding.TransferSyntaxNotAcceptable as e:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=str(e))
+    try:
+        instances = await retrieval.open_retrieval(study_uid, series_uid, [instance_uid] if instance_uid else None)
+    except retrieval.InstanceNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    boundary = uuid.uuid4().hex
+    # Sin 'transfer-syntax' en la cabecera exterior: una instancia que no se pueda
+    # transcodificar se envía tal como está y cada parte indica su propia sintaxis
+    media_type = f'multipart/related; type="{DICOM_MEDIA_TYPE}"; boundary={boundary}'
+    return StreamingResponse(_stream_multipart(instances, boundary, transfer_syntax), media_type=media_type)
+
+
+@router.get("/studies/{study_uid}")
+async def wado_retrieve_study(request: Request, study_uid: str):
+    """WADO-RS: recupera todas las instancias de un estudio."""
+    return await _wado_response(request, study_uid)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}")
+async def wado_retrieve_series(request: Request, study_uid: str, series_uid: str):
+    """WADO-RS: recupera todas las instancias de una serie."""
+    return await _wado_response(request, study_uid, series_uid)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}")
+async def wado_retrieve_instance(request: Request, study_uid: str, series_uid: str, instance_uid: str):
+    """WADO-RS: recupera una única instancia."""
+    return await _wado_response(request, study_uid, series_uid, instance_uid)
+
+
+async def _open_instance(study_uid: str, series_uid: str, instance_uid: str):
+    """Una única instancia (caché local o PACS), o 404."""
+    try:
+        instances = await retrieval.open_retrieval(study_uid, series_uid, [instance_uid])
+    except retrieval.InstanceNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    try:
+        async for instance in instances:
+            return instance
+    except retrieval.RetrieveError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    finally:
+        await instances.aclose()
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"El PACS no devolvió la instancia {instance_uid}.")
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/frames/{frame_list}")
+async def wado_retrieve_frames(study_uid: str, series_uid: str, instance_uid: str, frame_list: str):
+    """
+    WADO-RS: recupera fotogramas concretos de una instancia. Solo se leen del archivo
+    los bytes de los fotogramas pedidos; el Pixel Data nunca se carga ni se decodifica entero.
+    """
+    try:
+        numbers = frame_reader.parse_frame_list(frame_list)
+    except frame_reader.FrameError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    logger.info(f"Petición WADO-RS de fotogramas {numbers} de la instancia {instance_uid}")
+    instance = await _open_instance(study_uid, series_uid, instance_uid)
+    try:
+        media_type, transfer_syntax, frames = await asyncio.to_thread(frame_reader.read_frames, instance, numbers)
+    except frame_reader.FrameNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except frame_reader.FrameError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        instance.release()
+
+    boundary = uuid.uuid4().hex
+    location = f"/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/frames"
+    parts = []
+    for number, frame in zip(numbers, frames):
+        parts.append((
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}; transfer-syntax={transfer_syntax}\r\n"
+            f"Content-Length: {len(frame)}\r\n"
+            f"Content-Location: {location}/{number}\r\n\r\n"
+        ).encode("ascii"))
+        parts.append(frame)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    response_type = f'multipart/related; type="{media_type}"; transfer-syntax={transfer_syntax}; boundary={boundary}'
+    return Response(content=b"".join(parts), media_type=response_type)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/bulkdata/{tag}")
+async def wado_retrieve_bulkdata(study_uid: str, series_uid: str, instance_uid: str, tag: str):
+    """WADO-RS: valor binario de un atributo (destino de los BulkDataURI de las respuestas QIDO-RS)."""
+    try:
+        tag_value = int(tag, 16) if len(tag) == 8 else None
+    except ValueError:
+        tag_value = None
+    if tag_value is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Tag no válido: '{tag}' (formato GGGGEEEE)")
+    instance = await _open_instance(study_uid, series_uid, instance_uid)
+    try:
+        value = await asyncio.to_thread(frame_reader.read_bulkdata, instance, tag_value)
+    finally:
+        instance.release()
+    if value is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"La instancia {instance_uid} no tiene un valor binario en {tag}.")
+
+    boundary = uuid.uuid4().hex
+    location = f"/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/bulkdata/{tag}"
+    body = (
+        f"--{boundary}\r\n"
+        f"Content-Type: {frame_reader.NATIVE_MEDIA_TYPE}\r\n"
+        f"Content-Length: {len(value)}\r\n"
+        f"Content-Location: {location}\r\n\r\n"
+    ).encode("ascii") + value + f"\r\n--{boundary}--\r\n".encode("ascii")
+    return Response(content=body, media_type=f'multipart/related; type="{frame_reader.NATIVE_MEDIA_TYPE}"; boundary={boundary}')
+
+
+# --- Imágenes renderizadas ---
+async def _rendered_response(request: Request, study_uid: str, series_uid: str, instance_uid: str,
+                             frame: int = 1, thumbnail: bool = False):
+    """
+    Renderiza (o toma de la caché de renderizado) un fotograma de la instancia. Solo
+    si no está en caché se obtiene la instancia por la ruta de recuperación habitual.
+    """
+    default_viewport = (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE) if thumbnail else None
+    try:
+        params = rendering.RenderParams.from_query(request.query_params, request.headers.get("accept"), default_viewport)
+    except rendering.RenderNotAcceptable as e:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=str(e))
+    except rendering.RenderError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if frame < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Los fotogramas se numeran desde 1")
+
+    key = rendering.cache_key(instance_uid, frame, params)
+    data = rendering.render_cache.get(key)
+    if data is None:
+        instance = await _open_instance(study_uid, series_uid, instance_uid)
+        try:
+            data = await rendering.render(instance, frame, params)
+        except frame_reader.FrameNotFound as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+        except rendering.RenderError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        finally:
+            instance.release()
+        rendering.render_cache.put(key, data)
+    return Response(content=data, media_type=params.media_type)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/rendered")
+async def wado_rendered_instance(request: Request, study_uid: str, series_uid: str, instance_uid: str):
+    """WADO-RS: imagen renderizada (primer fotograma) con ventana y tamaño opcionales."""
+    return await _rendered_response(request, study_uid, series_uid, instance_uid)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/thumbnail")
+async def wado_thumbnail_instance(request: Request, study_uid: str, series_uid: str, instance_uid: str):
+    """WADO-RS: miniatura de la instancia (THUMBNAIL_SIZE píxeles salvo 'viewport')."""
+    return await _rendered_response(request, study_uid, series_uid, instance_uid, thumbnail=True)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/frames/{frame}/rendered")
+async def wado_rendered_frame(request: Request, study_uid: str, series_uid: str, instance_uid: str, frame: int):
+    """WADO-RS: un fotograma renderizado."""
+    return await _rendered_response(request, study_uid, series_uid, instance_uid, frame)
+
+
+@router.get("/studies/{study_uid}/series/{series_uid}/instances/{instance_uid}/frames/{frame}/thumbnail")
+async def wado_thumbnail_frame(request: Request, study_uid: str, series_uid: str, instance_uid: str, frame: int):
+    """WADO-RS: miniatura de un fotograma."""
+    return await _rendered_response(request, study_uid, series_uid, instance_uid, frame, thumbnail=True)
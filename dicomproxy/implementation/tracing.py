@@ -0,0 +1,297 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from loguru import logger
+
+from implementation.config.settings import settings
+
+# Tipos de span de OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+# Cabecera W3C 'traceparent': versión-traceid-spanid-flags
+TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(values: dict) -> list:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in values.items() if value is not None]
+
+
+class Span:
+    """Una operación cronometrada dentro de una traza (modelo de OpenTelemetry)."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "events", "status", "message")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: int = KIND_INTERNAL, start_ns: int = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.events = []
+        self.status = None
+        self.message = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def event(self, name: str, **attributes):
+        """Marca un instante dentro del span (p. ej. la primera respuesta del PACS)."""
+        self.events.append((time.time_ns(), name, attributes))
+
+    def fail(self, message: str):
+        self.status, self.message = STATUS_ERROR, message
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id, "spanId": self.span_id, "name": self.name, "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns), "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _attributes(self.attributes),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [{"timeUnixNano": str(ts), "name": name, "attributes": _attributes(attrs)} for ts, name, attrs in self.events]
+        if self.status is not None:
+            span["status"] = {"code": self.status, **({"message": self.message} if self.message else {})}
+        return span
+
+
+class _NoopSpan:
+    """Sustituto fuera de una traza (o con la traza desactivada): acepta las mismas llamadas y no hace nada."""
+
+    trace_id = span_id = None
+
+    def set(self, key, value): pass
+    def event(self, name, **attributes): pass
+    def fail(self, message): pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    return _current.get()
+
+
+def current_trace_id():
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, parent: Span = None, root: bool = False, trace_id: str = None, parent_id: str = None,
+         start_ns: int = None, **attributes):
+    """
+    Abre un span hijo del span actual (o de 'parent', para continuar una traza en
+    otro hilo) y lo hace actual mientras dura el bloque. Fuera de una traza no se
+    registra nada, salvo con 'root' (empieza una traza nueva, o continúa la de
+    'trace_id'/'parent_id'). Una excepción marca el span con error y se propaga.
+    """
+    parent = parent if parent is not None else _current.get()
+    if not settings.TRACING_ENABLED or (parent is None and not root):
+        yield NOOP_SPAN
+        return
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    current = Span(name, trace_id or os.urandom(16).hex(), parent_id, kind, start_ns, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except GeneratorExit:
+        current.set("abandoned", True)
+        raise
+    except BaseException as e:
+        current.fail(str(e) or type(e).__name__)
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # El bloque terminó en otro contexto (generador cerrado desde fuera): se restaura el padre
+            _current.set(parent)
+        current.end_ns = time.time_ns()
+        span_exporter.add(current)
+
+
+@contextmanager
+def attach(parent: Span):
+    """Hace actual un span de otro hilo (sin crear uno nuevo), p. ej. en los manejadores del SCP."""
+    token = _current.set(parent)
+    try:
+        yield parent
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    """Devuelve 'fn' para ejecutarla en otro hilo con el contexto actual (traza y cliente)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def normalize_trace_id(value: str):
+    """Identificador de traza válido (32 hex en minúsculas) o None."""
+    value = (value or "").strip().lower()
+    return value if TRACE_ID_RE.match(value) else None
+
+
+def log_patcher(record):
+    """Patcher de loguru: añade el identificador de traza de la petición en curso a cada línea."""
+    span = _current.get()
+    record["extra"]["trace"] = f"[trace={span.trace_id}] " if span is not None else ""
+
+
+class SpanExporter:
+    """
+    Exporta los spans terminados a un archivo local en formato OTLP-JSON (una línea
+    'resourceSpans' por lote, como el exportador a archivo del OpenTelemetry
+    Collector). Terminar un span solo lo añade a una cola; un hilo en segundo plano
+    los escribe por lotes. Si la cola se llena se descartan los más antiguos.
+    """
+
+    def __init__(self, path, interval: float, max_pending: int, max_bytes: int):
+        self.path = Path(path)
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._pending = deque(maxlen=max_pending)
+        self._stop = threading.Event()
+        self._thread = None
+        self._write_lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def add(self, span: Span):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(span)
+
+    def flush(self) -> int:
+        spans = []
+        while self._pending:
+            try:
+                spans.append(self._pending.popleft())
+            except IndexError:
+                break
+        if not spans:
+            return 0
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": "dicomproxy", "service.instance.id": settings.PROXY_AET})},
+            "scopeSpans": [{"scope": {"name": "implementation.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}, ensure_ascii=False, separators=(",", ":"))
+        with self._write_lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.max_bytes and self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+                # Se conserva un único archivo anterior
+                os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        self.exported += len(spans)
+        return len(spans)
+
+    def start(self):
+        if not settings.TRACING_ENABLED or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"No se pudieron exportar los últimos spans: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error al exportar spans a '{self.path}': {e}")
+
+    def stats(self) -> dict:
+        return {"enabled": settings.TRACING_ENABLED, "path": str(self.path), "pending": len(self._pending),
+                "exported": self.exported, "dropped": self.dropped}
+
+
+span_exporter = SpanExporter(
+    path=settings.TRACE_EXPORT_FILE,
+    interval=settings.TRACE_EXPORT_INTERVAL,
+    max_pending=settings.TRACE_MAX_PENDING,
+    max_bytes=settings.TRACE_EXPORT_MAX_BYTES,
+)
+
+
+# --- Middleware HTTP ---
+# Rutas que no se trazan (recursos estáticos y la exportación de métricas)
+UNTRACED_PREFIXES = ("/static", "/metrics")
+
+
+class TracingMiddleware:
+    """
+    Middleware ASGI que abre el span raíz de cada petición HTTP. Continúa la traza
+    de la cabecera 'traceparent' si el cliente la envía y devuelve el identificador
+    en 'X-Trace-Id' para poder buscarlo en el visor de logs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED or scope["path"].startswith(UNTRACED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        trace_id = parent_id = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                match = TRACEPARENT_RE.match(value.decode("latin-1").strip())
+                if match:
+                    trace_id, parent_id = match.groups()
+                break
+        with span(f"{scope['method']} {scope['path']}", KIND_SERVER, root=True, trace_id=trace_id, parent_id=parent_id,
+                  **{"http.method": scope["method"], "http.target": scope["path"]}) as request_span:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    request_span.set("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        request_span.fail(f"HTTP {message['status']}")
+                    message["headers"] = [*message.get("headers", []), (b"x-trace-id", request_span.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    request_span.name = f"{scope['method']} {route.path}"
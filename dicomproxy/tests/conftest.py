@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Los directorios de trabajo se fijan antes de importar 'implementation' (los lee settings)
+_WORK_DIR = Path(tempfile.mkdtemp(prefix="dicomproxy-tests-"))
+for _name, _value in {"SPOOL_DIR": "spool", "INSTANCE_STORE_DIR": "instance_store", "LOGS_DIR": "logs",
+                      "LOG_INDEX_DB": "logs/log_index.db", "TRACE_EXPORT_FILE": "logs/traces.jsonl"}.items():
+    os.environ.setdefault(_name, str(_WORK_DIR / _value))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def database_file(tmp_path, monkeypatch):
+    """Base de datos vacía y propia de cada prueba."""
+    from implementation import database
+    monkeypatch.setattr(database, "DATABASE_FILE", tmp_path / "dicomproxy.db")
+    database.initialize_database()
+    yield database.DATABASE_FILE
+    database.get_pool().close_all()
+
+
+def make_pacs(description: str, port: int = 104) -> dict:
+    return {"id": port, "description": description, "aetitle": description.upper(), "ip_address": "127.0.0.1",
+            "port": port, "is_active": 1, "retrieval_strategy": "C-MOVE", "mirror_group": None, "max_associations": None}
@@ -0,0 +1,116 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from implementation.dicom_services.association_pool import AssociationPool, _PooledAssociation
+from conftest import make_pacs
+
+PACS = make_pacs("Archivo central")
+
+
+class _Association:
+    def __init__(self, echo_status: int = 0x0000):
+        self.is_established = True
+        self.dimse_timeout = 30
+        self.echo_status = echo_status
+        self.released = False
+
+    def send_c_echo(self):
+        return SimpleNamespace(Status=self.echo_status)
+
+    def release(self):
+        self.is_established = False
+        self.released = True
+
+    def abort(self):
+        self.is_established = False
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(max_per_pacs=2, health_check_interval=60):
+        created = []
+        pool = AssociationPool("PROXY", max_per_pacs=max_per_pacs, idle_timeout=600,
+                               health_check_interval=health_check_interval, acquire_timeout=5)
+
+        def open_association(key, timeout=None):
+            created.append(_Association())
+            return _PooledAssociation(created[-1])
+        pool._open = open_association
+        pool.created = created
+        pools.append(pool)
+        return pool
+    yield make
+    for pool in pools:
+        pool.close_all()
+
+
+def test_association_is_reused(make_pool):
+    pool = make_pool()
+    for _ in range(3):
+        with pool.acquire(PACS) as assoc:
+            assert assoc is pool.created[0]
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["pacs"]["ARCHIVO CENTRAL@127.0.0.1:104"]["idle"] == 1
+
+
+def test_failed_block_discards_the_association(make_pool):
+    pool = make_pool()
+    with pytest.raises(RuntimeError):
+        with pool.acquire(PACS):
+            raise RuntimeError("respuesta DIMSE incompleta")
+    assert pool.created[0].released
+    with pool.acquire(PACS) as assoc:
+        assert assoc is pool.created[1]
+
+
+def test_limit_per_pacs_waits_for_a_free_association(make_pool):
+    pool = make_pool(max_per_pacs=1)
+    acquired, release = threading.Event(), threading.Event()
+
+    def holder():
+        with pool.acquire(PACS):
+            acquired.set()
+            release.wait(5)
+    thread = threading.Thread(target=holder)
+    thread.start()
+    acquired.wait(5)
+    with pool.acquire(PACS, timeout=0.1) as assoc:
+        assert assoc is None
+    threading.Timer(0.1, release.set).start()
+    with pool.acquire(PACS) as assoc:
+        assert assoc is pool.created[0]
+    thread.join(5)
+    assert len(pool.created) == 1
+
+
+def test_pacs_max_associations_overrides_the_default(make_pool):
+    pool = make_pool(max_per_pacs=1)
+    pacs = dict(PACS, max_associations=2)
+    with pool.acquire(pacs) as first, pool.acquire(pacs) as second:
+        assert first is not None and second is not None and first is not second
+
+
+def test_unhealthy_idle_association_is_replaced(make_pool):
+    pool = make_pool(health_check_interval=0)
+    with pool.acquire(PACS):
+        pass
+    pool.created[0].echo_status = 0x0110
+    with pool.acquire(PACS) as assoc:
+        assert assoc is pool.created[1]
+    assert pool.created[0].released
+    assert pool.stats()["pacs"]["ARCHIVO CENTRAL@127.0.0.1:104"]["open"] == 1
+
+
+def test_evict_idle_closes_expired_associations(make_pool):
+    pool = make_pool()
+    with pool.acquire(PACS):
+        pass
+    assert pool.evict_idle(max_idle=3600) == 0
+    assert pool.evict_idle(max_idle=0) == 1
+    assert pool.created[0].released
+    assert pool.stats()["pacs"]["ARCHIVO CENTRAL@127.0.0.1:104"]["open"] == 0
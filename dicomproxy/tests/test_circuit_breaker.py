@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from implementation.dicom_services import circuit_breaker
+from implementation.dicom_services.circuit_breaker import CircuitBreakers, CLOSED, OPEN, HALF_OPEN
+from conftest import make_pacs
+
+PACS = make_pacs("Archivo")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_opens_after_consecutive_failures(clock):
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=30)
+    breakers.record_failure(PACS, "timeout")
+    assert breakers.state_of(PACS)["state"] == CLOSED
+    breakers.record_failure(PACS, "timeout")
+    assert breakers.state_of(PACS)["state"] == OPEN
+    assert not breakers.acquire(PACS)
+    assert breakers.state_of(PACS)["rejected"] == 1
+
+
+def test_half_open_trial_closes_the_circuit(clock):
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=30)
+    breakers.record_failure(PACS, "timeout")
+    clock.value += 29
+    assert not breakers.available(PACS)
+    clock.value += 1
+    assert breakers.available(PACS)
+    assert breakers.acquire(PACS)
+    assert breakers.state_of(PACS)["state"] == HALF_OPEN
+    # Solo pasa la búsqueda de prueba
+    assert not breakers.acquire(PACS)
+    breakers.record_success(PACS)
+    assert breakers.state_of(PACS)["state"] == CLOSED
+    assert breakers.acquire(PACS)
+
+
+def test_failed_trial_reopens_the_circuit(clock):
+    breakers = CircuitBreakers(failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        breakers.record_failure(PACS, "timeout")
+    clock.value += 30
+    assert breakers.acquire(PACS)
+    breakers.record_failure(PACS, "timeout")
+    state = breakers.state_of(PACS)
+    assert state["state"] == OPEN and state["times_opened"] == 2
+    assert not breakers.acquire(PACS)
+
+
+def test_trial_without_verdict_lets_another_trial_through(clock):
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=30)
+    breakers.record_failure(PACS, "timeout")
+    clock.value += 30
+    assert breakers.acquire(PACS)
+    breakers.release(PACS)
+    assert breakers.acquire(PACS)
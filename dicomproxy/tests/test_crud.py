@@ -0,0 +1,59 @@
+import pytest
+
+from implementation import crud, database
+
+
+@pytest.fixture
+def config(database_file):
+    crud.reload_config()
+    yield
+    crud.reload_config()
+
+
+def _add(description: str, port: int = 104):
+    crud.add_pacs_config(description, description.upper(), "127.0.0.1", port)
+    return next(pacs for pacs in crud.get_all_pacs() if pacs['description'] == description)
+
+
+def test_only_the_first_pacs_starts_active(config):
+    first, second = _add("Archivo central"), _add("Urgencias", 105)
+    assert first['is_active'] == 1 and second['is_active'] == 0
+    assert [pacs['id'] for pacs in crud.get_active_pacs()] == [first['id']]
+
+
+def test_toggle_flips_state_and_publishes_snapshot(config):
+    pacs = _add("Archivo central")
+    version = crud.get_config_snapshot().version
+    assert crud.toggle_pacs_active(pacs['id']) == 0
+    assert crud.get_active_pacs() == []
+    assert crud.toggle_pacs_active(str(pacs['id'])) == 1
+    assert crud.get_config_snapshot().version == version + 2 == crud.stored_config_version()
+
+
+@pytest.mark.parametrize("pacs_id", [None, "", "abc", 999])
+def test_missing_or_invalid_id_is_not_found(config, pacs_id):
+    _add("Archivo central")
+    assert crud.get_pacs(pacs_id) is None
+    assert crud.toggle_pacs_active(pacs_id) is None
+    assert crud.delete_pacs_config(pacs_id) is False
+    assert len(crud.get_all_pacs()) == 1
+
+
+def test_delete_pacs(config):
+    pacs = _add("Archivo central")
+    assert crud.delete_pacs_config(str(pacs['id']))
+    assert crud.get_all_pacs() == []
+
+
+def test_watcher_reloads_changes_from_another_process(config):
+    pacs = _add("Archivo central")
+    # Otro proceso desactiva el PACS directamente en la BD y sube la versión
+    with database.connection() as conn:
+        conn.execute("UPDATE pacs_configs SET is_active = 0 WHERE id = ?", (pacs['id'],))
+        conn.execute("UPDATE proxy_config SET value = CAST(value AS INTEGER) + 1 WHERE key = ?", (crud.CONFIG_VERSION_KEY,))
+        conn.commit()
+    assert crud.get_active_pacs() != []
+    watcher = crud.ConfigWatcher()
+    assert watcher.check() and watcher.reloads == 1
+    assert crud.get_active_pacs() == []
+    assert not watcher.check()
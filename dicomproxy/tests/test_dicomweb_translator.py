@@ -0,0 +1,80 @@
+import json
+
+from pydicom import dcmread
+from pydicom.data import get_testdata_file
+from pydicom.dataelem import DataElement, RawDataElement
+from pydicom.dataset import Dataset
+
+from implementation.dicom_services import ipc
+from implementation.dicom_services.dicomweb_translator import (
+    BULKDATA_THRESHOLD, dataset_to_dicomweb_dict, result_to_json_bytes,
+)
+
+
+def _identifier(**elements) -> Dataset:
+    """Identificador tal como llega por IPC (o de una respuesta C-FIND): elementos sin convertir."""
+    ds = Dataset()
+    ds.SpecificCharacterSet = "ISO_IR 192"
+    ds.StudyInstanceUID = "1.2.3"
+    for keyword, value in elements.items():
+        setattr(ds, keyword, value)
+    decoded = ipc.decode_dataset(ipc.encode_dataset(ds))
+    assert all(isinstance(decoded.get_item(tag), RawDataElement) for tag in decoded.keys() if decoded.get_item(tag).value)
+    return decoded
+
+
+def test_raw_binary_numbers():
+    ds = _identifier(SimpleFrameList=[1, 4294967295], ReferencePixelX0=-7, DiffusionBValue=[0.5, 1000.0],
+                     SelectorUVValue=[2 ** 63 + 1], SelectorSVValue=[-(2 ** 40)])
+    result = dataset_to_dicomweb_dict(ds)
+    assert result["00081161"] == {"vr": "UL", "Value": [1, 4294967295]}
+    assert result["00186020"] == {"vr": "SL", "Value": [-7]}
+    assert result["00189087"] == {"vr": "FD", "Value": [0.5, 1000.0]}
+    # Los enteros de 64 bits fuera del rango exacto de un double van como cadenas (PS3.18 F.2.3.1)
+    assert result["00720083"] == {"vr": "UV", "Value": [str(2 ** 63 + 1)]}
+    assert result["00720082"] == {"vr": "SV", "Value": [-(2 ** 40)]}
+
+
+def test_raw_attribute_tags():
+    ds = _identifier(FrameIncrementPointer=[0x00181063, 0x00186060])
+    assert dataset_to_dicomweb_dict(ds)["00280009"] == {"vr": "AT", "Value": ["00181063", "00186060"]}
+
+
+def test_raw_strings_and_person_names():
+    ds = _identifier(PatientName="García^Ana", ModalitiesInStudy=["CT", "MR"], StudyDescription="")
+    result = dataset_to_dicomweb_dict(ds)
+    assert result["00100010"] == {"vr": "PN", "Value": [{"Alphabetic": "García^Ana"}]}
+    assert result["00080061"] == {"vr": "CS", "Value": ["CT", "MR"]}
+    assert result["00081030"] == {"vr": "LO"}
+
+
+def test_whole_file_translates():
+    ds = dcmread(get_testdata_file("CT_small.dcm"))
+    result = json.loads(result_to_json_bytes(ds))
+    assert result["00280010"] == {"vr": "US", "Value": [128]}
+    assert result["00200032"]["vr"] == "DS" and len(result["00200032"]["Value"]) == 3
+    pixel_data = result["7FE00010"]
+    assert pixel_data["BulkDataURI"] == (f"/studies/{ds.StudyInstanceUID}/series/{ds.SeriesInstanceUID}"
+                                         f"/instances/{ds.SOPInstanceUID}/bulkdata/7FE00010")
+
+
+def test_binary_values_are_never_dropped():
+    ds = Dataset()
+    ds.add(DataElement(0x00091010, "OB", b"x" * (BULKDATA_THRESHOLD + 1)))
+    item = Dataset()
+    item.add(DataElement(0x00091011, "OB", b"y" * (BULKDATA_THRESHOLD + 1)))
+    ds.add(DataElement(0x00091020, "SQ", [item]))
+    result = json.loads(result_to_json_bytes(ds))
+    # Sin los UID de la instancia no hay BulkDataURI posible: el valor va en línea
+    assert "InlineBinary" in result["00091010"]
+    assert "InlineBinary" in result["00091020"]["Value"][0]["00091011"]
+
+
+def test_ambiguous_vr_is_resolved():
+    ds = Dataset()
+    ds.PixelRepresentation = 1
+    ds.add(DataElement(0x00280106, "US or SS", b"\xff\xff"))
+    ds.add(DataElement(0x00281201, "OB or OW", b"\x00\x01" * 4))
+    result = dataset_to_dicomweb_dict(ds)
+    assert result["00280106"] == {"vr": "SS", "Value": [-1]}
+    assert result["00281201"]["vr"] in ("OB", "OW") and "InlineBinary" in result["00281201"]
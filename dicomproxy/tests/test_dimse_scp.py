@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+from implementation.config.settings import settings
+from implementation.dicom_services.dimse_scp import RetrieveRequest
+
+
+class _Instance:
+    def __init__(self, index: int):
+        self.index = index
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+def test_full_buffer_holds_the_association_until_consumed(monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVE_BUFFER", 2)
+
+    async def run():
+        request = RetrieveRequest(asyncio.get_running_loop(), 1, "1.2.3")
+        delivered = []
+
+        def association():
+            for index in range(5):
+                delivered.append(request.deliver(_Instance(index)))
+            request.finish()
+
+        thread = threading.Thread(target=association)
+        thread.start()
+        await asyncio.sleep(0.3)
+        # Solo caben RETRIEVE_BUFFER instancias sin consumir: la tercera espera hueco
+        assert len(delivered) == 2
+        received = []
+        while (item := await request.get()) is not None:
+            received.append(item.index)
+        thread.join(1)
+        return delivered, received
+
+    delivered, received = asyncio.run(run())
+    assert delivered == [True] * 5
+    assert received == [0, 1, 2, 3, 4]
+
+
+def test_close_releases_pending_and_unblocks_the_association(monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVE_BUFFER", 1)
+
+    async def run():
+        request = RetrieveRequest(asyncio.get_running_loop(), 1, "1.2.3")
+        pending, late = _Instance(0), _Instance(1)
+        result = []
+        thread = threading.Thread(target=lambda: result.extend([request.deliver(pending), request.deliver(late)]))
+        thread.start()
+        await asyncio.sleep(0.3)
+        request.close()
+        await asyncio.to_thread(thread.join, 2)
+        return pending, late, result, thread.is_alive()
+
+    pending, late, result, alive = asyncio.run(run())
+    assert not alive
+    assert result == [True, False]
+    assert pending.released and late.released
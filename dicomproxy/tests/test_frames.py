@@ -0,0 +1,88 @@
+import io
+
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate, encapsulate_extended
+from pydicom.filewriter import dcmwrite
+from pydicom.uid import ExplicitVRLittleEndian, JPEGBaseline8Bit, SecondaryCaptureImageStorage
+
+from implementation.dicom_services import frames
+from implementation.dicom_services.spool import SpooledInstance
+
+FRAMES = [bytes([index]) * (100 + 10 * index) for index in range(1, 5)]
+
+
+def _instance(pixel_data: bytes, **elements) -> SpooledInstance:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = JPEGBaseline8Bit
+    ds.SOPClassUID = SecondaryCaptureImageStorage
+    ds.SOPInstanceUID = "1.2.3.4"
+    ds.Rows, ds.Columns, ds.BitsAllocated, ds.SamplesPerPixel = 8, 8, 8, 1
+    ds.NumberOfFrames = len(FRAMES)
+    for keyword, value in elements.items():
+        setattr(ds, keyword, value)
+    ds.PixelData = pixel_data
+    ds["PixelData"].VR = "OB"
+    buffer = io.BytesIO()
+    dcmwrite(buffer, ds, enforce_file_format=True)
+    data = buffer.getvalue()
+    return SpooledInstance("1.2.3.4", SecondaryCaptureImageStorage, "1.2", "1.2.3", JPEGBaseline8Bit, len(data), data=data)
+
+
+def test_basic_offset_table_groups_fragments():
+    instance = _instance(encapsulate(FRAMES, fragments_per_frame=2, has_bot=True))
+    media_type, transfer_syntax, result = frames.read_frames(instance, [1, 3, 4])
+    assert media_type == "image/jpeg" and transfer_syntax == JPEGBaseline8Bit
+    assert result == [FRAMES[0], FRAMES[2], FRAMES[3]]
+
+
+def test_without_basic_offset_table_one_fragment_per_frame():
+    instance = _instance(encapsulate(FRAMES, has_bot=False))
+    assert frames.read_frames(instance, [2, 4])[2] == [FRAMES[1], FRAMES[3]]
+
+
+def test_without_basic_offset_table_several_fragments_per_frame_is_rejected():
+    instance = _instance(encapsulate(FRAMES, fragments_per_frame=2, has_bot=False))
+    with pytest.raises(frames.FrameError):
+        frames.read_frames(instance, [1])
+
+
+def test_extended_offset_table(monkeypatch):
+    pixel_data, offsets, lengths = encapsulate_extended(FRAMES)
+    instance = _instance(pixel_data, ExtendedOffsetTable=offsets, ExtendedOffsetTableLengths=lengths)
+
+    def walk_fragments(*args):
+        raise AssertionError("con tabla extendida no se recorren los fragmentos")
+    monkeypatch.setattr(frames, "_fragments", walk_fragments)
+    assert frames.read_frames(instance, [4, 1])[2] == [FRAMES[3], FRAMES[0]]
+
+
+def test_missing_frame():
+    instance = _instance(encapsulate(FRAMES, has_bot=True))
+    with pytest.raises(frames.FrameNotFound):
+        frames.read_frames(instance, [5])
+
+
+def test_native_frames_from_a_stored_file(tmp_path):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = SecondaryCaptureImageStorage
+    ds.SOPInstanceUID = "1.2.3.5"
+    ds.Rows, ds.Columns, ds.BitsAllocated, ds.SamplesPerPixel = 2, 3, 16, 1
+    ds.NumberOfFrames = 3
+    ds.PixelData = b"".join(bytes([index]) * 12 for index in range(1, 4))
+    path = tmp_path / "native.dcm"
+    dcmwrite(path, ds, enforce_file_format=True)
+    instance = SpooledInstance("1.2.3.5", SecondaryCaptureImageStorage, "1.2", "1.2.3", ExplicitVRLittleEndian,
+                               path.stat().st_size, path=path, owned=False)
+    media_type, transfer_syntax, result = frames.read_frames(instance, [3, 1])
+    assert media_type == "application/octet-stream" and transfer_syntax == ExplicitVRLittleEndian
+    assert result == [b"\3" * 12, b"\1" * 12]
+
+
+@pytest.mark.parametrize("frame_list", ["", "1,a", "0", "2,-1"])
+def test_invalid_frame_list(frame_list):
+    with pytest.raises(frames.FrameError):
+        frames.parse_frame_list(frame_list)
@@ -0,0 +1,93 @@
+import gc
+
+import pytest
+
+from implementation import database
+from implementation.dicom_services.instance_store import InstanceStore
+from implementation.dicom_services.spool import SpooledInstance
+
+SIZE = 1000
+
+
+@pytest.fixture
+def store(database_file, tmp_path):
+    def make(policy="lru", max_bytes=2500):
+        return InstanceStore(tmp_path / "store", max_bytes=max_bytes, policy=policy)
+    return make
+
+
+@pytest.fixture
+def received(tmp_path):
+    """Instancia recién recibida en un archivo de spool."""
+    spool = tmp_path / "spool"
+    spool.mkdir()
+
+    def make(index: int) -> SpooledInstance:
+        path = spool / f"{index}.dcm"
+        path.write_bytes(b"\0" * SIZE)
+        return SpooledInstance(f"1.2.{index}", "1.2.840.10008.5.1.4.1.1.7", "1.2", "1.2.1",
+                               "1.2.840.10008.1.2.1", SIZE, path=path)
+    return make
+
+
+def _pins() -> dict:
+    with database.connection() as conn:
+        return {row['sop_instance_uid']: row['pins'] for row in conn.execute("SELECT sop_instance_uid, pins FROM instance_cache")}
+
+
+@pytest.mark.parametrize("policy", ["lru", "lfu"])
+def test_evict_skips_instances_still_being_served(store, received, policy):
+    instance_store = store(policy)
+    handles = [instance_store.put(received(index)) for index in range(5)]
+    # Por encima del presupuesto, pero nadie ha leído aún las instancias: no se expulsa ninguna
+    assert all(handle.path.exists() for handle in handles)
+    assert instance_store.evictions == 0
+
+    for handle in handles[:3]:
+        handle.release()
+    instance_store.put(received(5)).release()
+    assert [handle.path.exists() for handle in handles] == [False, False, False, True, True]
+    assert instance_store.stats()["bytes"] <= 2500 + SIZE
+
+
+def test_lookup_pins_until_release(store, received):
+    instance_store = store(max_bytes=1500)
+    instance_store.put(received(0)).release()
+    cached = instance_store.get_many(["1.2.0"])
+    assert _pins() == {"1.2.0": 1}
+
+    instance_store.put(received(1)).release()
+    assert cached[0].path.exists()
+    cached[0].release()
+    assert _pins()["1.2.0"] == 0
+    instance_store.put(received(2)).release()
+    assert not cached[0].path.exists()
+
+
+def test_dropped_handle_unpins(store, received):
+    instance_store = store()
+    instance_store.put(received(0))
+    gc.collect()
+    assert _pins() == {"1.2.0": 0}
+
+
+def test_reset_pins(store, received):
+    instance_store = store()
+    handle = instance_store.put(received(0))
+    instance_store.reset_pins()
+    assert _pins() == {"1.2.0": 0}
+    handle.release()
+    assert _pins() == {"1.2.0": 0}
+
+
+def test_in_memory_instance_is_served_from_the_store(store):
+    instance_store = store()
+    instance = SpooledInstance("1.2.9", "1.2.840.10008.5.1.4.1.1.7", "1.2", "1.2.1",
+                               "1.2.840.10008.1.2.1", SIZE, data=b"\1" * SIZE)
+    handle = instance_store.put(instance)
+    # La copia en memoria se suelta: se sirve el archivo del almacén, fijado como los demás
+    assert instance.data is None
+    assert not handle.in_memory and handle.path.read_bytes() == b"\1" * SIZE
+    assert _pins() == {"1.2.9": 1}
+    handle.release()
+    assert _pins() == {"1.2.9": 0}
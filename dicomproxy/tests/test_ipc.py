@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from pydicom.dataelem import RawDataElement
+from pydicom.dataset import Dataset
+from pynetdicom.dsutils import encode
+
+from implementation.dicom_services import ipc
+
+
+def _reader(data: bytes, eof: bool = True) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+def _read_frame(data: bytes, eof: bool = True):
+    async def run():
+        return await ipc.read_frame(_reader(data, eof))
+    return asyncio.run(run())
+
+
+class _Writer:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def test_frames_round_trip():
+    async def run():
+        writer = _Writer()
+        await ipc.write_frame(writer, {"op": "retrieve", "descripción": "Archivo"}, b"\x00\x01DICM")
+        await ipc.write_frame(writer, {"op": "end"})
+        reader = _reader(bytes(writer.data))
+        return [await ipc.read_frame(reader) for _ in range(3)]
+
+    first, second, closed = asyncio.run(run())
+    assert first == ({"op": "retrieve", "descripción": "Archivo"}, b"\x00\x01DICM")
+    assert second == ({"op": "end"}, b"")
+    assert closed == (None, b"")
+
+
+def test_pack_frame_matches_write_frame():
+    async def run():
+        writer = _Writer()
+        await ipc.write_frame(writer, {"n": 1}, b"abc")
+        return bytes(writer.data)
+    assert asyncio.run(run()) == ipc.pack_frame({"n": 1}, b"abc")
+
+
+@pytest.mark.parametrize("cut", [3, 10])
+def test_connection_closed_mid_frame(cut):
+    frame = ipc.pack_frame({"op": "find"}, b"payload")
+    with pytest.raises(ipc.IPCError):
+        _read_frame(frame[:cut])
+
+
+def test_oversized_header_is_rejected():
+    prefix = ipc._PREFIX.pack(ipc.MAX_HEADER_BYTES + 1, 0)
+    with pytest.raises(ipc.IPCError):
+        _read_frame(prefix, eof=False)
+
+
+def _identifier() -> Dataset:
+    ds = Dataset()
+    ds.SpecificCharacterSet = "ISO_IR 100"
+    ds.QueryRetrieveLevel = "STUDY"
+    ds.PatientName = "Muñoz^José"
+    ds.StudyInstanceUID = "1.2.3"
+    ds.NumberOfStudyRelatedInstances = "12"
+    item = Dataset()
+    item.CodeValue = "CT"
+    ds.ProcedureCodeSequence = [item]
+    return ds
+
+
+def test_undecoded_elements_are_copied_byte_for_byte():
+    data = encode(_identifier(), True, True)
+    decoded = ipc.decode_dataset(data)
+    assert isinstance(decoded.get_item(0x00100010), RawDataElement)
+    assert ipc.encode_dataset(decoded) == data
+
+
+def test_converted_elements_are_encoded():
+    decoded = ipc.decode_dataset(encode(_identifier(), True, True))
+    decoded.PatientName = "Núñez^Ana"
+    decoded.add_new(0x00080000, "UL", 0)  # las longitudes de grupo no se copian
+    result = ipc.decode_dataset(ipc.encode_dataset(decoded))
+    assert str(result.PatientName) == "Núñez^Ana"
+    assert result.StudyInstanceUID == "1.2.3"
+    assert result.ProcedureCodeSequence[0].CodeValue == "CT"
+    assert 0x00080000 not in result
@@ -0,0 +1,100 @@
+import gzip
+
+import pytest
+
+from implementation.logviewer.indexer import LogIndexer
+
+ACTIVE = "DicomProxy_Actual.log"
+
+
+def _line(number: int, level: str = "INFO", message: str = None) -> str:
+    return (f"2024-05-01 10:{number // 60 % 60:02d}:{number % 60:02d}.000 | {level:<8} | "
+            f"modulo:funcion:{number} - {message or f'mensaje número {number}'}\n")
+
+
+@pytest.fixture
+def logs(tmp_path):
+    directory = tmp_path / "logs"
+    directory.mkdir()
+    indexer = LogIndexer(tmp_path / "log_index.db", logs_dir=directory)
+    indexer.initialize()
+    return directory, indexer
+
+
+def _messages(page) -> list:
+    return [str(entry["message"]) for entry in page["entries"]]
+
+
+def test_active_log_is_indexed_incrementally(logs):
+    directory, indexer = logs
+    active = directory / ACTIVE
+    active.write_text(_line(1) + _line(2) + _line(3)[:20])
+    indexer.scan()
+    assert indexer.stats()["entries"] == 2
+
+    with open(active, "a") as f:
+        f.write(_line(3)[20:] + _line(4))
+    indexer.scan()
+    indexer.scan()
+    page = indexer.search(limit=10)
+    assert _messages(page) == [f"mensaje número {number}" for number in (4, 3, 2, 1)]
+    entry = page["entries"][0]
+    assert (entry["file"], entry["location"], entry["level"]) == (ACTIVE, "modulo:funcion:4", "INFO")
+    assert active.read_bytes()[entry["offset"]:entry["end"]] == _line(4).encode()
+
+
+def test_search_filters_and_highlights(logs):
+    directory, indexer = logs
+    (directory / ACTIVE).write_text(
+        _line(1, "ERROR", "C-FIND fallido en Archivo central")
+        + _line(2, "INFO", "C-FIND correcto en archivo <secundario>")
+        + _line(3, "ERROR", "[trace=abc123] C-MOVE fallido")
+        + _line(120, "ERROR", "C-FIND fallido más tarde"))
+    indexer.scan()
+
+    assert _messages(indexer.search("archivo")) == ["C-FIND correcto en <mark>archivo</mark> &lt;secundario&gt;",
+                                                     "C-FIND fallido en <mark>Archivo</mark> central"]
+    assert len(indexer.search("c-find fallido", level="error")["entries"]) == 2
+    assert len(indexer.search(until="2024-05-01 10:01")["entries"]) == 3
+    assert len(indexer.search(since="2024-05-01 10:02")["entries"]) == 1
+    assert [entry["location"] for entry in indexer.search(trace="abc123")["entries"]] == ["modulo:funcion:3"]
+    # Las comillas y operadores del usuario no rompen la consulta FTS5
+    assert indexer.search('"fallido OR" AND')["entries"] == []
+
+
+def test_pages_follow_id_cursors(logs):
+    directory, indexer = logs
+    (directory / ACTIVE).write_text("".join(_line(number) for number in range(1, 26)))
+    indexer.scan()
+    first = indexer.search(limit=10)
+    second = indexer.search(limit=10, before=first["older_cursor"])
+    third = indexer.search(limit=10, before=second["older_cursor"])
+    assert [len(page["entries"]) for page in (first, second, third)] == [10, 10, 5]
+    assert third["older_cursor"] is None and first["newer_cursor"] is None
+    assert indexer.search(limit=10, after=second["newer_cursor"])["entries"] == first["entries"]
+
+
+def test_rotated_and_compressed_log_is_not_indexed_again(logs):
+    directory, indexer = logs
+    active = directory / ACTIVE
+    # Más de 4 KB: la huella del contenido reconoce el log ya comprimido
+    active.write_text("".join(_line(number) for number in range(1, 101)))
+    indexer.scan()
+
+    rotated = directory / "DicomProxy_2024-05-01.log"
+    active.rename(rotated)
+    active.write_text(_line(500))
+    indexer.scan()
+    assert indexer.stats()["entries"] == 101
+
+    with gzip.open(directory / "DicomProxy_2024-05-01.log.gz", "wb") as f:
+        f.write(rotated.read_bytes())
+    rotated.unlink()
+    indexer.scan()
+    stats = indexer.stats()
+    assert stats["entries"] == 101 and stats["archived_sources"] == 1
+    assert {entry["file"] for entry in indexer.search("mensaje", limit=1000)["entries"]} == {ACTIVE, "DicomProxy_2024-05-01.log.gz"}
+
+    (directory / "DicomProxy_2024-05-01.log.gz").unlink()
+    indexer.scan()
+    assert indexer.stats()["entries"] == 1
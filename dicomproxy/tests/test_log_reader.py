@@ -0,0 +1,81 @@
+import gzip
+
+import pytest
+
+from implementation.logviewer import reader
+from implementation.logviewer.reader import LogFilter
+
+
+def _line(number: int, level: str = "INFO", message: str = None) -> str:
+    return f"2024-05-01 10:00:{number % 60:02d}.000 | {level:<8} | modulo:funcion:1 - {message or f'mensaje {number}'}\n"
+
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    # Bloques pequeños para que las páginas crucen varios bloques
+    monkeypatch.setattr(reader, "BLOCK_SIZE", 128)
+    path = tmp_path / "DicomProxy_Actual.log"
+    path.write_text("".join(_line(number, "ERROR" if number % 10 == 0 else "INFO") for number in range(1, 101)))
+    return path
+
+
+def _numbers(page) -> list:
+    return [int(str(entry["message"]).rsplit(" ", 1)[1]) for entry in page["entries"]]
+
+
+def test_pages_from_the_end_and_back_with_cursors(log_file):
+    page = reader.read_page(log_file, LogFilter(), limit=30)
+    assert _numbers(page) == list(range(100, 70, -1))
+    assert page["newer_cursor"] is None
+
+    older = reader.read_page(log_file, LogFilter(), limit=30, before=page["older_cursor"])
+    assert _numbers(older) == list(range(70, 40, -1))
+
+    newer = reader.read_page(log_file, LogFilter(), limit=30, after=older["newer_cursor"])
+    assert _numbers(newer) == list(range(100, 70, -1))
+    assert newer["newer_cursor"] is None
+
+
+def test_last_page_has_no_older_cursor(log_file):
+    page = reader.read_page(log_file, LogFilter(), limit=50, before=reader.read_page(log_file, LogFilter(), limit=60)["older_cursor"])
+    assert _numbers(page) == list(range(40, 0, -1))
+    assert page["older_cursor"] is None
+
+
+def test_level_filter_reads_until_the_page_is_full(log_file):
+    page = reader.read_page(log_file, LogFilter(level="error"), limit=3)
+    assert _numbers(page) == [100, 90, 80]
+    assert all(entry["level"] == "ERROR" for entry in page["entries"])
+
+
+def test_line_being_written_is_not_shown(log_file):
+    with open(log_file, "a") as f:
+        f.write(_line(101)[:30])
+    page = reader.read_page(log_file, LogFilter(), limit=1)
+    assert _numbers(page) == [100]
+
+
+def test_search_highlights_and_escapes(tmp_path):
+    path = tmp_path / "x.log"
+    path.write_text(_line(1, message="C-FIND <b>Archivo</b> archivo") + _line(2, message="otro"))
+    page = reader.read_page(path, LogFilter(search="archivo"), limit=10)
+    assert [str(entry["message"]) for entry in page["entries"]] == [
+        "modulo:funcion:1 - C-FIND &lt;b&gt;<mark>Archivo</mark>&lt;/b&gt; <mark>archivo</mark>"]
+
+
+def test_trace_filter(tmp_path):
+    path = tmp_path / "x.log"
+    path.write_text(_line(1, message="[trace=abc] C-FIND") + _line(2, message="[trace=def] C-MOVE"))
+    page = reader.read_page(path, LogFilter(trace="abc"), limit=10)
+    assert [str(entry["message"]) for entry in page["entries"]] == ["modulo:funcion:1 - [trace=abc] C-FIND"]
+
+
+def test_archived_log_is_uncompressed_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(reader, "LOGS_DIR", tmp_path)
+    monkeypatch.setattr(reader, "ARCHIVE_CACHE_DIR", tmp_path / ".viewer_cache")
+    with gzip.open(tmp_path / "DicomProxy_2024-05-01.log.gz", "wt") as f:
+        f.write(_line(1) + _line(2))
+    path = reader.readable_path("DicomProxy_2024-05-01.log.gz")
+    assert reader.readable_path("DicomProxy_2024-05-01.log.gz") == path
+    assert _numbers(reader.read_page(path, LogFilter())) == [2, 1]
+    assert reader.list_log_files() == ["DicomProxy_2024-05-01.log.gz"]
@@ -0,0 +1,99 @@
+import asyncio
+
+from implementation.logviewer.reader import LogFilter
+from implementation.logviewer.tail import LogTailer, TailSubscription
+
+
+def _line(number: int, level: str = "INFO") -> str:
+    return f"2024-05-01 10:00:{number % 60:02d}.000 | {level:<8} | modulo:funcion:1 - mensaje {number}\n"
+
+
+def _append(path, text: str):
+    with open(path, "a") as f:
+        f.write(text)
+
+
+async def _collect(subscription: TailSubscription, count: int) -> list:
+    items = []
+    while len(items) < count:
+        batch, _ = await subscription.next_batch(timeout=2)
+        assert batch, "sin novedades del log en vivo"
+        items += batch
+    return items
+
+
+def test_only_new_complete_lines_are_streamed(tmp_path):
+    path = tmp_path / "DicomProxy_Actual.log"
+    path.write_text(_line(1))
+
+    async def run():
+        tailer = LogTailer(path=path, interval=0.02)
+        subscription = tailer.subscribe()
+        await asyncio.sleep(0.1)
+        _append(path, _line(2) + _line(3)[:15])
+        first = await _collect(subscription, 1)
+        _append(path, _line(3)[15:])
+        second = await _collect(subscription, 1)
+        tailer.unsubscribe(subscription)
+        return first, second, tailer.stats()
+
+    first, second, stats = asyncio.run(run())
+    assert [entry["message"] for entry in first + second] == ["modulo:funcion:1 - mensaje 2", "modulo:funcion:1 - mensaje 3"]
+    assert isinstance(first[0]["message"], str)
+    assert stats["clients"] == 0 and not stats["running"]
+
+
+def test_each_client_gets_its_own_filter(tmp_path):
+    path = tmp_path / "DicomProxy_Actual.log"
+    path.write_text("")
+
+    async def run():
+        tailer = LogTailer(path=path, interval=0.02)
+        everything, errors = tailer.subscribe(), tailer.subscribe(level="ERROR")
+        await asyncio.sleep(0.1)
+        _append(path, _line(1) + _line(2, "ERROR") + _line(3))
+        result = await _collect(everything, 3), await _collect(errors, 1)
+        tailer.unsubscribe(everything)
+        tailer.unsubscribe(errors)
+        return result
+
+    everything, errors = asyncio.run(run())
+    assert len(everything) == 3
+    assert [entry["level"] for entry in errors] == ["ERROR"]
+
+
+def test_rotation_is_announced_and_the_new_file_followed(tmp_path):
+    path = tmp_path / "DicomProxy_Actual.log"
+    path.write_text(_line(1))
+
+    async def run():
+        tailer = LogTailer(path=path, interval=0.02)
+        subscription = tailer.subscribe()
+        await asyncio.sleep(0.1)
+        # Lo último del archivo antiguo, la rotación y el archivo nuevo desde el principio
+        _append(path, _line(2))
+        path.rename(tmp_path / "DicomProxy_2024-05-01.log")
+        path.write_text(_line(3))
+        items = await _collect(subscription, 3)
+        tailer.unsubscribe(subscription)
+        return items, tailer.rotations
+
+    items, rotations = asyncio.run(run())
+    assert [item.get("type") or item["message"][-9:] for item in items] == ["mensaje 2", "rotated", "mensaje 3"]
+    assert rotations == 1
+
+
+def test_slow_client_loses_the_oldest_entries():
+    async def run():
+        subscription = TailSubscription(LogFilter(), max_buffer=3, batch_size=10)
+        for number in range(5):
+            subscription.push({"message": f"mensaje {number}"})
+        subscription.notify({"type": "rotated"})
+        batch, dropped = await subscription.next_batch(timeout=1)
+        empty = await subscription.next_batch(timeout=0.01)
+        return batch, dropped, empty
+
+    batch, dropped, empty = asyncio.run(run())
+    assert [item.get("message", item.get("type")) for item in batch] == ["mensaje 2", "mensaje 3", "mensaje 4", "rotated"]
+    assert dropped == 2
+    assert empty == ([], 0)
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+from pydicom.dataset import Dataset
+
+from implementation.dicom_services import dimse_scu
+from implementation.dicom_services.circuit_breaker import circuit_breakers
+from implementation.dicom_services.query_cache import QueryCache
+from implementation.dicom_services.query_engine import QueryOutcome, query_engine
+from conftest import make_pacs
+
+PACS = make_pacs("Archivo central", port=11104)
+
+
+def _query(patient_id: str = "123") -> Dataset:
+    ds = Dataset()
+    ds.QueryRetrieveLevel = "STUDY"
+    ds.PatientID = patient_id
+    ds.StudyInstanceUID = ""
+    return ds
+
+
+def _result(index: int) -> Dataset:
+    ds = Dataset()
+    ds.StudyInstanceUID = f"1.2.{index}"
+    return ds
+
+
+@pytest.fixture(autouse=True)
+def one_pacs(monkeypatch):
+    monkeypatch.setattr(dimse_scu, "partition_pacs", lambda: ([PACS], []))
+    circuit_breakers._breakers.clear()
+    yield
+    circuit_breakers._breakers.clear()
+
+
+def _collect(cache: QueryCache, query: Dataset):
+    async def run():
+        outcome = QueryOutcome()
+        results = [identifier async for _, identifier in cache.stream_query(query, outcome=outcome)]
+        return results, outcome
+    return asyncio.run(run())
+
+
+def test_complete_answer_is_cached(monkeypatch):
+    def c_find(pacs, query, timeout=None, call=None, client=None):
+        yield from (_result(index) for index in range(3))
+    monkeypatch.setattr(dimse_scu, "iter_c_find", c_find)
+    cache = QueryCache(ttl=60, max_results=1000, max_entry_results=1000)
+
+    results, outcome = _collect(cache, _query())
+    assert len(results) == 3
+    assert outcome.completed == [PACS['description']] and not outcome.partial
+    assert cache.stats()["entries"] == 1
+
+
+def test_winner_failing_mid_stream_is_partial_and_not_cached(monkeypatch):
+    def c_find(pacs, query, timeout=None, call=None, client=None):
+        yield _result(1)
+        yield _result(2)
+        raise dimse_scu.FindError("asociación perdida")
+    monkeypatch.setattr(dimse_scu, "iter_c_find", c_find)
+    cache = QueryCache(ttl=60, max_results=1000, max_entry_results=1000)
+
+    results, outcome = _collect(cache, _query())
+    assert len(results) == 2
+    assert outcome.partial
+    assert outcome.failed == [PACS['description']] and outcome.completed == []
+    assert cache.stats()["entries"] == 0
+
+
+def test_identical_concurrent_queries_share_one_fan_out(monkeypatch):
+    calls = []
+
+    async def stream_query(query_params, active_pacs=None, outcome=None, **kwargs):
+        calls.append(query_params)
+        for index in range(3):
+            await asyncio.sleep(0.01)
+            yield PACS, _result(index)
+        outcome.completed.append(PACS['description'])
+    monkeypatch.setattr(query_engine, "stream_query", stream_query)
+    cache = QueryCache(ttl=60, max_results=1000, max_entry_results=1000)
+
+    async def run():
+        async def one():
+            return [identifier.StudyInstanceUID async for _, identifier in cache.stream_query(_query())]
+        return await asyncio.gather(one(), one())
+
+    first, second = asyncio.run(run())
+    assert first == second == ["1.2.0", "1.2.1", "1.2.2"]
+    assert len(calls) == 1 and cache.stats()["coalesced"] == 1
+
+
+def test_engine_error_marks_subscribers_partial(monkeypatch):
+    async def stream_query(query_params, active_pacs=None, outcome=None, **kwargs):
+        yield PACS, _result(1)
+        raise RuntimeError("fallo inesperado")
+    monkeypatch.setattr(query_engine, "stream_query", stream_query)
+    cache = QueryCache(ttl=60, max_results=1000, max_entry_results=1000)
+
+    results, outcome = _collect(cache, _query())
+    assert len(results) == 1
+    assert outcome.partial and outcome.failed == [PACS['description']]
+    assert cache.stats()["entries"] == 0
+
+
+def test_query_never_joins_a_cancelled_flight(monkeypatch):
+    async def stream_query(query_params, active_pacs=None, outcome=None, **kwargs):
+        for index in range(3):
+            yield PACS, _result(index)
+            await asyncio.sleep(0)
+        outcome.completed.append(PACS['description'])
+    monkeypatch.setattr(query_engine, "stream_query", stream_query)
+    cache = QueryCache(ttl=60, max_results=1000, max_entry_results=1000)
+
+    async def run():
+        # El único suscriptor se va tras el primer resultado (p. ej. 'limit=1')
+        abandoned = cache.stream_query(_query())
+        await abandoned.__anext__()
+        await abandoned.aclose()
+        # Una búsqueda idéntica justo después no debe unirse al fan-out cancelado
+        outcome = QueryOutcome()
+        results = [identifier async for _, identifier in cache.stream_query(_query(), outcome=outcome)]
+        return results, outcome
+
+    results, outcome = asyncio.run(run())
+    assert len(results) == 3
+    assert not outcome.partial
+    assert cache.stats()["misses"] == 2 and cache.stats()["coalesced"] == 0
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import pytest
+from pydicom.dataset import Dataset
+
+from implementation.config.settings import settings
+from implementation.dicom_services import dimse_scu
+from implementation.dicom_services.circuit_breaker import circuit_breakers
+from implementation.dicom_services.query_engine import QueryOutcome, query_engine
+from conftest import make_pacs
+
+PACS = make_pacs("Archivo central", port=11104)
+
+
+def _query() -> Dataset:
+    ds = Dataset()
+    ds.QueryRetrieveLevel = "STUDY"
+    ds.PatientID = "123"
+    return ds
+
+
+@pytest.fixture(autouse=True)
+def one_pacs(monkeypatch):
+    monkeypatch.setattr(dimse_scu, "partition_pacs", lambda: ([PACS], []))
+    circuit_breakers._breakers.clear()
+    yield
+    circuit_breakers._breakers.clear()
+
+
+def test_slow_consumer_stops_reading_from_pacs(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_STREAM_BUFFER", 5)
+    produced = []
+    finished = threading.Event()
+
+    def c_find(pacs, query, timeout=None, call=None, client=None):
+        try:
+            for index in range(100):
+                ds = Dataset()
+                ds.StudyInstanceUID = f"1.2.{index}"
+                produced.append(index)
+                yield ds
+        finally:
+            finished.set()
+    monkeypatch.setattr(dimse_scu, "iter_c_find", c_find)
+
+    async def run():
+        outcome = QueryOutcome()
+        stream = query_engine.stream_query(_query(), outcome=outcome)
+        await stream.__anext__()
+        await asyncio.sleep(0.5)
+        # El hilo C-FIND queda parado con el búfer lleno en vez de leer la respuesta entera
+        assert len(produced) <= settings.QUERY_STREAM_BUFFER + 2
+        received = 1 + len([item async for item in stream])
+        return received, outcome
+
+    received, outcome = asyncio.run(run())
+    assert received == 100 and len(produced) == 100
+    assert outcome.completed == [PACS['description']]
+    assert finished.wait(1)
+
+
+def test_abandoned_stream_releases_the_waiting_thread(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_STREAM_BUFFER", 2)
+    finished = threading.Event()
+
+    def c_find(pacs, query, timeout=None, call=None, client=None):
+        try:
+            for index in range(100):
+                ds = Dataset()
+                ds.StudyInstanceUID = f"1.2.{index}"
+                yield ds
+        finally:
+            finished.set()
+    monkeypatch.setattr(dimse_scu, "iter_c_find", c_find)
+
+    async def run():
+        stream = query_engine.stream_query(_query())
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert finished.wait(2)
@@ -0,0 +1,107 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.filewriter import dcmwrite
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian
+
+from implementation.dicom_services import rendering
+from implementation.dicom_services.frames import FrameNotFound
+from implementation.dicom_services.rendering import BytesCache, RenderError, RenderNotAcceptable, RenderParams
+from implementation.dicom_services.spool import SpooledInstance
+
+
+def _ct(**elements) -> Dataset:
+    ds = Dataset()
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsStored = 12
+    for keyword, value in elements.items():
+        setattr(ds, keyword, value)
+    return ds
+
+
+def test_params_from_query():
+    params = RenderParams.from_query({"window": "40,400,sigmoid", "viewport": "64,32", "quality": "75"},
+                                     accept="image/webp, image/png;q=0.9")
+    assert params.media_type == "image/png"
+    assert (params.window, params.viewport, params.quality) == ((40.0, 400.0, "sigmoid"), (64, 32), 75)
+    # La calidad solo distingue entradas de la caché en JPEG
+    assert params.key() == ("image/png", (40.0, 400.0, "sigmoid"), (64, 32), None)
+    assert RenderParams.from_query({}, accept="*/*").media_type == "image/jpeg"
+
+
+@pytest.mark.parametrize("query", [{"window": "40"}, {"window": "40,0"}, {"window": "40,400,gamma"},
+                                   {"viewport": "0,10"}, {"quality": "101"}, {"quality": "alta"}])
+def test_invalid_params(query):
+    with pytest.raises(RenderError):
+        RenderParams.from_query(query)
+
+
+def test_unsupported_media_type():
+    with pytest.raises(RenderNotAcceptable):
+        RenderParams.from_query({"accept": "image/gif"})
+
+
+def test_rescale_and_window_are_applied():
+    ds = _ct(RescaleSlope=1, RescaleIntercept=-1024, WindowCenter=40, WindowWidth=400)
+    # Valores almacenados: -1024 + 864 = -160 (bajo la ventana), 1064 = 40 (centro), 1264 = 240 (sobre la ventana)
+    pixels = np.array([[864, 1064, 1264]], dtype=np.uint16)
+    image = rendering.render_pixels(pixels, ds, RenderParams())
+    assert image.dtype == np.uint8
+    assert image[0, 0] == 0 and image[0, 2] == 255 and 126 <= image[0, 1] <= 129
+
+
+def test_monochrome1_is_inverted_and_window_overrides_the_file():
+    ds = _ct(PhotometricInterpretation="MONOCHROME1", WindowCenter=0, WindowWidth=10)
+    pixels = np.array([[0, 100]], dtype=np.uint16)
+    image = rendering.render_pixels(pixels, ds, RenderParams(window=(50.0, 100.0, "linear_exact")))
+    assert image.tolist() == [[255, 0]]
+
+
+def test_viewport_downsamples_by_blocks():
+    pixels = np.arange(16, dtype=np.uint16).reshape(4, 4)
+    image = rendering.render_pixels(pixels, _ct(), RenderParams(viewport=(2, 2)))
+    assert image.shape == (2, 2)
+
+
+def _multiframe_instance(tmp_path) -> SpooledInstance:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = "1.2.3.6"
+    ds.Rows, ds.Columns, ds.NumberOfFrames = 8, 8, 2
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.WindowCenter, ds.WindowWidth = 100, 10
+    frames = np.stack([np.full((8, 8), 0, np.uint16), np.full((8, 8), 4000, np.uint16)])
+    ds.PixelData = frames.tobytes()
+    path = tmp_path / "multiframe.dcm"
+    dcmwrite(path, ds, enforce_file_format=True)
+    return SpooledInstance("1.2.3.6", CTImageStorage, "1.2", "1.2.3", ExplicitVRLittleEndian,
+                           path.stat().st_size, path=path, owned=False)
+
+
+def test_render_instance_decodes_the_requested_frame(tmp_path):
+    instance = _multiframe_instance(tmp_path)
+    first = Image.open(io.BytesIO(rendering.render_instance(instance, 1, RenderParams(media_type="image/png"))))
+    second = Image.open(io.BytesIO(rendering.render_instance(instance, 2, RenderParams(media_type="image/png"))))
+    assert first.format == "PNG" and first.size == (8, 8)
+    assert first.getextrema() == (0, 0) and second.getextrema() == (255, 255)
+    with pytest.raises(FrameNotFound):
+        rendering.render_instance(instance, 3, RenderParams())
+
+
+def test_bytes_cache_evicts_least_recently_used():
+    cache = BytesCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert cache.get("b") is None and cache.get("a") is not None
+    cache.put("grande", b"x" * 11)
+    assert cache.get("grande") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 8, 1)
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from implementation.dicom_services.scheduler import DimseScheduler, Overloaded, dimse_scheduler
+from implementation.routers.dicomweb import dimse_admission
+from conftest import make_pacs
+
+PACS = make_pacs("Archivo central")
+OTHER_PACS = make_pacs("Urgencias", port=105)
+
+
+def _wait_until(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "la condición no se cumplió a tiempo"
+        time.sleep(0.005)
+
+
+def test_free_slots_are_shared_in_turns_between_clients():
+    scheduler = DimseScheduler(max_concurrent=1, max_queue=20, max_queue_per_client=10)
+    order, release = [], threading.Event()
+
+    def operation(client: str, label: str):
+        with scheduler.slot(PACS, client=client, timeout=5):
+            order.append(label)
+            if label == "inicial":
+                release.wait(5)
+
+    threads = [threading.Thread(target=operation, args=("otro", "inicial"))]
+    threads[0].start()
+    _wait_until(lambda: scheduler.stats()["active"] == 1)
+    # Un cliente encola una ráfaga antes de que llegue la petición del segundo
+    for index in range(3):
+        threads.append(threading.Thread(target=operation, args=("ráfaga", f"ráfaga {index}")))
+        threads[-1].start()
+        _wait_until(lambda: scheduler.stats()["waiting"] == index + 1)
+    threads.append(threading.Thread(target=operation, args=("puntual", "puntual")))
+    threads[-1].start()
+    _wait_until(lambda: scheduler.stats()["waiting"] == 4)
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["inicial", "ráfaga 0", "puntual", "ráfaga 1", "ráfaga 2"]
+
+
+def test_per_pacs_limit_does_not_block_other_pacs():
+    scheduler = DimseScheduler(max_concurrent=4, max_queue=10, max_queue_per_client=10)
+    limited = dict(PACS, max_associations=1)
+    with scheduler.slot(limited, client="a"):
+        with pytest.raises(Overloaded):
+            with scheduler.slot(limited, client="a", timeout=0.05):
+                pass
+        with scheduler.slot(OTHER_PACS, client="a", timeout=0.05):
+            assert scheduler.stats()["active"] == 2
+    assert scheduler.stats()["timeouts"] == 1
+
+
+def test_full_queues_are_rejected_immediately():
+    scheduler = DimseScheduler(max_concurrent=1, max_queue=2, max_queue_per_client=1)
+    release = threading.Event()
+
+    def hold(client):
+        with scheduler.slot(PACS, client=client, timeout=5):
+            release.wait(5)
+
+    threads = [threading.Thread(target=hold, args=(client,)) for client in ("a", "b", "c")]
+    for index, thread in enumerate(threads):
+        thread.start()
+        _wait_until(lambda: scheduler.stats()["granted"] + scheduler.stats()["waiting"] == index + 1)
+    with pytest.raises(Overloaded):
+        scheduler.admit("d")  # cola global llena
+    scheduler.max_queue = 10
+    with pytest.raises(Overloaded) as error:
+        scheduler.admit("b")  # cola del cliente llena
+    assert error.value.retry_after >= 1
+    scheduler.admit("d")
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert scheduler.stats()["rejected"] == 2
+
+
+def test_cancelled_operation_leaves_the_queue():
+    scheduler = DimseScheduler(max_concurrent=1, max_queue=10, max_queue_per_client=10)
+    cancelled = threading.Event()
+    errors = []
+
+    def wait_for_slot():
+        try:
+            with scheduler.slot(PACS, client="b", timeout=5, cancelled=cancelled.is_set):
+                pass
+        except Overloaded as e:
+            errors.append(e)
+
+    with scheduler.slot(PACS, client="a"):
+        thread = threading.Thread(target=wait_for_slot)
+        thread.start()
+        _wait_until(lambda: scheduler.stats()["waiting"] == 1)
+        cancelled.set()
+        scheduler.interrupt()
+        thread.join(5)
+    assert len(errors) == 1 and scheduler.stats()["waiting"] == 0
+
+
+def test_admission_answers_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr(dimse_scheduler, "max_queue", 0)
+    request = SimpleNamespace(client=SimpleNamespace(host="10.0.0.7"))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(dimse_admission(request))
+    assert error.value.status_code == 503
+    assert int(error.value.headers["Retry-After"]) >= 1
@@ -0,0 +1,100 @@
+import asyncio
+import io
+
+import numpy as np
+import pytest
+from pydicom import dcmread
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.filewriter import dcmwrite
+from pydicom.uid import (
+    CTImageStorage, ExplicitVRLittleEndian, ImplicitVRLittleEndian, JPEGBaseline8Bit, JPEGLSLossless, RLELossless,
+)
+
+from implementation.dicom_services import transcoding
+from implementation.dicom_services.rendering import BytesCache
+from implementation.dicom_services.spool import SpooledInstance
+from implementation.dicom_services.transcoding import TransferSyntaxNotAcceptable
+
+PIXELS = (np.arange(16 * 16, dtype=np.uint16) * 7 % 4096).reshape(16, 16)
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, ExplicitVRLittleEndian),
+    ("*/*", ExplicitVRLittleEndian),
+    ('multipart/related; type="application/dicom"', ExplicitVRLittleEndian),
+    ('multipart/related; type="application/dicom"; transfer-syntax=*', None),
+    (f'multipart/related; type="application/dicom"; transfer-syntax={ImplicitVRLittleEndian}', ImplicitVRLittleEndian),
+    # Se elige por q y se salta lo que no se puede generar
+    (f'multipart/related; type="application/dicom"; transfer-syntax={JPEGBaseline8Bit}, '
+     f'multipart/related; type="application/dicom"; transfer-syntax={RLELossless}; q=0.5', RLELossless),
+    (f'application/dicom; transfer-syntax={ImplicitVRLittleEndian}; q=0.2, '
+     f'application/dicom; transfer-syntax={RLELossless}; q=0.9', RLELossless),
+])
+def test_negotiate(accept, expected):
+    assert transcoding.negotiate(accept) == expected
+
+
+def test_negotiate_without_any_supported_syntax():
+    with pytest.raises(TransferSyntaxNotAcceptable):
+        transcoding.negotiate(f'multipart/related; type="application/dicom"; transfer-syntax={JPEGBaseline8Bit}')
+
+
+def _instance(transfer_syntax=ExplicitVRLittleEndian, pixel_data: bytes = None) -> SpooledInstance:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = "1.2.3.7"
+    ds.Rows, ds.Columns = PIXELS.shape
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.PixelData = PIXELS.tobytes() if pixel_data is None else pixel_data
+    if pixel_data is not None:
+        ds["PixelData"].VR = "OB"
+    out = io.BytesIO()
+    dcmwrite(out, ds, enforce_file_format=True)
+    data = out.getvalue()
+    return SpooledInstance("1.2.3.7", CTImageStorage, "1.2", "1.2.3", transfer_syntax, len(data), data=data)
+
+
+@pytest.mark.parametrize("target", [ImplicitVRLittleEndian, RLELossless])
+def test_transcode_file_keeps_the_pixels(target):
+    data = transcoding.transcode_file(io.BytesIO(_instance().data), target)
+    ds = dcmread(io.BytesIO(data))
+    assert ds.file_meta.TransferSyntaxUID == target
+    assert np.array_equal(ds.pixel_array, PIXELS)
+
+
+def test_transcoded_instances_are_cached(monkeypatch):
+    monkeypatch.setattr(transcoding, "transcode_cache", BytesCache(1024 * 1024))
+
+    async def run():
+        first = await transcoding.transcode(_instance(), RLELossless)
+        second = await transcoding.transcode(_instance(), RLELossless)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.transfer_syntax == second.transfer_syntax == RLELossless
+    assert first.data == second.data
+    stats = transcoding.transcode_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_instance_without_decoder_is_sent_as_stored():
+    instance = _instance(JPEGLSLossless, encapsulate([b"\xff\xd8 no decodificable \xff\xd9"]))
+
+    async def run():
+        return await transcoding.transcode(instance, ExplicitVRLittleEndian)
+
+    result = asyncio.run(run())
+    assert result is instance and result.transfer_syntax == JPEGLSLossless
+
+
+def test_same_syntax_or_as_stored_is_not_transcoded():
+    instance = _instance()
+
+    async def run():
+        return (await transcoding.transcode(instance, ExplicitVRLittleEndian), await transcoding.transcode(instance, None))
+
+    assert asyncio.run(run()) == (instance, instance)